@@ -1,22 +1,42 @@
 from binance.client import Client
-from time import time, sleep
-from binance.websockets import BinanceSocketManager
+from time import time, perf_counter
+from collections import namedtuple
+from queue import Queue, Empty
+from json import dumps
 from datetime import datetime
 from strategy import Strategy
-from utils import Order, configure_logging, to_string
+from utils import Order, LatencyHistogram, LiveChart, configure_logging, enable_json_logs
 from uuid import uuid1
-from threading import Thread
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 from sys import exit
-from Interface import Interface
-from Models import Orders
+from journal import OrderJournal
+from candles import CandleBuffer
+from store import KlineStore
+from streams import FuturesSocketManager
+from account import AccountCache
+from rest import RateLimitedClient
+from supervisor import StreamSupervisor
+from protection import ProtectiveOrders
+from symbols import SymbolRegistry
+from execution import OrderExecutor
+from events import EventBus
+from orderbook import OrderBook
+from feed import FeedSubscriber
+from snapshot import StateSnapshot
+from recorder import TrafficRecorder, recorded, encode_state, KIND_CONFIG
+from metrics import REGISTRY, TraderMetrics, MetricsServer
+from config import DEFAULT_CONFIG, load_config
 try:
     from credentials import API_KEY, API_SECRET
 except ImportError:
     API_KEY = API_SECRET = None
-    exit("CAN'T RUN BOT WITHOUT API_KEY, API_SECRET FROM CREDENTIALS.PY")
 
 log_warns = configure_logging()
 
+KlineEvent = namedtuple('KlineEvent', ['type', 'ohlc', 'kline', 'received'])
+
 
 class BinanceTrader(Thread):
 
@@ -29,57 +49,271 @@ class BinanceTrader(Thread):
 
     KLINE_INTERVALS = ['1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d', '3d', '1w', '1M']
 
-    def __init__(self, symbol: str, interval: str, leverage: int, api_key: str, api_secret: str, ui, test: bool,
-                 tracker: float, *args, **kwargs):
+    EVENT_TICK = 'TICK'
+    EVENT_CLOSED = 'CLOSED'
+    EVENT_BACKFILL = 'BACKFILL'
+    KLINE_UPDATE_INTERVAL = 0.25
+
+    ORDER_REQUIRED_PARAMS = {
+        'LIMIT': ['quantity', 'price'],
+        'MARKET': ['quantity'],
+        'STOP': ['quantity', 'price', 'stopPrice'],
+        'TAKE_PROFIT': ['quantity', 'price', 'stopPrice'],
+        'STOP_MARKET': ['stopPrice'],
+        'TAKE_PROFIT_MARKET': ['stopPrice'],
+        'TRAILING_STOP_MARKET': ['callbackRate'],
+    }
+    BATCH_ORDERS_LIMIT = 5
+
+    def __init__(self, symbol: str, interval: str, leverage: int, api_key: str, api_secret: str, bus: EventBus,
+                 test: bool, tracker: float, client: Client = None, history: int = 500, account: AccountCache = None,
+                 journal: OrderJournal = None, supervisor: StreamSupervisor = None,
+                 protection: str = ProtectiveOrders.MODE_TRAILING, order_book: bool = True,
+                 max_slippage: float = 0.0005, chart: bool = False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.symbol = symbol
         self.interval = interval
         self.leverage = leverage
         self.tracker = tracker
-        self.balance = {}
+        self.account = account or AccountCache()
         self.ohlc = []
+        self.history = history
+        self.candles = CandleBuffer(capacity=max(history, 1000))
         self.long, self.short = False, False
-        self.time_offset = 500
         self.precision = None
-        self.ui = ui
+        self.info = None
+        self.bus = bus
         self.test = test
+        self.events = Queue()
+        self.order_latency = LatencyHistogram()
+        self.metrics = TraderMetrics(symbol=symbol, events=self.events)
 
-        self.orders = Orders
+        self.orders = journal or OrderJournal()
         self.api_key = api_key
         self.api_secret = api_secret
-        self.client = Client(self.api_key, self.api_secret)
-        self.socket_manager, self.kline_socket_key = None, None
+        self.client = client or RateLimitedClient(self.api_key, self.api_secret)
+        self.store = KlineStore(client=self.client)
+        self.symbols = SymbolRegistry(client=self.client)
+        self.supervisor = supervisor or StreamSupervisor(client=self.client)
+        self.strategy = None
+        self.strategy_state = None
+        self.executor = OrderExecutor(trader=self, daemon=True)
+        self.submitted = 0
+        self.protection = ProtectiveOrders(trader=self, mode=protection) if protection else None
+        self.book = OrderBook(symbol=symbol, client=self.client) if order_book else None
+        self.max_slippage = max_slippage
+        self.chart = LiveChart(symbol=symbol) if chart else None
+        self.socket_manager, self.kline_socket_key, self.user_socket_key = None, None, None
+        self.book_socket_keys = []
+        self.recorder = None
+
+    @property
+    def balance(self):
+        return self.account.balances
+
+    @property
+    def time_offset(self):
+        return getattr(self.client, 'time_offset', 0)
 
     def run(self):
-        self.get_exchange_info()
-        klines = self.get_klines(interval=self.interval)
-        self.get_account_balance()
-        strategy = Strategy(klines=klines, symbol=self.symbol, leverage=self.leverage, quantity=self.get_quantity)
+        self.prepare()
+        if not self.orders.is_alive():
+            self.orders.start()
+        self.executor.start()
         self.start_kline_stream()
-        sleep(5)
+        self.supervisor.start()
         while True:
-            sleep(0.25)
-            time_check = strategy.timer()
-            if time_check:
-                self.ui.main_window.write_event_value(
-                    key="Klines",
-                    value=f"Time: {datetime.utcnow()} - Close: {self.ohlc[4]} - High: {self.ohlc[2]} - "
-                          f"Low: {self.ohlc[3]}"
-                )
-                sleep(2)
-                signals = strategy.check(on_long=self.long, on_short=self.short, ohlc=self.ohlc)
-                if signals:
-                    for signal in signals:
-                        self.place_order(order=signal, test=self.test)
-            sl = strategy.stoploss(ohlc=self.ohlc, on_long=self.long, on_short=self.short, tracker=self.tracker)
-            if sl:
-                self.place_order(order=sl, test=self.test)
+            self.process_event(event=self.next_event())
+
+    def prepare(self, state: dict = None, klines: list = None):
+        """
+        Loads symbol info, klines and balance and sets up strategy. State of a previous run is used when
+        no candle closed since it was taken: candles, strategy state and protective order come from it
+
+        :param state: dict from state()
+        :param klines: klines to start from instead of the synced store, e.g. recorded ones on replay
+        :return: list of klines the strategy started from
+        """
+        self.get_exchange_info()
+        if klines is None:
+            self.store.sync(symbol=self.symbol, interval=self.interval, history=self.history)
+            klines = self.store.history(symbol=self.symbol, interval=self.interval, limit=self.history)
+        warm = self.is_current(state=state, klines=klines)
+        if warm:
+            self.candles.seed(klines=state['candles'])
+            self.candles.closed = state['closed']
+            for kline in klines[-2:]:
+                if kline[0] >= self.candles.last()['time']:
+                    self.candles.update(kline=dict(zip('tohlcv', kline[:6]), x=kline[6] < time() * 1000))
+        else:
+            self.candles.seed(klines=klines)
+        if not self.account.ready:
+            self.load_account()
+        self.strategy = Strategy(klines=klines, symbol=self.symbol, leverage=self.leverage,
+                                 quantity=self.get_quantity)
+        self.strategy.candles = self.candles
+        if warm and state['strategy'] is not None and hasattr(self.strategy, 'set_state'):
+            self.strategy.set_state(state['strategy'])
+        self.checkpoint()
+        if self.chart:
+            self.chart.append(klines=klines)
+            self.update_chart()
+        amount = self.sync_position(previous=state)
+        if self.protection:
+            if warm:
+                self.protection.restore(state=state['protection'], amount=amount)
+            else:
+                self.protection.adopt()
+            self.protection.reconcile()
+        return klines
+
+    def is_current(self, state: dict, klines: list):
+        """
+        :param klines: stored klines, the last one may be forming
+        :return: True if state candles reach the stored ones and no candle closed since the snapshot, the strategy
+                 would miss its check otherwise
+        """
+        if not state or state['interval'] != self.interval or not len(state['candles']):
+            return False
+        last = state['candles'][-1][0]
+        if len(klines) > 1 and klines[-2][0] > last:
+            return False
+        unchecked = [kline for kline in klines[-2:] if kline[0] > last or kline[0] == last and not state['closed']]
+        return all(kline[6] >= time() * 1000 for kline in unchecked)
+
+    def state(self):
+        """
+        Trader part of engine snapshot, strategy state is the one taken after the last closed candle
+        """
+        return dict(symbol=self.symbol, interval=self.interval, long=self.long, short=self.short,
+                    candles=self.candles.tail(), closed=self.candles.closed, strategy=self.strategy_state,
+                    protection=self.protection.state() if self.protection else None)
+
+    def checkpoint(self):
+        """
+        Keeps strategy state for snapshots if strategy implements get_state and set_state
+        """
+        if hasattr(self.strategy, 'get_state'):
+            self.strategy_state = self.strategy.get_state()
+
+    def sync_position(self, previous: dict = None):
+        """
+        Sets position flags from the account position, so a restarted bot continues the position it holds
+
+        :param previous: state of the previous run, its flags are kept if position is unknown
+        :return: float position amount
+        """
+        positions = self.positions()
+        if isinstance(positions, dict):
+            if previous:
+                self.long, self.short = previous['long'], previous['short']
+            return None
+        amount = sum(float(position['positionAmt']) for position in positions if position['symbol'] == self.symbol)
+        self.long, self.short = amount > 0, amount < 0
+        if previous and (previous['long'], previous['short']) != (self.long, self.short):
+            log_warns.warning('%s position changed while bot was stopped, long: %s, short: %s', self.symbol,
+                              self.long, self.short)
+        return amount
+
+    def process_event(self, event):
+        """
+        Runs strategy checks for one kline event
+
+        :param event: KlineEvent
+        """
+        if event.type == self.EVENT_BACKFILL:
+            if not self.candles.size or event.kline['t'] >= self.candles.last()['time']:
+                self.candles.update(kline=event.kline)
+            return
+        self.candles.update(kline=event.kline)
+        if event.type == self.EVENT_CLOSED:
+            self.bus.publish(
+                key="Klines",
+                value=f"{self.symbol} - Time: {datetime.utcnow()} - Close: {event.ohlc[4]} - "
+                      f"High: {event.ohlc[2]} - Low: {event.ohlc[3]}",
+                topic=self.symbol,
+            )
+            started = perf_counter()
+            signals = self.strategy.check(on_long=self.long, on_short=self.short, ohlc=event.ohlc)
+            self.metrics.check_seconds.observe(perf_counter() - started)
+            if signals:
+                self.metrics.signal_age.observe(perf_counter() - event.received)
+                self.submit_orders(orders=signals, received=event.received)
+            self.checkpoint()
+            kline = event.kline
+            self.store.save(symbol=self.symbol, interval=self.interval, klines=[[
+                kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v'], kline['T'], kline['q'],
+                kline['n'], kline['V'], kline['Q'],
+            ]])
+            if self.chart:
+                self.chart.append(klines=[[kline['t'], kline['o'], kline['h'], kline['l'], kline['c']]])
+                self.update_chart()
+        if self.protection:
+            self.protection.supervise()
+            return
+        started = perf_counter()
+        sl = self.strategy.stoploss(ohlc=event.ohlc, on_long=self.long, on_short=self.short, tracker=self.tracker)
+        self.metrics.stoploss_seconds.observe(perf_counter() - started)
+        if sl:
+            self.submit_orders(orders=[sl], received=event.received)
+
+    def update_chart(self):
+        try:
+            page = self.chart.write()
+        except OSError as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        return page
+
+    def submit_orders(self, orders: list, received: float = None):
+        """
+        Hands orders to the executor thread, position flags are switched right away so following checks
+        see the expected position
+        """
+        previous = self.long, self.short
+        self.long, self.short = orders[-1].long, orders[-1].short
+        self.submitted += 1
+        self.executor.submit(orders=orders, received=received, previous=previous, submission=self.submitted,
+                             test=self.test)
+
+    def next_event(self):
+        """
+        Blocks until kline data arrives. Queued ticks are collapsed into the newest one,
+        closed candle events are never skipped
+
+        :rtype: KlineEvent
+        """
+        event = self.events.get()
+        while event.type == self.EVENT_TICK:
+            try:
+                event = self.events.get_nowait()
+            except Empty:
+                break
+        return event
+
+    @property
+    def stream_name(self):
+        return f"{self.symbol.lower()}@kline_{self.interval}"
 
     def start_kline_stream(self):
         try:
-            self.socket_manager = BinanceSocketManager(client=self.client, user_timeout=60)
-            self.kline_socket_key = self.socket_manager.start_kline_socket(symbol=self.symbol, interval=self.interval,
-                                                                           callback=self.callback)
+            self.socket_manager = FuturesSocketManager(client=self.client, user_timeout=60)
+            self.kline_socket_key = self.socket_manager.start_futures_kline_socket(
+                symbol=self.symbol, interval=self.interval, callback=self.callback)
+            self.user_socket_key = self.socket_manager.start_futures_user_socket(callback=self.user_data_callback)
+            self.supervisor.watch(
+                name=self.stream_name,
+                expected_interval=self.KLINE_UPDATE_INTERVAL,
+                restart=lambda: self.restart_stream(manager=self.socket_manager, socket_key=self.kline_socket_key),
+                backfill=self.backfill,
+            )
+            self.supervisor.watch(name='user')
+            if self.book:
+                self.book_socket_keys = [
+                    self.socket_manager.start_futures_socket(self.book.depth_stream, self.depth_callback),
+                    self.socket_manager.start_futures_socket(self.book.trade_stream, self.trade_callback),
+                ]
+                self.supervisor.watch(name=self.book.depth_stream)
             if self.kline_socket_key:
                 self.socket_manager.start()
             else:
@@ -94,8 +328,23 @@ class BinanceTrader(Thread):
         except Exception as exc:
             log_warns.exception(exc)
         if socket_key == self.kline_socket_key:
-            self.kline_socket_key = self.socket_manager.start_kline_socket(symbol=self.symbol, interval=self.interval,
-                                                                           callback=self.callback)
+            self.kline_socket_key = self.socket_manager.start_futures_kline_socket(
+                symbol=self.symbol, interval=self.interval, callback=self.callback)
+        elif socket_key == self.user_socket_key:
+            self.user_socket_key = self.socket_manager.start_futures_user_socket(callback=self.user_data_callback)
+
+    def backfill(self):
+        """
+        Downloads klines missed while the kline stream was down and queues them for the candle buffer
+        """
+        self.store.sync(symbol=self.symbol, interval=self.interval, history=self.history)
+        start = int(self.candles.last()['time']) if self.candles.size else None
+        klines = self.store.history(symbol=self.symbol, interval=self.interval, start=start,
+                                    limit=None if start else self.history)
+        now = int(time() * 1000) + self.time_offset
+        for kline in klines:
+            self.events.put(KlineEvent(type=self.EVENT_BACKFILL, ohlc=kline[:5],
+                                       kline=dict(zip('tohlcv', kline[:6]), x=kline[6] < now), received=perf_counter()))
 
     def check_order(self, order: Order):
         try:
@@ -130,23 +379,17 @@ class BinanceTrader(Thread):
 
     def get_exchange_info(self):
         """
-        Gets all symbols exchange info and returns minimum price change value, sets up precision for price and qty
+        Loads symbol filters from shared registry, sets up precision for price and qty
 
-        :return: Decimal
+        :return: str minimum price change value
         """
-        ticksize = None
         try:
-            data = self.client.futures_exchange_info()
+            self.info = self.symbols.get(self.symbol)
         except Exception as exc:
             log_warns.exception(exc)
             return {'msg': exc}
-        for symbol in data['symbols']:
-            if symbol['symbol'] == self.symbol:
-                self.precision = [symbol['pricePrecision'], symbol['quantityPrecision']]
-                for filter_ in symbol['filters']:
-                    if filter_['filterType'] == 'PRICE_FILTER':
-                        ticksize = filter_['tickSize']
-        return ticksize
+        self.precision = [self.info.price_precision, self.info.quantity_precision]
+        return self.info.tick_size
 
     def get_account_information(self):
         """
@@ -160,13 +403,13 @@ class BinanceTrader(Thread):
         except Exception as exc:
             log_warns.exception(exc)
             return {'msg': exc}
+        self.account.load_info(info=info)
         sorted_info = {}
         for key, value in info.items():
             if key == 'assets':
                 for asset in info[key]:
                     if float(asset['walletBalance']) > 0:
                         sorted_info[asset['asset']] = asset
-                        self.balance[asset['asset']] = asset['walletBalance']
             elif key == 'positions':
                 for pos in info[key]:
                     if float(pos['positionAmt']) > 0 or float(pos['positionAmt']) < 0:
@@ -190,9 +433,25 @@ class BinanceTrader(Thread):
             return {'msg': exc}
         for asset in balance:
             account_balance[asset['asset']] = asset['balance']
-        self.balance = account_balance
+        self.account.update_balances(balances=account_balance)
         return balance
 
+    def load_account(self):
+        """
+        Fills account cache with balances and positions of every symbol, user data stream keeps it up to date
+        """
+        try:
+            balance = self.client.futures_account_balance(timestamp=int(round(time()) * 1000) + self.time_offset,
+                                                          recvWindow=5000)
+            positions = self.client.futures_position_information(
+                timestamp=int(round(time()) * 1000) + self.time_offset,
+                recvWindow=5000
+            )
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        self.account.load(balance=balance, positions=positions)
+
     def get_position(self):
         """
         Gets position for self.symbol
@@ -210,6 +469,16 @@ class BinanceTrader(Thread):
             return {'msg': exc}
         return positions
 
+    def positions(self):
+        """
+        Positions for self.symbol from account cache, falls back to REST until cache is loaded
+
+        :rtype: list
+        """
+        if self.account.ready:
+            return self.account.positions(symbol=self.symbol)
+        return self.get_position()
+
     def get_quantity(self, leverage: int, open_position: bool = True):
         """
         Counts quantity using required leverage and account balance
@@ -221,18 +490,21 @@ class BinanceTrader(Thread):
         quantity = 0.0
         if self.ohlc:
             if open_position:
-                self.get_account_balance()
+                if not self.account.ready:
+                    self.get_account_balance()
                 main_asset = float(self.balance["USDT"])
-                close = float(self.ohlc[4])
+                close = self.book.mid_price() if self.book else None
+                if close is None:
+                    close = self.candles.last()['close'] if self.candles.size else float(self.ohlc[4])
                 quantity = (leverage + 1) * main_asset / close
             else:
-                positions = self.get_position()
+                positions = self.positions()
                 for position in positions:
                     if position["symbol"] == self.symbol:
                         quantity = abs(float(position["positionAmt"]))
         return quantity
 
-    def place_order(self, order: Order, **kwargs):
+    def place_order(self, order: Order, received: float = None, **kwargs):
         """
         Places an order with mandatory parameters:
         symbol str: trading symbol
@@ -243,6 +515,16 @@ class BinanceTrader(Thread):
                     STOP/TAKE_PROFIT	           | quantity, price, stopPrice
                     STOP_MARKET/TAKE_PROFIT_MARKET | stopPrice
                     TRAILING_STOP_MARKET	       | callbackRate
+
+        received float: perf_counter() of the websocket message that triggered the order, used for latency stats
+        """
+        return self.place_orders(orders=[order], received=received, **kwargs)
+
+    def build_params(self, order: Order, **kwargs):
+        """
+        Sets order id, rounds prices to tick size and quantity to step size
+
+        :return: error message if order misses mandatory parameters or breaks symbol filters, None otherwise
         """
         order.id, order.db = str(uuid1()), self.orders
 
@@ -253,34 +535,111 @@ class BinanceTrader(Thread):
             timestamp=int(round(time()) * 1000) + self.time_offset,
             newClientOrderId=order.id,
         )
-        if type == 'LIMIT':
-            params['timeInForce'] = 'GTC'
-        additional = ['price', 'stopPrice', 'activationPrice', 'quantity']
-        for param, value in params.items():
-            if param in additional:
-                if param == 'quantity':
-                    precision = self.precision[1]
-                else:
-                    precision = self.precision[0]
-                params[param] = to_string(value=value, precision=precision)
+        self.choose_order_type(params=params)
+        if params.get('type') == 'LIMIT':
+            params.setdefault('timeInForce', 'GTC')
+        for param in ('price', 'stopPrice', 'activationPrice'):
+            if param in params:
+                params[param] = self.info.format_price(params[param])
+        if 'quantity' in params:
+            params['quantity'] = self.info.format_quantity(params['quantity'])
         order.params = params
         order.time = datetime.utcnow()
 
-        self.ui.main_window.write_event_value(key="Order", value=f"Placing order with params: {params}")
-        try:
-            self.client.futures_create_order(**params)
-        except Exception as exc:
-            log_warns.exception(exc)
-            order.failed = True
-            order.to_db()
-            self.ui.main_window.write_event_value(key="Order", value=f"Failed placing order {order.id}")
-            return {'msg': exc}
+        if params.get('type') not in self.ORDER_REQUIRED_PARAMS:
+            return f"Unknown order type {params.get('type')}"
+        for param in self.ORDER_REQUIRED_PARAMS[params['type']]:
+            if param == 'quantity' and params.get('closePosition') in (True, 'true'):
+                continue
+            if param not in params or float(params[param]) <= 0:
+                return f"Missing or zero {param}"
+        return self.info.check(params=params, price=self.candles.last()['close'] if self.candles.size else None)
+
+    def choose_order_type(self, params: dict):
+        """
+        Turns MARKET order into IOC LIMIT at max_slippage from the best price when the local order book
+        expects the order to fill worse than that, the part that does not fill at once is canceled instead of
+        resting in the book. Reduce only orders stay MARKET
+        """
+        if params.get('type') != 'MARKET' or self.book is None or params.get('reduceOnly') in (True, 'true'):
+            return
+        price, slippage = self.book.estimate(side=params['side'], quantity=float(params['quantity']))
+        if slippage is None:
+            return
+        self.metrics.expected_slippage.observe(slippage)
+        if slippage <= self.max_slippage:
+            return
+        bid, ask = self.book.best_prices()
+        limit = ask * (1 + self.max_slippage) if params['side'] == 'BUY' else bid * (1 - self.max_slippage)
+        params.update(type='LIMIT', price=limit, timeInForce='IOC')
+        self.bus.publish(key="Order", value=f"{self.symbol} expected fill {price} slips {slippage:.4%}, "
+                                            f"placing LIMIT at {limit} instead of MARKET")
+
+    def place_orders(self, orders: list, received: float = None, previous: tuple = None, submission: int = None,
+                     **kwargs):
+        """
+        Places orders with one futures_create_order call for a single order and batchOrders requests
+        of up to BATCH_ORDERS_LIMIT orders otherwise. Orders are saved to db after submission
+
+        :param previous: (long, short) flags to keep if every order fails, flags are left as is if None
+        :param submission: number from submit_orders, flags are only set if no later orders were submitted
+                           since, those already switched them
+        """
+        started = perf_counter()
+        flags, valid = previous, []
+        for order in orders:
+            error = self.build_params(order=order, **kwargs)
+            if error:
+                self.order_failed(order=order, error=error)
+            else:
+                valid.append(order)
+        for start in range(0, len(valid), self.BATCH_ORDERS_LIMIT):
+            batch = valid[start:start + self.BATCH_ORDERS_LIMIT]
+            for order in batch:
+                self.bus.publish(key="Order", value=f"Placing order with params: {order.params}")
+            try:
+                if len(batch) == 1:
+                    responses = [self.client.futures_create_order(**batch[0].params)]
+                else:
+                    responses = self.client._request_futures_api('post', 'batchOrders', True, data=dict(
+                        batchOrders=dumps([self.batch_params(order=order) for order in batch]),
+                        recvWindow=5000,
+                        timestamp=int(round(time()) * 1000) + self.time_offset,
+                    ))
+            except Exception as exc:
+                log_warns.exception(exc)
+                responses = [{'code': None, 'msg': exc}] * len(batch)
+            if received is not None:
+                self.order_latency.observe(perf_counter() - received)
+            for order, response in zip(batch, responses):
+                if 'code' in response:
+                    self.order_failed(order=order, error=response['msg'])
+                else:
+                    flags = order.long, order.short
+                    self.metrics.placed.inc()
+                    order.to_db()
+        if flags is not None and (submission is None or submission == self.submitted):
+            self.long, self.short = flags
+        self.metrics.place_seconds.observe(perf_counter() - started)
+
+    @staticmethod
+    def batch_params(order: Order):
+        params = {}
+        for param, value in order.params.items():
+            if param in ('recvWindow', 'timestamp'):
+                continue
+            params[param] = str(value).lower() if isinstance(value, bool) else str(value)
+        return params
 
-        self.long, self.short = order.long, order.short
+    def order_failed(self, order: Order, error):
+        log_warns.warning('Order %s failed: %s', order.id, error, extra=dict(symbol=self.symbol, order_id=order.id))
+        self.metrics.failed.inc()
+        order.failed = True
         order.to_db()
+        self.bus.publish(key="Order", value=f"Failed placing order {order.id}: {error}")
 
     def close_positions(self):
-        positions = self.get_position()
+        positions = self.positions()
         for position in positions:
             pos_quantity = float(position["positionAmt"])
             if pos_quantity > 0:
@@ -317,48 +676,373 @@ class BinanceTrader(Thread):
 
     def order_update(self, response):
         """
-        Updates order using self.user_data_stream (executionReport event) response
+        Updates order using futures user data stream ORDER_TRADE_UPDATE order info with 'C' set to client order id
         """
+        status = response['X']
+        if status == self.ORDER_STATUS_NEW:
+            return
         try:
-            order = self.orders.get(self.orders.id == response['C'])
+            if status in (self.ORDER_STATUS_FILLED, self.ORDER_STATUS_PARTIALLY_FILLED, self.ORDER_STATUS_REJECTED):
+                self.orders.update(response['C'], params=response, status=status)
+            elif status in (self.ORDER_STATUS_CANCELED, self.ORDER_STATUS_EXPIRED):
+                self.orders.delete(response['C'])
+            if self.protection:
+                self.protection.on_order_update(response=response)
         except Exception as exc:
             log_warns.exception(exc)
             return {'msg': exc}
-        if response['X'] == self.ORDER_STATUS_NEW:
-            return
-        else:
-            order.status = response['X']
-        if order.status == self.ORDER_STATUS_FILLED or order.status == self.ORDER_STATUS_PARTIALLY_FILLED:
-            order.update(params=response, status=order.status)
-        elif order.status == self.ORDER_STATUS_REJECTED:
-            order.update(params=response, status=order.status)
-        elif order.status == self.ORDER_STATUS_CANCELED or order.status == self.ORDER_STATUS_EXPIRED:
-            order.delete()
 
+    @recorded
     def callback(self, msg):
         """
-        Handles messages from kline/candlestick websocket
+        Handles messages from kline/candlestick websocket, queues closed candle event when kline is final
+        and tick event otherwise
         """
+        received = perf_counter()
+        if msg.get('e') == 'error':
+            log_warns.warning('Kline stream error: %s', msg.get('m'))
+            return
+        self.supervisor.beat(name=self.stream_name, event_time=msg.get('E'))
+        self.metrics.kline_messages.inc()
         kline_info = msg['k']
         self.ohlc = [kline_info['t'], kline_info['o'], kline_info['h'], kline_info['l'], kline_info['c']]
+        event_type = self.EVENT_CLOSED if kline_info['x'] else self.EVENT_TICK
+        self.events.put(KlineEvent(type=event_type, ohlc=self.ohlc, kline=kline_info, received=received))
+        self.metrics.callback_seconds.observe(perf_counter() - received)
+
+    @recorded
+    def depth_callback(self, msg):
+        """
+        Handles messages from diff depth stream
+        """
+        if msg.get('e') == 'error':
+            log_warns.warning('Depth stream error: %s', msg.get('m'))
+            return
+        self.supervisor.beat(name=self.book.depth_stream, event_time=msg.get('E'))
+        self.book.on_depth(msg=msg)
 
+    @recorded
+    def trade_callback(self, msg):
+        """
+        Handles messages from aggregate trade stream
+        """
+        if msg.get('e') == 'aggTrade':
+            self.book.on_trade(msg=msg)
 
-def main():
-    symbol, interval, leverage, tracker, test = 'BTCUSDT', '5m', 7, 0.005, False
-    ui = Interface()
-    ui.start_window()
-    bot = BinanceTrader(
-        symbol=symbol,
-        interval=interval,
-        leverage=leverage,
-        tracker=tracker,
-        test=test,
-        api_key=API_KEY,
-        api_secret=API_SECRET,
-        ui=ui,
+    @recorded
+    def user_data_callback(self, msg):
+        """
+        Handles messages from futures user data stream
+        """
+        self.supervisor.beat(name='user', event_time=msg.get('E'))
+        event = msg.get('e')
+        if event == 'ORDER_TRADE_UPDATE':
+            self.order_update(response=dict(msg['o'], C=msg['o']['c']))
+        elif event == 'ACCOUNT_UPDATE':
+            self.account.apply(update=msg['a'])
+            if self.protection and any(position['s'] == self.symbol for position in msg['a'].get('P', [])):
+                self.protection.reconcile()
+        elif event == 'listenKeyExpired':
+            self.restart_stream(manager=self.socket_manager, socket_key=self.user_socket_key)
+        elif event == 'error':
+            log_warns.warning('User data stream error: %s', msg.get('m'))
+
+
+class TradingEngine(Thread):
+
+    def __init__(self, configs: list, api_key: str, api_secret: str, bus: EventBus, test: bool, max_workers: int = 4,
+                 feed: str = None, snapshot: str = None, record: str = None, client: Client = None, *args,
+                 **kwargs):
+        """
+        Trades several symbols over one client and one combined kline stream
+
+        :param configs: list(dict(symbol=str, interval=str, leverage=int, tracker=float), ..)
+        :param max_workers: size of the pool evaluating strategies, one symbol occupies at most one worker
+        :param feed: shared memory name of a kline ring filled by feed.py, klines are read from it
+                     instead of the websocket
+        :param snapshot: file for periodic state snapshots, state of the previous run is loaded from it
+        :param record: file websocket messages and REST traffic are appended to, see recorder.py for replay
+        :param client: client used instead of a RateLimitedClient, e.g. ReplayClient
+        """
+        super().__init__(*args, **kwargs)
+        self.bus = bus
+        self.test = test
+        self.orders = OrderJournal()
+        self.order_latency = LatencyHistogram()
+        self.snapshot = StateSnapshot(engine=self, path=snapshot) if snapshot else None
+        self.state = self.snapshot.load() if self.snapshot else None
+        self.recorder = TrafficRecorder(path=record) if record else None
+        if self.recorder:
+            self.recorder.record(kind=KIND_CONFIG, name='engine', payload=dict(symbols=configs, test=test))
+            self.recorder.start()
+        self.client = client or RateLimitedClient(api_key, api_secret, recorder=self.recorder,
+                                                  time_offset=self.state['time_offset'] if self.state else None)
+        self.account = AccountCache()
+        self.supervisor = StreamSupervisor(client=self.client)
+        self.traders = {}
+        for config in configs:
+            trader = BinanceTrader(api_key=api_key, api_secret=api_secret, bus=bus, test=test, client=self.client,
+                                   account=self.account, journal=self.orders, supervisor=self.supervisor, daemon=True,
+                                   **config)
+            trader.order_latency = self.order_latency
+            self.traders[trader.stream_name] = trader
+        self.symbols = {trader.symbol: trader for trader in self.traders.values()}
+        self.book_streams = {}
+        for trader in self.traders.values():
+            if trader.book:
+                self.book_streams[trader.book.depth_stream] = trader.depth_callback
+                self.book_streams[trader.book.trade_stream] = trader.trade_callback
+        self.feed = FeedSubscriber(name=feed, streams=list(self.traders), callback=self.feed_callback) if feed else None
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='strategy')
+        self.socket_manager, self.multiplex_socket_key, self.user_socket_key = None, None, None
+        self._scheduled = set()
+        self._lock = Lock()
+
+    @property
+    def balance(self):
+        return self.account.balances
+
+    def run(self):
+        self.prepare()
+        self.start_multiplex_stream()
+        self.supervisor.start()
+        if self.snapshot:
+            self.snapshot.start()
+
+    def prepare(self, startup: dict = None):
+        """
+        Prepares traders and starts order writing and execution, streams are not started. With a recorder
+        the klines and snapshot state traders started from are recorded, so replay does not depend on the store
+
+        :param startup: recorded dict(time=float, state=dict, klines=dict(stream=list)), traders start from it
+                        instead of the store and snapshot
+        """
+        started = time()
+        self.load_account()
+        if startup is not None:
+            self.state = startup['state']
+        stored = startup['klines'] if startup is not None else {}
+        states = self.state['traders'] if self.state else {}
+        klines = list(self.pool.map(lambda trader: trader.prepare(state=states.get(trader.stream_name),
+                                                                  klines=stored.get(trader.stream_name)),
+                                    self.traders.values()))
+        if self.recorder:
+            self.recorder.record(kind=KIND_CONFIG, name='startup',
+                                 payload=dict(time=started, state=encode_state(self.state),
+                                              klines=dict(zip(self.traders, klines))))
+        self.orders.start()
+        for trader in self.traders.values():
+            trader.executor.start()
+
+    def load_account(self):
+        """
+        Fills account cache with balances and positions of every symbol in one request
+        """
+        try:
+            info = self.client.futures_account(timestamp=int(round(time()) * 1000) + self.client.time_offset,
+                                               recvWindow=5000)
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        self.account.load_info(info=info)
+
+    def start_multiplex_stream(self):
+        try:
+            self.socket_manager = FuturesSocketManager(client=self.client, user_timeout=60)
+            if self.streams:
+                self.multiplex_socket_key = self.socket_manager.start_futures_multiplex_socket(
+                    streams=self.streams, callback=self.callback)
+                if not self.multiplex_socket_key:
+                    raise ConnectionError(f"Multiplex key is missing: {self.multiplex_socket_key}")
+                self.supervisor.watch(
+                    name='multiplex',
+                    expected_interval=BinanceTrader.KLINE_UPDATE_INTERVAL,
+                    restart=lambda: self.restart_stream(manager=self.socket_manager,
+                                                        socket_key=self.multiplex_socket_key),
+                    backfill=None if self.feed else self.backfill,
+                )
+            if self.feed:
+                self.supervisor.watch(name='feed', expected_interval=BinanceTrader.KLINE_UPDATE_INTERVAL,
+                                      restart=self.feed.reattach, backfill=self.backfill)
+                self.feed.start()
+            self.user_socket_key = self.socket_manager.start_futures_user_socket(callback=self.user_data_callback)
+            for name in list(self.traders) + list(self.book_streams):
+                self.supervisor.watch(name=name)
+            self.supervisor.watch(name='user')
+            self.socket_manager.start()
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+
+    def restart_stream(self, manager, socket_key):
+        try:
+            manager.stop_socket(conn_key=socket_key)
+        except Exception as exc:
+            log_warns.exception(exc)
+        if socket_key == self.multiplex_socket_key:
+            self.multiplex_socket_key = self.socket_manager.start_futures_multiplex_socket(streams=self.streams,
+                                                                                           callback=self.callback)
+        elif socket_key == self.user_socket_key:
+            self.user_socket_key = self.socket_manager.start_futures_user_socket(callback=self.user_data_callback)
+
+    @property
+    def streams(self):
+        """
+        Streams of the combined socket, kline streams come from the feed when it is used
+        """
+        return ([] if self.feed else list(self.traders)) + list(self.book_streams)
+
+    def backfill(self):
+        for trader in self.traders.values():
+            trader.backfill()
+            self.schedule(trader)
+
+    @recorded
+    def callback(self, msg):
+        """
+        Routes combined stream messages {"stream": name, "data": payload} to the trader of the stream
+        """
+        self.supervisor.beat(name='multiplex')
+        handler = self.book_streams.get(msg.get('stream'))
+        if handler is not None:
+            handler(msg['data'])
+            return
+        trader = self.traders.get(msg.get('stream'))
+        if trader is None:
+            log_warns.warning('Unrouted multiplex message: %s', msg)
+            return
+        trader.callback(msg['data'])
+        self.schedule(trader)
+
+    @recorded
+    def feed_callback(self, msg):
+        """
+        Routes kline messages of the shared feed to the trader of the stream
+        """
+        self.supervisor.beat(name='feed')
+        trader = self.traders[msg['stream']]
+        trader.callback(msg['data'])
+        self.schedule(trader)
+
+    @recorded
+    def user_data_callback(self, msg):
+        """
+        Routes order updates to the trader of the symbol, account updates go to the shared account cache
+        """
+        self.supervisor.beat(name='user', event_time=msg.get('E'))
+        if msg.get('e') == 'ORDER_TRADE_UPDATE':
+            trader = self.symbols.get(msg['o']['s'])
+            if trader is not None:
+                trader.order_update(response=dict(msg['o'], C=msg['o']['c']))
+        elif msg.get('e') == 'ACCOUNT_UPDATE':
+            self.account.apply(update=msg['a'])
+            for position in msg['a'].get('P', []):
+                trader = self.symbols.get(position['s'])
+                if trader is not None and trader.protection:
+                    trader.protection.reconcile()
+        elif msg.get('e') == 'listenKeyExpired':
+            self.restart_stream(manager=self.socket_manager, socket_key=self.user_socket_key)
+        elif msg.get('e') == 'error':
+            log_warns.warning('User data stream error: %s', msg.get('m'))
+
+    def schedule(self, trader: BinanceTrader):
+        with self._lock:
+            if trader in self._scheduled:
+                return
+            self._scheduled.add(trader)
+        self.pool.submit(self.evaluate, trader)
+
+    def evaluate(self, trader: BinanceTrader):
+        """
+        Processes queued events of one trader, events of a symbol are never processed concurrently
+        """
+        while True:
+            with self._lock:
+                if trader.events.empty():
+                    self._scheduled.discard(trader)
+                    return
+            try:
+                trader.process_event(event=trader.next_event())
+            except Exception as exc:
+                log_warns.exception(exc)
+
+    def get_account_information(self):
+        return next(iter(self.traders.values())).get_account_information()
+
+    def close_positions(self):
+        for trader in self.traders.values():
+            trader.close_positions()
+
+
+def run_headless(bot):
+    """
+    Runs bot without GUI, published events are printed to stdout until interrupted
+    """
+    bot.start()
+    try:
+        while True:
+            for key, value in bot.bus.wait(timeout=1):
+                print(f"{key}: {value}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        from twisted.internet import reactor
+        if bot.socket_manager is not None:
+            bot.socket_manager.close()
+        bot.orders.close()
+        if reactor.running:
+            reactor.callFromThread(reactor.stop)
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Binance futures trading bot')
+    parser.add_argument('--config', help='TOML or YAML file with symbols to trade, see config.example.toml')
+    parser.add_argument('--headless', action='store_true', help='run without GUI, events are printed to stdout')
+    parser.add_argument('--test', action='store_true', help='send orders with test flag')
+    parser.add_argument('--metrics-port', type=int, help='serve /metrics and /profile on this local port')
+    parser.add_argument('--mock', nargs='?', const='127.0.0.1:8080:8081', metavar='HOST:PORT:WS_PORT',
+                        help='trade against a running mock_exchange.py with placeholder keys, orders and klines '
+                             'go to mock_orders.db, 127.0.0.1:8080:8081 by default')
+    args = parser.parse_args(args)
+    config = load_config(args.config) if args.config else dict(DEFAULT_CONFIG)
+    if config['json_logs']:
+        enable_json_logs()
+
+    api_key, api_secret = API_KEY, API_SECRET
+    if args.mock:
+        from mock_exchange import use_mock_exchange
+        host, port, ws_port = args.mock.split(':')
+        use_mock_exchange(host=host, port=int(port), ws_port=int(ws_port))
+        api_key, api_secret = 'mock', 'mock'
+        if config['snapshot']:
+            config['snapshot'] = f"mock_{config['snapshot']}"
+    elif API_KEY is None or API_SECRET is None:
+        exit("CAN'T RUN BOT WITHOUT API_KEY, API_SECRET FROM CREDENTIALS.PY")
+    bus = EventBus()
+    REGISTRY.gauge('bot_bus_dropped_events', 'Events dropped by full event bus').labels().set_function(
+        lambda: bus.dropped)
+    metrics_port = args.metrics_port if args.metrics_port is not None else config['metrics_port']
+    if metrics_port:
+        MetricsServer(port=metrics_port).start()
+    engine = TradingEngine(
+        configs=config['symbols'],
+        test=args.test or config['test'],
+        api_key=api_key,
+        api_secret=api_secret,
+        bus=bus,
+        max_workers=config['max_workers'],
+        feed=config['feed'] or None,
+        snapshot=config['snapshot'] or None,
+        record=config['record'] or None,
         daemon=True
     )
-    ui.run(bot=bot)
+    if args.headless or config['headless']:
+        run_headless(bot=engine)
+        return
+    from Interface import Interface
+    ui = Interface()
+    ui.start_window()
+    ui.run(bot=engine)
 
 
 if __name__ == '__main__':
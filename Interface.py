@@ -1,27 +1,50 @@
+from threading import Thread
 import PySimpleGUI as sg
 from twisted.internet import reactor
+from analytics import TradeAnalytics, format_summary
+from metrics import SamplingProfiler
+from utils import configure_logging
+
+log_warns = configure_logging()
 
 
 class Interface:
 
+    PAGE_SIZE = 20
+    EVENTS_PER_READ = 50
+    READ_TIMEOUT = 100
+    PROFILE_PATH = 'profile.folded'
+
     def __init__(self):
         self.title = 'Binance Futures Bot'
         self.theme = 'DarkAmber'
         self.options = {
             "Stop": "Close all connections and terminate bot",
-            "Orders": "Show trade orders and their parameters",
+            "Orders": "Show latest trade orders, then the ones placed since last press",
+            "Older orders": "Show previous page of trade orders",
             "Balance": "Show amount of every asset on account",
             "Account info": "Show all information about account (uses request weight)",
+            "Latency": "Show time from kline message to placed order",
+            "Streams": "Show message rate, lag and reconnects of websocket streams",
+            "Profile": "Start sampling threads, press again to save flame graph stacks",
+            "Stats": "Show pnl, win rate, fees and slippage of filled orders",
         }
         self.layout = list()
         self.main_window = None
+        self.newest, self.oldest = None, None
+        self.profiler = None
+        self.stats = None
 
     def run(self, bot):
         bot.start()
         while True:
-            event, values = self.main_window.read()
+            event, values = self.main_window.read(timeout=self.READ_TIMEOUT)
             if event == sg.WIN_CLOSED:
                 break
+            elif event == sg.TIMEOUT_KEY:
+                events = bot.bus.drain(limit=self.EVENTS_PER_READ)
+                if events:
+                    self.main_window[self.ml_key].print("\n".join(f"{key}: {value}" for key, value in events))
             elif event == "Stop":
                 popup = self.popup_window(
                     text="Want to close all positions?",
@@ -36,19 +59,20 @@ class Interface:
                 popup.close()
                 break
             elif event == "Orders":
-                orders = bot.orders.select()
+                orders = bot.orders.page(limit=self.PAGE_SIZE, after=self.newest)
+                if orders:
+                    self.newest = (orders[-1].time, orders[-1].id)
+                    self.oldest = self.oldest or (orders[0].time, orders[0].id)
+                    self.print_orders(orders=orders)
+                else:
+                    self.main_window[self.ml_key].print("\nNo new orders\n")
+            elif event == "Older orders":
+                orders = bot.orders.page(limit=self.PAGE_SIZE, before=self.oldest) if self.oldest else []
                 if orders:
-                    self.main_window[self.ml_key].print("")
-                    for order in orders:
-                        order_params = dict(
-                            time=order.time, status=order.status, params=order.params, failed=order.failed,
-                            long=order.long, short=order.short, price=order.price, track_price=order.track_price,
-                        )
-                        for key, value in order_params.items():
-                            self.main_window[self.ml_key].print(f"{key}: {value}")
-                        self.main_window[self.ml_key].print("")
+                    self.oldest = (orders[0].time, orders[0].id)
+                    self.print_orders(orders=orders)
                 else:
-                    self.main_window[self.ml_key].print("\nNo orders yet\n")
+                    self.main_window[self.ml_key].print("\nNo older orders\n")
             elif event == "Balance":
                 self.main_window[self.ml_key].print(f"\n{bot.balance}\n")
             elif event == "Account info":
@@ -57,13 +81,58 @@ class Interface:
                 for k, v in info_dict.items():
                     self.main_window[self.ml_key].print(f"{k}: {v}")
                 self.main_window[self.ml_key].print("")
-            else:
-                self.main_window[self.ml_key].print(values)
-        bot.socket_manager.close()
+            elif event == "Latency":
+                self.main_window[self.ml_key].print(f"\n{bot.order_latency.summary()}\n")
+            elif event == "Streams":
+                self.main_window[self.ml_key].print(f"\n{bot.supervisor.summary()}\n")
+            elif event == "Profile":
+                self.toggle_profiler()
+            elif event == "Stats":
+                if self.stats is not None and self.stats.is_alive():
+                    self.main_window[self.ml_key].print("\nStats are being computed\n")
+                else:
+                    self.stats = Thread(target=self.publish_stats, args=(bot,), name='stats', daemon=True)
+                    self.stats.start()
+        if bot.socket_manager is not None:
+            bot.socket_manager.close()
         bot.join(timeout=5)
-        reactor.stop()
+        if reactor.running:
+            reactor.callFromThread(reactor.stop)
         self.main_window.close()
 
+    def toggle_profiler(self):
+        if self.profiler is None:
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+            self.main_window[self.ml_key].print("\nProfiling started\n")
+            return
+        with open(self.PROFILE_PATH, 'w') as file:
+            file.write(self.profiler.stop())
+        self.profiler = None
+        self.main_window[self.ml_key].print(f"\nProfile saved to {self.PROFILE_PATH}, render it with flamegraph.pl "
+                                            f"or speedscope\n")
+
+    @staticmethod
+    def publish_stats(bot):
+        """
+        Runs in a worker, summary syncs fills and reads all of them, that takes a while with many fills
+        """
+        try:
+            bot.orders.flush()
+            summary = format_summary(TradeAnalytics().summary())
+        except Exception as exc:
+            log_warns.exception(exc)
+            summary = f"Failed computing stats: {exc}"
+        bot.bus.publish(key="Stats", value=f"\n{summary}\n", topic="stats")
+
+    def print_orders(self, orders: list):
+        lines = [
+            f"time: {order.time} - status: {order.status} - failed: {order.failed} - long: {order.long} - "
+            f"short: {order.short} - price: {order.price} - track_price: {order.track_price}\nparams: {order.params}"
+            for order in orders
+        ]
+        self.main_window[self.ml_key].print("\n" + "\n\n".join(lines) + "\n")
+
     @property
     def ml_key(self):
         return "out" + sg.WRITE_ONLY_KEY
@@ -95,7 +164,7 @@ class Interface:
             title=self.title,
             layout=self.layout,
             default_button_element_size=(10, 2),
-            size=(800, 550),
+            size=(800, 600),
             element_padding=(10, 10),
             auto_size_buttons=False,
         )
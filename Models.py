@@ -1,5 +1,5 @@
 from playhouse.sqlite_ext import SqliteExtDatabase, Model, TextField, JSONField, BooleanField, TimestampField, FloatField
-import os
+from peewee import IntegerField, CompositeKey
 
 db_name = 'Orders.db'
 sqlite_db = SqliteExtDatabase(database=db_name, pragmas={'journal_mode': 'wal'})
@@ -13,16 +13,89 @@ class BaseModel(Model):
 
 class Orders(BaseModel):
 
-    id = TextField()
+    id = TextField(primary_key=True)
     params = JSONField()
     long = BooleanField()
     short = BooleanField()
-    time = TimestampField()
+    time = TimestampField(index=True)
     failed = BooleanField()
     price = FloatField()
     track_price = FloatField()
     status = TextField()
 
 
-if not os.path.isfile(db_name):
-    Orders.create_table()
+class Klines(BaseModel):
+
+    symbol = TextField()
+    interval = TextField()
+    time = IntegerField()
+    open = FloatField()
+    high = FloatField()
+    low = FloatField()
+    close = FloatField()
+    volume = FloatField()
+    close_time = IntegerField()
+    quote_volume = FloatField()
+    trades = IntegerField()
+    taker_base_volume = FloatField()
+    taker_quote_volume = FloatField()
+
+    class Meta:
+        primary_key = CompositeKey('symbol', 'interval', 'time')
+        without_rowid = True
+
+
+class EmptyKlines(BaseModel):
+
+    symbol = TextField()
+    interval = TextField()
+    start = IntegerField()
+    end = IntegerField()
+
+    class Meta:
+        primary_key = CompositeKey('symbol', 'interval', 'start')
+        without_rowid = True
+
+
+class Fills(BaseModel):
+
+    id = TextField(primary_key=True)
+    symbol = TextField()
+    side = TextField()
+    type = TextField(null=True)
+    status = TextField()
+    placed = IntegerField()
+    time = IntegerField()
+    avg_price = FloatField()
+    executed_qty = FloatField()
+    commission = FloatField()
+    commission_asset = TextField(null=True)
+    realized_profit = FloatField()
+    signal_price = FloatField()
+
+    class Meta:
+        indexes = (
+            (('time',), False),
+            (('symbol', 'time'), False),
+        )
+
+
+def create_tables():
+    sqlite_db.create_tables([Orders, Klines, EmptyKlines, Fills])
+    if not sqlite_db.get_primary_keys('orders'):
+        # tables created before id became the primary key
+        sqlite_db.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "orders_id" ON "orders" ("id")')
+
+
+def use_database(path: str):
+    """
+    Points all models at another database file, e.g. for mock exchange and replay runs.
+    Has to be called before orders or klines are stored
+    """
+    global db_name
+    db_name = path
+    sqlite_db.init(database=path, pragmas={'journal_mode': 'wal'})
+    create_tables()
+
+
+create_tables()
@@ -0,0 +1,73 @@
+from threading import Lock
+
+
+class AccountCache:
+
+    def __init__(self):
+        """
+        Balances and positions kept up to date by futures user data stream ACCOUNT_UPDATE events
+        """
+        self.balances = {}
+        self._positions = {}
+        self._lock = Lock()
+        self.ready = False
+
+    def load(self, balance: list, positions: list):
+        """
+        Fills cache from REST responses
+
+        :param balance: futures_account_balance response
+        :param positions: futures_position_information response
+        """
+        with self._lock:
+            for asset in balance:
+                self.balances[asset['asset']] = asset['balance']
+            for position in positions:
+                self._positions[(position['symbol'], position.get('positionSide', 'BOTH'))] = position
+            self.ready = True
+
+    def load_info(self, info: dict):
+        """
+        Fills cache from one futures_account response, which holds balances and positions of every symbol
+        """
+        self.load(
+            balance=[dict(asset=asset['asset'], balance=asset['walletBalance']) for asset in info.get('assets', [])],
+            positions=[dict(position, unRealizedProfit=position.get('unrealizedProfit', '0'),
+                            positionSide=position.get('positionSide', 'BOTH'))
+                       for position in info.get('positions', [])],
+        )
+
+    def update_balances(self, balances: dict):
+        """
+        :param balances: dict(asset=balance str, ..) from a REST response
+        """
+        with self._lock:
+            self.balances.update(balances)
+
+    def apply(self, update: dict):
+        """
+        Applies 'a' field of ACCOUNT_UPDATE event
+        """
+        with self._lock:
+            for asset in update.get('B', []):
+                self.balances[asset['a']] = asset['wb']
+            for position in update.get('P', []):
+                key = (position['s'], position.get('ps', 'BOTH'))
+                cached = self._positions.setdefault(key, dict(symbol=position['s'], positionSide=key[1]))
+                cached.update(
+                    positionAmt=position['pa'],
+                    entryPrice=position['ep'],
+                    unRealizedProfit=position['up'],
+                    marginType=position.get('mt', cached.get('marginType')),
+                )
+
+    def balance(self, asset: str):
+        return float(self.balances.get(asset, 0.0))
+
+    def positions(self, symbol: str = None):
+        """
+        :return: list of positions in futures_position_information layout
+        """
+        with self._lock:
+            return [dict(position) for (pos_symbol, _), position in self._positions.items()
+                    if symbol is None or pos_symbol == symbol]
@@ -0,0 +1,262 @@
+import argparse
+import json
+from time import time
+import numpy as np
+from peewee import SQL
+from Models import Fills, Klines, sqlite_db
+from utils import configure_logging, interval_to_ms
+
+log_warns = configure_logging()
+
+
+class TradeAnalytics:
+
+    FIELDS = ('symbol', 'side', 'placed', 'time', 'avg_price', 'executed_qty', 'commission', 'realized_profit',
+              'signal_price')
+    SYNC_SQL = """
+        INSERT OR REPLACE INTO fills (id, symbol, side, type, status, placed, time, avg_price, executed_qty,
+                                      commission, commission_asset, realized_profit, signal_price)
+        SELECT id, symbol, side, type, status, placed, COALESCE(fill_time, placed), avg_price, executed_qty,
+               commission, commission_asset, realized_profit, price
+        FROM (
+            SELECT o.id, o.status, o.price,
+                   COALESCE(json_extract(o.params, '$.s'), json_extract(o.params, '$.symbol')) AS symbol,
+                   COALESCE(json_extract(o.params, '$.S'), json_extract(o.params, '$.side')) AS side,
+                   COALESCE(json_extract(o.params, '$.o'), json_extract(o.params, '$.type')) AS type,
+                   CAST(strftime('%s', o.time, 'unixepoch', 'localtime') AS INTEGER) * 1000 AS placed,
+                   COALESCE(json_extract(o.params, '$.T'), json_extract(o.params, '$.updateTime')) AS fill_time,
+                   CAST(COALESCE(json_extract(o.params, '$.ap'), json_extract(o.params, '$.avgPrice'), 0) AS REAL)
+                       AS avg_price,
+                   CAST(COALESCE(json_extract(o.params, '$.z'), json_extract(o.params, '$.executedQty'), 0) AS REAL)
+                       AS executed_qty,
+                   CAST(COALESCE(json_extract(o.params, '$.n'), 0) AS REAL) AS commission,
+                   json_extract(o.params, '$.N') AS commission_asset,
+                   CAST(COALESCE(json_extract(o.params, '$.rp'), 0) AS REAL) AS realized_profit
+            FROM orders o LEFT JOIN fills f ON f.id = o.id
+            WHERE o.status IN ('FILLED', 'PARTIALLY_FILLED') AND NOT o.failed
+              AND (f.id IS NULL OR f.status != o.status OR o.status = 'PARTIALLY_FILLED')
+        )
+    """
+
+    def __init__(self, model=Fills, klines=Klines):
+        """
+        Trade statistics over filled orders. Order params are JSON, so fields of fills are extracted once into
+        the typed and indexed fills table, analysis loads a time range of it in one query and works on numpy arrays.
+        Orders store the last ORDER_TRADE_UPDATE, so commission of partially filled orders is the one of their
+        last fill
+
+        :param model: peewee model with Fills layout
+        :param klines: peewee model with Klines layout, closes are used when an order has no signal price
+        """
+        self.model = model
+        self.klines = klines
+
+    def sync(self):
+        """
+        Extracts fills of orders filled since the last sync, partially filled orders are extracted again
+
+        :return: int amount of extracted fills
+        """
+        with sqlite_db.atomic():
+            return sqlite_db.execute_sql(self.SYNC_SQL).rowcount
+
+    def load(self, start: int = None, end: int = None, symbols: list = None):
+        """
+        Loads fills with fill time in [start, end] ordered by time
+
+        :param start: milliseconds
+        :param end: milliseconds
+        :return: dict of np.ndarray by FIELDS, with buy, signed_qty, code of symbol in symbols
+        """
+        query = (self.model
+                 .select(*[getattr(self.model, field) for field in self.FIELDS])
+                 .where(self.model.executed_qty > 0))
+        if start is not None:
+            query = query.where(self.model.time >= start)
+        if end is not None:
+            query = query.where(self.model.time <= end)
+        if symbols:
+            query = query.where(self.model.symbol.in_(symbols))
+        rows = sqlite_db.execute(query.order_by(self.model.time)).fetchall()
+        columns = list(zip(*rows)) or [()] * len(self.FIELDS)
+        fills = {field: np.array(column, dtype=np.float64) for field, column in zip(self.FIELDS[2:], columns[2:])}
+        codes = {}
+        fills['code'] = np.fromiter((codes.setdefault(symbol, len(codes)) for symbol in columns[0]), dtype=np.int64,
+                                    count=len(rows))
+        fills['symbols'] = np.array(list(codes), dtype=object)
+        fills['symbol'] = fills['symbols'][fills['code']]
+        fills['buy'] = np.array(columns[1], dtype=object) == 'BUY'
+        fills['signed_qty'] = np.where(fills['buy'], fills['executed_qty'], -fills['executed_qty'])
+        return fills
+
+    @staticmethod
+    def positions(fills: dict):
+        """
+        Position in the symbol of every fill after it, starting flat at the first loaded fill
+
+        :return: np.ndarray
+        """
+        codes = fills['code']
+        order = np.argsort(codes, kind='stable')
+        running = np.cumsum(fills['signed_qty'][order])
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0]) if len(order) else np.empty(0, dtype=int)
+        offsets = np.repeat(running[starts] - fills['signed_qty'][order][starts], np.diff(np.r_[starts, len(order)]))
+        positions = np.empty(len(order), dtype=np.float64)
+        positions[order] = np.round(running - offsets, 9)
+        return positions
+
+    def trades(self, fills: dict):
+        """
+        Splits fills of every symbol into trades from flat position to flat position, a fill reversing the
+        position continues the trade. Pnl of a closed trade is its cash flow, which needs no entry price
+        bookkeeping because its quantities net to zero
+
+        :return: dict of np.ndarray: symbol, opened, closed (milliseconds, nan while open), pnl, fees, net, fills
+        """
+        order = np.argsort(fills['code'], kind='stable')
+        codes, positions = fills['code'][order], self.positions(fills=fills)[order]
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = (codes[1:] != codes[:-1]) | (positions[:-1] == 0)
+        last = np.ones(len(codes), dtype=bool)
+        last[:-1] = first[1:]
+        trade = np.cumsum(first) - 1
+        amount = int(first.sum())
+        cash = -fills['signed_qty'][order] * fills['avg_price'][order]
+        closed = positions[last] == 0
+        pnl = np.bincount(trade, weights=cash, minlength=amount)
+        fees = np.bincount(trade, weights=fills['commission'][order], minlength=amount)
+        return {
+            'symbol': fills['symbols'][codes[last]],
+            'opened': fills['time'][order][first],
+            'closed': np.where(closed, fills['time'][order][last], np.nan),
+            'pnl': np.where(closed, pnl, np.nan),
+            'fees': fees,
+            'net': np.where(closed, pnl - fees, np.nan),
+            'fills': np.bincount(trade, minlength=amount),
+        }
+
+    def reference_prices(self, fills: dict):
+        """
+        Price at signal time of every fill: signal price of the order if it was given, otherwise close of the
+        last kline closed before the order was placed, of the shortest stored interval. Only klines at these
+        times are loaded
+
+        :return: np.ndarray, nan where neither is known
+        """
+        reference = np.where(fills['signal_price'] > 0, fills['signal_price'], np.nan)
+        missing = np.isnan(reference)
+        for code in np.unique(fills['code'][missing]):
+            symbol = fills['symbols'][code]
+            intervals = [row[0] for row in self.klines.select(self.klines.interval).distinct()
+                         .where(self.klines.symbol == symbol).tuples()]
+            if not intervals:
+                continue
+            interval = min(intervals, key=interval_to_ms)
+            step = interval_to_ms(interval)
+            rows = np.flatnonzero(missing & (fills['code'] == code))
+            opened = (fills['placed'][rows] // step - 1) * step
+            times = np.unique(opened)
+            query = (self.klines
+                     .select(self.klines.time, self.klines.close)
+                     .where((self.klines.symbol == symbol) & (self.klines.interval == interval) &
+                            self.klines.time.in_(SQL('(SELECT value FROM json_each(?))',
+                                                     [json.dumps(times.astype(np.int64).tolist())])))
+                     .order_by(self.klines.time))
+            closes = np.array(sqlite_db.execute(query).fetchall(), dtype=np.float64).reshape(-1, 2)
+            index = np.minimum(np.searchsorted(closes[:, 0], opened), len(closes) - 1)
+            found = (index >= 0) & (closes[index, 0] == opened) if len(closes) else np.zeros(len(rows), dtype=bool)
+            reference[rows[found]] = closes[index[found], 1]
+        return reference
+
+    def slippage(self, fills: dict):
+        """
+        :return: np.ndarray of average fill price distance from reference price as fraction,
+                 positive when the fill was worse for the order side
+        """
+        reference = self.reference_prices(fills=fills)
+        direction = np.where(fills['buy'], 1.0, -1.0)
+        return direction * (fills['avg_price'] - reference) / reference
+
+    def exposure(self, fills: dict):
+        """
+        Positions after every fill, carried forward for symbols that did not trade
+
+        :return: dict: time np.ndarray, symbols list, positions and notional np.ndarray shape (n, symbols)
+                 valued at the last fill price of each symbol, gross np.ndarray sum of absolute notional
+        """
+        codes, positions = fills['code'], self.positions(fills=fills)
+        rows = np.arange(len(codes))
+        filled = np.zeros((len(codes), len(fills['symbols'])), dtype=bool)
+        filled[rows, codes] = True
+        last = np.maximum.accumulate(np.where(filled, rows[:, None], -1), axis=0)
+        valid = last >= 0
+        last = np.maximum(last, 0)
+        position = np.where(valid, positions[last], 0.0)
+        notional = position * fills['avg_price'][last]
+        return {
+            'time': fills['time'],
+            'symbols': list(fills['symbols']),
+            'positions': position,
+            'notional': notional,
+            'gross': np.abs(notional).sum(axis=1),
+        }
+
+    def summary(self, start: int = None, end: int = None, symbols: list = None, sync: bool = True):
+        """
+        :param sync: extract new fills first
+        :return: dict of statistics
+        """
+        if sync:
+            self.sync()
+        fills = self.load(start=start, end=end, symbols=symbols)
+        trades = self.trades(fills=fills)
+        slippage = self.slippage(fills=fills)
+        exposure = self.exposure(fills=fills)
+        closed = ~np.isnan(trades['net'])
+        known = ~np.isnan(slippage)
+        return {
+            'fills': len(fills['time']),
+            'trades': int(closed.sum()),
+            'open_trades': int((~closed).sum()),
+            'win_rate': float((trades['net'][closed] > 0).mean()) if closed.any() else None,
+            'pnl': float(trades['pnl'][closed].sum()),
+            'fees': float(fills['commission'].sum()),
+            'net': float(trades['net'][closed].sum()),
+            'realized_profit': float(fills['realized_profit'].sum()),
+            'avg_trade': float(trades['net'][closed].mean()) if closed.any() else None,
+            'slippage_bps': float(slippage[known].mean() * 10000) if known.any() else None,
+            'volume': float(np.dot(fills['executed_qty'], fills['avg_price'])),
+            'max_gross_exposure': float(exposure['gross'].max()) if len(exposure['gross']) else 0.0,
+        }
+
+    def frame(self, fills: dict):
+        """
+        :rtype: pd.DataFrame of fills with datetime index
+        """
+        import pandas as pd
+        df = pd.DataFrame({field: values for field, values in fills.items() if field != 'symbols'})
+        df.index = pd.to_datetime(fills['time'], unit='ms')
+        return df
+
+
+def format_summary(summary: dict):
+    return "\n".join(f"{key}: {value:.6g}" if isinstance(value, float) else f"{key}: {value}"
+                     for key, value in summary.items())
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Trade statistics of filled orders in Orders.db')
+    parser.add_argument('--days', type=float, help='only fills of the last days')
+    parser.add_argument('--symbol', action='append', help='only fills of the symbol, may be repeated')
+    parser.add_argument('--csv', help='save trades to the csv file')
+    options = parser.parse_args(args)
+    analytics = TradeAnalytics()
+    start = int((time() - options.days * 86400) * 1000) if options.days else None
+    print(format_summary(analytics.summary(start=start, symbols=options.symbol)))
+    if options.csv:
+        import pandas as pd
+        pd.DataFrame(analytics.trades(fills=analytics.load(start=start, symbols=options.symbol))).to_csv(options.csv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+import os
+import sqlite3
+import numpy as np
+from candles import CandleBuffer
+from utils import Order, interval_to_ms
+
+
+def load_klines(path: str, symbol: str = None, interval: str = None):
+    """
+    Loads historical klines from csv (binance dump layout, header optional), parquet or sqlite kline store
+
+    :param path: path to file
+    :param symbol: required for sqlite store
+    :param interval: required for sqlite store
+    :return: np.ndarray shape (n, 6) of time, open, high, low, close, volume
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.db':
+        with sqlite3.connect(path) as connection:
+            rows = connection.execute(
+                "SELECT time, open, high, low, close, volume FROM klines WHERE symbol = ? AND interval = ? "
+                "ORDER BY time", (symbol, interval)
+            ).fetchall()
+        return np.array(rows, dtype=np.float64).reshape(-1, 6)
+    if extension == '.csv':
+        with open(path) as file:
+            header = not file.readline().split(',')[0].strip().replace('.', '', 1).isdigit()
+        return np.loadtxt(path, delimiter=',', usecols=range(6), skiprows=int(header), dtype=np.float64, ndmin=2)
+    elif extension == '.parquet':
+        import pandas as pd
+        return pd.read_parquet(path).iloc[:, :6].to_numpy(dtype=np.float64)
+    raise ValueError(f"Unsupported klines file: {path}")
+
+
+def resample_klines(klines: np.ndarray, interval: str):
+    """
+    Aggregates klines into a larger interval aligned on open time
+
+    :param klines: array from load_klines
+    :param interval: constant from BinanceTrader.KLINE_INTERVALS
+    :rtype: np.ndarray
+    """
+    step = interval_to_ms(interval)
+    buckets = klines[:, 0] // step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(klines)) - 1
+    return np.column_stack((
+        buckets[starts] * step,
+        klines[starts, 1],
+        np.maximum.reduceat(klines[:, 2], starts),
+        np.minimum.reduceat(klines[:, 3], starts),
+        klines[ends, 4],
+        np.add.reduceat(klines[:, 5], starts),
+    ))
+
+
+class BacktestReport:
+
+    def __init__(self, balance: float, equity: np.ndarray, trades: list, fees: float):
+        """
+        :param balance: starting balance
+        :param equity: equity at close of every replayed candle
+        :param trades: list(dict(entry_time, exit_time, side, entry, exit, quantity, pnl), ..)
+        :param fees: paid commission
+        """
+        self.balance = balance
+        self.equity = equity
+        self.trades = trades
+        self.fees = fees
+        self.pnl = float(equity[-1] - balance) if len(equity) else 0.0
+        peak = np.maximum.accumulate(equity) if len(equity) else equity
+        self.max_drawdown = float(np.max((peak - equity) / peak)) if len(equity) else 0.0
+        wins = sum(1 for trade in trades if trade['pnl'] > 0)
+        self.win_rate = wins / len(trades) if trades else 0.0
+
+    def summary(self):
+        return (f"PnL: {self.pnl:.2f} ({self.pnl / self.balance:.2%}) - Max drawdown: {self.max_drawdown:.2%} - "
+                f"Trades: {len(self.trades)} - Win rate: {self.win_rate:.2%} - Fees: {self.fees:.2f}")
+
+
+class Backtester:
+
+    def __init__(self, strategy_cls, klines: np.ndarray, symbol: str, leverage: int, tracker: float,
+                 balance: float = 1000.0, fee: float = 0.0004, warmup: int = 500):
+        """
+        Replays klines through a Strategy the same way BinanceTrader does and simulates fills
+
+        :param strategy_cls: Strategy class from strategy.py
+        :param klines: array from load_klines
+        :param balance: starting USDT balance
+        :param fee: commission rate per fill
+        :param warmup: amount of klines given to the strategy as history
+        """
+        self.strategy_cls = strategy_cls
+        self.klines = np.asarray(klines, dtype=np.float64)
+        self.symbol = symbol
+        self.leverage = leverage
+        self.tracker = tracker
+        self.start_balance = balance
+        self.fee = fee
+        self.warmup = min(warmup, len(self.klines))
+        self.reset()
+
+    def reset(self):
+        self.balance = {'USDT': self.start_balance}
+        self.position, self.entry, self.entry_time, self.extreme = 0.0, 0.0, None, 0.0
+        self.long, self.short = False, False
+        self.ohlc = []
+        self.resting = []
+        self.trades = []
+        self.fees = 0.0
+
+    def get_quantity(self, leverage: int, open_position: bool = True):
+        """
+        Same sizing as BinanceTrader.get_quantity
+        """
+        if not self.ohlc:
+            return 0.0
+        if open_position:
+            return (leverage + 1) * self.balance['USDT'] / float(self.ohlc[4])
+        return abs(self.position)
+
+    def place_order(self, order: Order, **kwargs):
+        params = order.params
+        if params['type'] == 'MARKET':
+            self._fill(params=params, price=float(self.ohlc[4]))
+        else:
+            if params['type'] == 'TRAILING_STOP_MARKET':
+                params.setdefault('activationPrice', float(self.ohlc[4]))
+                params['extreme'] = float(params['activationPrice'])
+            self.resting.append(params)
+        self.long, self.short = order.long, order.short
+
+    def close_order(self, order: Order):
+        if order.params in self.resting:
+            self.resting.remove(order.params)
+        return "closed"
+
+    def run(self):
+        """
+        Bar-by-bar replay through check and stoploss. Resting orders are matched against each candle,
+        check runs on the closed candle, stoploss runs on open, high and low (in the order implied by
+        the candle direction) and close
+
+        :rtype: BacktestReport
+        """
+        self.reset()
+        history = self.klines[:self.warmup]
+        candles = CandleBuffer(capacity=max(self.warmup, 1000))
+        candles.seed(klines=history)
+        strategy = self.strategy_cls(klines=history.tolist(), symbol=self.symbol, leverage=self.leverage,
+                                     quantity=self.get_quantity)
+        strategy.candles = candles
+        equity = np.empty(len(self.klines) - self.warmup)
+        for idx, (time_, open_, high, low, close, volume) in enumerate(self.klines[self.warmup:].tolist()):
+            self._match_resting(time_=time_, open_=open_, high=high, low=low)
+            path = (open_, high, low, close) if close < open_ else (open_, low, high, close)
+            path_high = path_low = open_
+            for price in path:
+                path_high, path_low = max(path_high, price), min(path_low, price)
+                self.ohlc = [time_, open_, path_high, path_low, price]
+                sl = strategy.stoploss(ohlc=self.ohlc, on_long=self.long, on_short=self.short, tracker=self.tracker)
+                if sl:
+                    self.place_order(order=sl)
+            candles.update(kline=dict(t=time_, o=open_, h=high, l=low, c=close, v=volume, x=True))
+            signals = strategy.check(on_long=self.long, on_short=self.short, ohlc=self.ohlc)
+            if signals:
+                for signal in signals:
+                    self.place_order(order=signal)
+            equity[idx] = self.balance['USDT'] + self.position * (close - self.entry)
+        return BacktestReport(balance=self.start_balance, equity=equity, trades=self.trades, fees=self.fees)
+
+    def run_vectorized(self):
+        """
+        Fast path for strategies exposing signals(candles) -> array of target side per candle
+        (1 long, -1 short, 0 flat, nan keep previous). Position is taken at the close of the signal candle,
+        sized like get_quantity, tracker works as trailing stop and is the only part evaluated bar by bar
+
+        :rtype: BacktestReport
+        """
+        self.reset()
+        candles = CandleBuffer(capacity=len(self.klines))
+        candles.seed(klines=self.klines)
+        strategy = self.strategy_cls(klines=self.klines[:self.warmup].tolist(), symbol=self.symbol,
+                                     leverage=self.leverage, quantity=self.get_quantity)
+        target = np.asarray(strategy.signals(candles), dtype=np.float64)
+        filled = np.where(np.isnan(target), 0, np.arange(len(target)))
+        target = np.nan_to_num(target[np.maximum.accumulate(filled)])
+        target[:self.warmup] = 0
+        if self.tracker:
+            return self._run_trailing(target=target)
+
+        times, closes = self.klines[:, 0], self.klines[:, 4]
+        held = np.concatenate(([0.0], target[:-1]))
+        returns = np.concatenate(([0.0], np.diff(closes) / closes[:-1]))
+        exposure = self.leverage + 1
+        turnover = np.abs(np.diff(np.concatenate(([0.0], target))))
+        growth = np.maximum(1 + exposure * held * returns, 0) * (1 - exposure * self.fee * turnover)
+        equity = self.start_balance * np.cumprod(growth)
+        self.fees = float(np.sum(equity / (1 - exposure * self.fee * turnover) * exposure * self.fee * turnover))
+        changes = np.flatnonzero(turnover)
+        for start, end in zip(changes, np.append(changes[1:], len(target) - 1)):
+            if target[start]:
+                self.trades.append(dict(
+                    entry_time=times[start], exit_time=times[end], side=int(target[start]),
+                    entry=closes[start], exit=closes[end], quantity=None,
+                    pnl=float(equity[end] - equity[start]),
+                ))
+        return BacktestReport(balance=self.start_balance, equity=equity[self.warmup:], trades=self.trades,
+                              fees=self.fees)
+
+    def _run_trailing(self, target: np.ndarray):
+        equity = np.empty(len(target))
+        stopped_side = 0
+        for idx, (time_, open_, high, low, close, volume) in enumerate(self.klines.tolist()):
+            self.ohlc = [time_, open_, high, low, close]
+            side = int(target[idx])
+            if self.position:
+                direction = 1 if self.position > 0 else -1
+                self.extreme = max(self.extreme, high) if direction > 0 else min(self.extreme, low)
+                stop = self.extreme * (1 - direction * self.tracker)
+                if (low <= stop) if direction > 0 else (high >= stop):
+                    price = min(open_, stop) if direction > 0 else max(open_, stop)
+                    self._fill(params=dict(side='SELL' if direction > 0 else 'BUY', quantity=abs(self.position)),
+                               price=price, time_=time_)
+                    stopped_side = direction
+            if side != stopped_side:
+                stopped_side = 0
+                current = (self.position > 0) - (self.position < 0)
+                if side != current:
+                    if self.position:
+                        self._fill(params=dict(side='SELL' if current > 0 else 'BUY', quantity=abs(self.position)),
+                                   price=close, time_=time_)
+                    if side:
+                        quantity = self.get_quantity(leverage=self.leverage)
+                        self._fill(params=dict(side='BUY' if side > 0 else 'SELL', quantity=quantity), price=close,
+                                   time_=time_)
+                        self.extreme = close
+            equity[idx] = self.balance['USDT'] + self.position * (close - self.entry)
+        return BacktestReport(balance=self.start_balance, equity=equity[self.warmup:], trades=self.trades,
+                              fees=self.fees)
+
+    def _match_resting(self, time_: float, open_: float, high: float, low: float):
+        for params in list(self.resting):
+            buy = params['side'] == 'BUY'
+            if params['type'] == 'LIMIT':
+                price = float(params['price'])
+                if (low <= price) if buy else (high >= price):
+                    self._fill(params=params, price=min(open_, price) if buy else max(open_, price), time_=time_)
+            elif params['type'] in ('STOP_MARKET', 'STOP'):
+                price = float(params['stopPrice'])
+                if (high >= price) if buy else (low <= price):
+                    self._fill(params=params, price=max(open_, price) if buy else min(open_, price), time_=time_)
+            elif params['type'] == 'TRAILING_STOP_MARKET':
+                rate = float(params['callbackRate']) / 100
+                if buy:
+                    params['extreme'] = min(params['extreme'], low)
+                    price = params['extreme'] * (1 + rate)
+                    triggered = high >= price
+                else:
+                    params['extreme'] = max(params['extreme'], high)
+                    price = params['extreme'] * (1 - rate)
+                    triggered = low <= price
+                if triggered:
+                    self._fill(params=params, price=price, time_=time_)
+
+    def _fill(self, params: dict, price: float, time_: float = None):
+        if params in self.resting:
+            self.resting.remove(params)
+        time_ = self.ohlc[0] if time_ is None else time_
+        direction = 1 if params['side'] == 'BUY' else -1
+        if params.get('closePosition') in (True, 'true'):
+            quantity = abs(self.position)
+        else:
+            quantity = float(params['quantity'])
+        if params.get('reduceOnly') in (True, 'true'):
+            quantity = min(quantity, abs(self.position))
+        if not quantity:
+            return
+        fee = quantity * price * self.fee
+        self.fees += fee
+        self.balance['USDT'] -= fee
+        if self.position and (self.position > 0) != (direction > 0):
+            closing = min(quantity, abs(self.position))
+            pnl = closing * (price - self.entry) * (1 if self.position > 0 else -1)
+            self.balance['USDT'] += pnl
+            self.trades.append(dict(
+                entry_time=self.entry_time, exit_time=time_, side=1 if self.position > 0 else -1,
+                entry=self.entry, exit=price, quantity=closing, pnl=pnl,
+            ))
+            self.position += direction * quantity
+            if abs(self.position) < 1e-12:
+                self.position, self.entry = 0.0, 0.0
+            elif (self.position > 0) == (direction > 0):
+                self.entry, self.entry_time = price, time_
+        else:
+            size = abs(self.position)
+            self.entry = (self.entry * size + price * quantity) / (size + quantity)
+            self.entry_time = time_ if not size else self.entry_time
+            self.position += direction * quantity
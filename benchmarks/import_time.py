@@ -0,0 +1,48 @@
+"""
+Cold start import time of the bot against the modules it used to import eagerly
+
+Usage: python benchmarks/import_time.py [runs]
+Strategy module has to be importable from the repository root
+"""
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = {
+    'lazy': 'import BinanceFuturesBot',
+    'eager': 'import BinanceFuturesBot, pandas, plotly.graph_objs, plotly.offline, PySimpleGUI',
+}
+
+
+def import_time(statement: str):
+    """
+    :return: cumulative import time of every top level module in seconds, measured with -X importtime
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=ROOT,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        if not package.startswith('  '):
+            total += int(cumulative)
+    return total / 1e6
+
+
+def main(runs: int = 5):
+    for name, statement in CASES.items():
+        try:
+            times = [import_time(statement=statement) for _ in range(runs)]
+        except RuntimeError as exc:
+            print(f"{name:>6}: failed, {exc}")
+            continue
+        print(f"{name:>6}: median {median(times):.3f}s, min {min(times):.3f}s over {runs} runs")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,470 @@
+"""
+Benchmarks of the bot hot paths with the network replaced by a local stub client
+
+Usage: python benchmarks/run.py [--quick] [--only callback,db] [--output results.json]
+                                [--save benchmarks/baseline.json] [--compare benchmarks/baseline.json]
+
+Strategy module has to be importable from the repository root. Databases are created in --workdir,
+keep it between runs to skip filling the large ones again. Exit code is 1 if --compare finds a
+benchmark slower than the baseline by more than --threshold
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from random import Random
+from statistics import median
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES = {
+    'full': dict(klines=(500, 10000, 100000), orders=(10000, 100000, 1000000), plot=(500, 5000, 50000),
+                 fills=(10000, 100000)),
+    'quick': dict(klines=(500, 10000), orders=(10000,), plot=(500,), fills=(10000,)),
+}
+INTERVAL_MS = 60000
+START_TIME = 1600000000000
+
+
+class StubClient:
+
+    time_offset = 0
+
+    def futures_create_order(self, **params):
+        return dict(params, orderId=1, status='NEW')
+
+    def _request_futures_api(self, method, path, signed=False, **kwargs):
+        return [dict(order, orderId=1, status='NEW') for order in json.loads(kwargs['data']['batchOrders'])]
+
+
+def timed(loop, ops: int, repeat: int, setup=None):
+    """
+    :param loop: callable running ops operations
+    :param setup: callable run before every repeat, not timed
+    :return: list of seconds per operation for every repeat
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = perf_counter()
+        loop()
+        runs.append((perf_counter() - started) / ops)
+    return runs
+
+
+def make_klines(amount: int, seed: int = 1):
+    """
+    :return: list of futures_klines rows with a random walk price
+    """
+    random, price, klines = Random(seed), 20000.0, []
+    for number in range(amount):
+        open_ = price
+        price = max(1.0, price * (1 + random.gauss(0, 0.002)))
+        high = max(open_, price) * (1 + random.random() * 0.001)
+        low = min(open_, price) * (1 - random.random() * 0.001)
+        time = START_TIME + number * INTERVAL_MS
+        klines.append([time, f"{open_:.2f}", f"{high:.2f}", f"{low:.2f}", f"{price:.2f}",
+                       f"{random.random() * 100:.3f}", time + INTERVAL_MS - 1, '0', 0, '0', '0', '0'])
+    return klines
+
+
+def make_trader(journal=None):
+    from BinanceFuturesBot import BinanceTrader
+    from events import EventBus
+    from symbols import SymbolInfo
+    trader = BinanceTrader(symbol='BTCUSDT', interval='1m', leverage=1, api_key=None, api_secret=None,
+                           bus=EventBus(), test=False, tracker=0.01, client=StubClient(), journal=journal,
+                           protection=None, order_book=False, daemon=True)
+    trader.info = SymbolInfo(info=dict(symbol='BTCUSDT', pricePrecision=2, quantityPrecision=3, filters=[
+        dict(filterType='PRICE_FILTER', tickSize='0.10', minPrice='0.10', maxPrice='1000000'),
+        dict(filterType='LOT_SIZE', stepSize='0.001', minQty='0.001', maxQty='1000'),
+        dict(filterType='MARKET_LOT_SIZE', stepSize='0.001', minQty='0.001', maxQty='120'),
+        dict(filterType='MIN_NOTIONAL', notional='5'),
+    ]))
+    trader.candles.seed(klines=make_klines(amount=500))
+    trader.supervisor.watch(name=trader.stream_name)
+    return trader
+
+
+def bench_callback(sizes: dict, repeat: int):
+    trader = make_trader()
+    messages = []
+    for number, kline in enumerate(make_klines(amount=1000)):
+        for tick in range(10):
+            messages.append({'e': 'kline', 'E': kline[0] + tick * 1000, 's': 'BTCUSDT', 'k': {
+                't': kline[0], 'T': kline[6], 's': 'BTCUSDT', 'i': '1m', 'o': kline[1], 'c': kline[4], 'h': kline[2],
+                'l': kline[3], 'v': kline[5], 'n': 0, 'x': tick == 9, 'q': '0', 'V': '0', 'Q': '0', 'B': '0',
+            }})
+
+    def loop():
+        for msg in messages:
+            trader.callback(msg)
+
+    def drain():
+        while not trader.events.empty():
+            trader.events.get_nowait()
+    return {'callback': timed(loop=loop, ops=len(messages), repeat=repeat, setup=drain)}
+
+
+def bench_dataframe(sizes: dict, repeat: int):
+    from utils import to_dataframe
+    results = {}
+    for size in sizes['klines']:
+        klines = make_klines(amount=size)
+        results[f'to_dataframe[{size}]'] = timed(loop=lambda: to_dataframe(klines), ops=1, repeat=repeat)
+    return results
+
+
+def bench_to_string(sizes: dict, repeat: int):
+    from utils import to_string
+    random = Random(2)
+    values = [random.uniform(0.001, 60000) for _ in range(10000)]
+
+    def loop():
+        for value in values:
+            to_string(value, 2)
+    return {'to_string': timed(loop=loop, ops=len(values), repeat=repeat)}
+
+
+def bench_orders(sizes: dict, repeat: int):
+    from journal import OrderJournal
+    from utils import Order
+    journal = OrderJournal()
+    trader = make_trader(journal=journal)
+    amount = 1000
+
+    def build():
+        for number in range(amount):
+            trader.build_params(order=Order(params=dict(symbol='BTCUSDT', side='BUY', type='LIMIT', quantity=0.0123,
+                                                        price=19999.123)))
+
+    def place():
+        for number in range(amount):
+            trader.place_orders(orders=[Order(params=dict(symbol='BTCUSDT', side='BUY', type='MARKET',
+                                                          quantity=0.0123))])
+
+    def place_batch():
+        for number in range(amount // 5):
+            trader.place_orders(orders=[Order(params=dict(symbol='BTCUSDT', side='SELL', type='LIMIT', quantity=0.01,
+                                                          price=20100 + level)) for level in range(5)])
+    return {
+        'build_params': timed(loop=build, ops=amount, repeat=repeat),
+        'place_orders': timed(loop=place, ops=amount, repeat=repeat, setup=journal.flush),
+        'place_orders_batch': timed(loop=place_batch, ops=amount, repeat=repeat, setup=journal.flush),
+    }
+
+
+def fill_orders(path: str, rows: int):
+    """
+    Opens orders database at path, fills it up to rows orders
+
+    :return: list of stored order ids
+    """
+    from Models import Orders, sqlite_db
+    from peewee import chunked
+    sqlite_db.close()
+    sqlite_db.init(path, pragmas={'journal_mode': 'wal'})
+    sqlite_db.create_tables([Orders])
+    stored = Orders.select().count()
+    ids = [f"order-{number:08d}" for number in range(rows)]
+    if stored < rows:
+        fields = [Orders.id, Orders.params, Orders.long, Orders.short, Orders.time, Orders.failed, Orders.price,
+                  Orders.track_price, Orders.status]
+        started = datetime(2020, 1, 1).timestamp()
+        new = ([id_, {'symbol': 'BTCUSDT', 'side': 'BUY', 'type': 'MARKET', 'quantity': '0.010'}, True, False,
+                datetime.fromtimestamp(started + number), False, 20000.0, 20000.0, 'FILLED']
+               for number, id_ in enumerate(ids[stored:], start=stored))
+        with sqlite_db.atomic():
+            for batch in chunked(new, 10000):
+                Orders.insert_many(batch, fields=fields).on_conflict_ignore().execute()
+    return ids
+
+
+def bench_db(sizes: dict, repeat: int, workdir: str):
+    from journal import OrderJournal
+    from utils import Order
+    results = {}
+    amount, random = 1000, Random(3)
+    for rows in sizes['orders']:
+        ids = fill_orders(path=os.path.join(workdir, f'orders_{rows}.db'), rows=rows)
+        journal = OrderJournal(cache_size=100)
+        trader = make_trader(journal=journal)
+        created = iter(range(10 ** 9))
+
+        def to_db():
+            for _ in range(amount):
+                order = Order(params={'symbol': 'BTCUSDT', 'side': 'BUY', 'type': 'MARKET', 'quantity': '0.010'},
+                              id_=f"bench-{next(created)}", time=datetime.utcnow(), db=journal)
+                order.to_db()
+            journal.flush()
+
+        def update():
+            for id_ in random.sample(ids, amount):
+                trader.order_update(response={'C': id_, 'X': 'FILLED', 's': 'BTCUSDT', 'ap': '20000.0'})
+            journal.flush()
+
+        def get():
+            for id_ in random.sample(ids, amount):
+                journal.get(id_)
+        results[f'to_db[{rows}]'] = timed(loop=to_db, ops=amount, repeat=repeat)
+        results[f'order_update[{rows}]'] = timed(loop=update, ops=amount, repeat=repeat)
+        results[f'journal_get[{rows}]'] = timed(loop=get, ops=amount, repeat=repeat)
+        journal.close()
+    return results
+
+
+def bench_plot(sizes: dict, repeat: int, workdir: str):
+    from utils import LiveChart, plot_data, to_dataframe
+    results = {}
+    for size in sizes['plot']:
+        df = to_dataframe(make_klines(amount=size))
+        graphs = [
+            dict(name='sma', dot=False, color='blue', values=df['close'].rolling(20).mean().tolist()),
+            dict(name='trades', dot=True, color='red', values=list(zip(df['date'][::50], df['close'][::50]))),
+        ]
+        symbol = os.path.join(workdir, f'plot_{size}')
+        results[f'plot_data[{size}]'] = timed(loop=lambda: plot_data(df, symbol, graphs=graphs, auto_open=False),
+                                              ops=1, repeat=repeat)
+    klines = make_klines(amount=max(sizes['plot']) + 1000)
+    chart = LiveChart(symbol='BTCUSDT', directory=workdir)
+    chart.append(klines=klines[:-1000])
+
+    def append():
+        for kline in klines[-1000:]:
+            chart.append(klines=[kline])
+    results['live_chart_append'] = timed(loop=append, ops=1000, repeat=1)
+    return results
+
+
+def bench_book(sizes: dict, repeat: int):
+    from orderbook import BookSide
+    random = Random(4)
+    asks = BookSide()
+    asks.load([[f"{20000 + level * 0.1:.1f}", f"{random.uniform(0.001, 2):.3f}"] for level in range(1000)])
+    updates = [[[f"{20000 + random.randint(0, 1200) * 0.1:.1f}", random.choice(['0', f"{random.random():.3f}"])]
+                for _ in range(20)] for _ in range(1000)]
+
+    def apply():
+        for levels in updates:
+            asks.apply(levels=levels)
+
+    def fill():
+        for _ in range(1000):
+            asks.fill(quantity=25.0)
+    return {
+        'book_apply': timed(loop=apply, ops=len(updates), repeat=repeat),
+        'book_fill': timed(loop=fill, ops=1000, repeat=repeat),
+    }
+
+
+def fill_trades(path: str, rows: int):
+    """
+    Opens orders database at path, fills it with rows filled orders of round trips spread over a year
+    """
+    from Models import Orders, Klines, Fills, sqlite_db
+    from peewee import chunked
+    sqlite_db.close()
+    sqlite_db.init(path, pragmas={'journal_mode': 'wal'})
+    sqlite_db.create_tables([Orders, Klines, Fills])
+    if Orders.select().count() >= rows:
+        return
+    random, new = Random(5), []
+    spacing = 365 * 86400 * 1000 // rows
+    for number in range(rows):
+        symbol = ('BTCUSDT', 'ETHUSDT')[number // 2 % 2]
+        side = ('BUY', 'SELL')[(number + number // 4) % 2]
+        price = 20000 * (1 + random.gauss(0, 0.01))
+        time = START_TIME + number * spacing
+        params = dict(s=symbol, S=side, o='MARKET', X='FILLED', ap=f"{price:.2f}", z='0.010', n=f"{price * 4e-6:.6f}",
+                      N='USDT', rp='0', T=time)
+        new.append([f"fill-{number:08d}", params, side == 'BUY', side == 'SELL', datetime.utcfromtimestamp(time / 1000),
+                    False, price * (1 + random.gauss(0, 0.0005)), 0.0, 'FILLED'])
+    fields = [Orders.id, Orders.params, Orders.long, Orders.short, Orders.time, Orders.failed, Orders.price,
+              Orders.track_price, Orders.status]
+    with sqlite_db.atomic():
+        for batch in chunked(new, 10000):
+            Orders.insert_many(batch, fields=fields).on_conflict_ignore().execute()
+
+
+def bench_analytics(sizes: dict, repeat: int, workdir: str):
+    from analytics import TradeAnalytics
+    from Models import Fills
+    results = {}
+    for rows in sizes['fills']:
+        fill_trades(path=os.path.join(workdir, f'fills_{rows}.db'), rows=rows)
+        analytics = TradeAnalytics()
+        results[f'analytics_sync[{rows}]'] = timed(loop=analytics.sync, ops=1, repeat=repeat,
+                                                   setup=lambda: Fills.delete().execute())
+        results[f'analytics_summary[{rows}]'] = timed(loop=analytics.summary, ops=1, repeat=repeat)
+    return results
+
+
+def bench_feed(sizes: dict, repeat: int):
+    from feed import FeedSubscriber, KlineReader, KlineRing
+    klines = make_klines(amount=10000)
+    streams = ['btcusdt@kline_1m', 'ethusdt@kline_1m']
+    ring = KlineRing(name=f'bench_feed_{os.getpid()}', streams=streams, create=True)
+    messages = [dict(zip('tohlcvTqnVQ', kline[:11]), x=True) for kline in klines]
+    reader = KlineReader(ring=ring, streams=streams[:1])
+
+    def write():
+        for number, kline in enumerate(messages):
+            ring.write(stream=number % 2, kline=kline, event_time=kline['T'])
+
+    def read():
+        while len(reader.read()):
+            pass
+
+    def decode():
+        for record in records:
+            FeedSubscriber.message(stream=streams[0], record=record)
+    try:
+        results = {'feed_write': timed(loop=write, ops=len(messages), repeat=repeat),
+                   'feed_read': timed(loop=read, ops=len(messages), repeat=repeat,
+                                      setup=lambda: setattr(reader, 'cursor', ring.head - len(messages)))}
+        records = ring.records[:len(messages)].tolist()
+        results['feed_message'] = timed(loop=decode, ops=len(records), repeat=repeat)
+    finally:
+        ring.close()
+    return results
+
+
+def bench_recorder(sizes: dict, repeat: int, workdir: str):
+    from recorder import TrafficRecorder
+    messages = [{'e': 'kline', 'E': kline[0], 's': 'BTCUSDT', 'k': {
+        't': kline[0], 'T': kline[6], 's': 'BTCUSDT', 'i': '1m', 'o': str(kline[1]), 'c': str(kline[4]),
+        'h': str(kline[2]), 'l': str(kline[3]), 'v': str(kline[5]), 'n': 0, 'x': False, 'q': '0', 'V': '0', 'Q': '0',
+    }} for kline in make_klines(amount=10000)]
+    recorder = TrafficRecorder(path=os.path.join(workdir, 'traffic.jsonl.gz'))
+
+    def record():
+        for msg in messages:
+            recorder.record(kind='ws', name='callback', payload=msg)
+
+    def fill():
+        recorder._records.clear()
+        record()
+    try:
+        return {'recorder_record': timed(loop=record, ops=len(messages), repeat=repeat,
+                                         setup=recorder._records.clear),
+                'recorder_write': timed(loop=recorder.write, ops=len(messages), repeat=repeat, setup=fill)}
+    finally:
+        recorder.close()
+        os.remove(recorder.path)
+
+
+BENCHMARKS = {
+    'callback': bench_callback,
+    'dataframe': bench_dataframe,
+    'to_string': bench_to_string,
+    'orders': bench_orders,
+    'db': bench_db,
+    'plot': bench_plot,
+    'book': bench_book,
+    'analytics': bench_analytics,
+    'feed': bench_feed,
+    'recorder': bench_recorder,
+}
+
+
+def run(names: list, sizes: dict, repeat: int, workdir: str):
+    results = {}
+    for name in names:
+        function = BENCHMARKS[name]
+        kwargs = dict(sizes=sizes, repeat=repeat)
+        if 'workdir' in function.__code__.co_varnames:
+            kwargs['workdir'] = workdir
+        try:
+            cases = function(**kwargs)
+        except Exception as exc:
+            print(f"{name:>28}: failed, {type(exc).__name__}: {exc}", flush=True)
+            continue
+        for case, runs in cases.items():
+            results[case] = dict(seconds=median(runs), best=min(runs), runs=runs)
+            print(f"{case:>28}: {format_seconds(median(runs))}/op, best {format_seconds(min(runs))}", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """
+    Prints change of every benchmark present in both results
+
+    :return: list of regressed benchmark names
+    """
+    regressions = []
+    print(f"\nCompared to baseline from {baseline['meta'].get('time')} ({baseline['meta'].get('python')}):")
+    for case, result in results.items():
+        if case not in baseline['results']:
+            continue
+        ratio = result['seconds'] / baseline['results'][case]['seconds']
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  REGRESSION'
+            regressions.append(case)
+        elif ratio < 1 - threshold:
+            mark = '  improved'
+        print(f"{case:>28}: {format_seconds(baseline['results'][case]['seconds'])} -> "
+              f"{format_seconds(result['seconds'])} ({ratio:.2f}x){mark}")
+    return regressions
+
+
+def format_seconds(seconds: float):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the bot hot paths')
+    parser.add_argument('--quick', action='store_true', help='smaller data sizes')
+    parser.add_argument('--only', help=f"comma separated subset of {', '.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workdir', help='directory for databases and plots, temporary if not set')
+    parser.add_argument('--output', help='write results json to this file')
+    parser.add_argument('--save', help='store results as baseline json')
+    parser.add_argument('--compare', help='baseline json to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown ratio')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='bot-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    output = [os.path.abspath(path) for path in (args.output, args.save) if path]
+
+    # Models creates Orders.db in working directory on import, keep it out of the repository
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+    try:
+        results = run(names=names, sizes=SIZES['quick' if args.quick else 'full'], repeat=args.repeat,
+                      workdir=workdir)
+    finally:
+        os.chdir(ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = dict(meta=dict(
+        time=datetime.utcnow().isoformat(timespec='seconds'), python=platform.python_version(),
+        platform=platform.platform(), machine=platform.machine(), quick=args.quick, repeat=args.repeat,
+    ), results=results)
+    for path in output:
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+    if baseline and compare(results=results, baseline=baseline, threshold=args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
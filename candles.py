@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class CandleBuffer:
+
+    FIELDS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, capacity: int = 1000):
+        """
+        Fixed capacity candle store. Every row is written twice, at slot and slot + capacity,
+        so the last `size` candles are always one contiguous slice and views never copy
+
+        :param capacity: maximum amount of candles kept
+        """
+        self.capacity = capacity
+        self.size = 0
+        self.closed = False
+        self._head = 0
+        self._data = np.zeros((len(self.FIELDS), 2 * capacity), dtype=np.float64)
+
+    def __len__(self):
+        return self.size
+
+    def seed(self, klines: list):
+        """
+        Fills buffer with REST klines
+
+        :param klines: list(list(open_time, open, high, low, close, volume, ..), ..)
+        """
+        rows = np.asarray([kline[:6] for kline in klines[-self.capacity:]], dtype=np.float64).reshape(-1, 6)
+        size = len(rows)
+        self._data[:, :size] = rows.T
+        self._data[:, self.capacity:self.capacity + size] = rows.T
+        self._head = size % self.capacity
+        self.size = size
+        self.closed = True
+
+    def update(self, kline: dict):
+        """
+        Applies kline from websocket: replaces forming candle if open time matches, appends otherwise
+
+        :param kline: msg['k'] of kline stream
+        :return: True if a new candle was appended, False if the forming one was replaced
+        """
+        values = (float(kline['t']), float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c']),
+                  float(kline['v']))
+        if self.size and self._data[0, self._head - 1] == values[0]:
+            slot, appended = self._head - 1 if self._head else self.capacity - 1, False
+        else:
+            appended = True
+            slot = self._head
+            self._head = (self._head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+        self._data[:, slot] = values
+        self._data[:, slot + self.capacity] = values
+        self.closed = kline['x']
+        return appended
+
+    def view(self, field: str, length: int = None):
+        """
+        Returns read-only float64 view of the last candles, oldest first.
+        View stays valid until the next update
+
+        :param field: one of FIELDS
+        :param length: amount of candles, all if None
+        :rtype: np.ndarray
+        """
+        length = self.size if length is None else min(length, self.size)
+        end = self._head + self.capacity if self._head < self.size else self._head
+        view = self._data[self.FIELDS.index(field), end - length:end]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def time(self):
+        return self.view('time')
+
+    @property
+    def open(self):
+        return self.view('open')
+
+    @property
+    def high(self):
+        return self.view('high')
+
+    @property
+    def low(self):
+        return self.view('low')
+
+    @property
+    def close(self):
+        return self.view('close')
+
+    @property
+    def volume(self):
+        return self.view('volume')
+
+    def tail(self):
+        """
+        :return: np.ndarray copy of stored candles shape (size, len(FIELDS)), oldest first, accepted by seed
+        """
+        return np.stack([self.view(field) for field in self.FIELDS], axis=1)
+
+    def last(self):
+        """
+        :return: dict(time=float, open=float, ..) of the latest candle
+        """
+        return dict(zip(self.FIELDS, self._data[:, self._head - 1 if self._head else self.capacity - 1]))
@@ -0,0 +1,52 @@
+import os
+
+DEFAULT_CONFIG = dict(
+    test=False,
+    headless=False,
+    max_workers=4,
+    metrics_port=0,
+    json_logs=False,
+    feed='',
+    snapshot='bot_state.pickle',
+    record='',
+    symbols=[
+        dict(symbol='BTCUSDT', interval='5m', leverage=7, tracker=0.005),
+    ],
+)
+REQUIRED_SYMBOL_KEYS = ('symbol', 'interval', 'leverage', 'tracker')
+
+
+def load_config(path: str):
+    """
+    Reads bot config from TOML or YAML file, missing top level keys are taken from DEFAULT_CONFIG
+
+    :param path: .toml, .yaml or .yml file
+    :return: dict(test=bool, headless=bool, max_workers=int, metrics_port=int, json_logs=bool, feed=str,
+             snapshot=str, record=str,
+             symbols=list(dict(symbol=str, interval=str, leverage=int, tracker=float, ..), ..))
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.toml':
+        try:
+            import tomllib
+            with open(path, 'rb') as file:
+                data = tomllib.load(file)
+        except ImportError:
+            import toml
+            with open(path) as file:
+                data = toml.load(file)
+    elif extension in ('.yaml', '.yml'):
+        import yaml
+        with open(path) as file:
+            data = yaml.safe_load(file) or {}
+    else:
+        raise ValueError(f"Unsupported config file: {path}")
+
+    config = dict(DEFAULT_CONFIG, **data)
+    if not config['symbols']:
+        raise ValueError(f"No symbols configured in {path}")
+    for number, symbol_config in enumerate(config['symbols']):
+        missing = [key for key in REQUIRED_SYMBOL_KEYS if key not in symbol_config]
+        if missing:
+            raise ValueError(f"Symbol config #{number + 1} in {path} misses {', '.join(missing)}")
+    return config
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from itertools import count
+from threading import Lock, Event
+
+
+class EventBus:
+
+    def __init__(self, capacity: int = 1000):
+        """
+        Bounded queue of presentation events between traders and UI. Publishing never blocks: events
+        with the same key and topic replace each other until consumed, when the bus is full the oldest
+        replaceable event is dropped first
+
+        :param capacity: maximal amount of unconsumed events
+        """
+        self.capacity = capacity
+        self.dropped = 0
+        self._events = OrderedDict()
+        self._ids = count()
+        self._lock = Lock()
+        self._ready = Event()
+
+    def publish(self, key: str, value, topic: str = None):
+        """
+        :param key: event name, e.g. "Klines" or "Order"
+        :param value: event payload
+        :param topic: events with equal key and topic are coalesced, None if every event has to be shown
+        """
+        with self._lock:
+            slot = next(self._ids) if topic is None else (key, topic)
+            if slot not in self._events and len(self._events) >= self.capacity:
+                victim = next((slot_ for slot_ in self._events if isinstance(slot_, tuple)), None)
+                if victim is None:
+                    self._events.popitem(last=False)
+                else:
+                    del self._events[victim]
+                self.dropped += 1
+            self._events[slot] = (key, value)
+            self._ready.set()
+
+    def drain(self, limit: int = None):
+        """
+        Takes published events, oldest first
+
+        :param limit: maximal amount of events, all if None
+        :return: list(tuple(key, value), ..)
+        """
+        with self._lock:
+            amount = len(self._events) if limit is None else min(limit, len(self._events))
+            events = [self._events.popitem(last=False)[1] for _ in range(amount)]
+            if not self._events:
+                self._ready.clear()
+        return events
+
+    def wait(self, timeout: float = None, limit: int = None):
+        """
+        Blocks until events are published or timeout passes
+
+        :return: list(tuple(key, value), ..)
+        """
+        self._ready.wait(timeout=timeout)
+        return self.drain(limit=limit)
@@ -0,0 +1,55 @@
+from queue import Queue, Empty
+from threading import Thread
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+
+class OrderExecutor(Thread):
+
+    def __init__(self, trader, *args, **kwargs):
+        """
+        Places orders of one trader off the strategy thread. Bursts queued while a request is in flight
+        are sent together as one batch
+
+        :param trader: BinanceTrader
+        """
+        super().__init__(*args, **kwargs)
+        self.trader = trader
+        self.queue = Queue()
+
+    def submit(self, orders: list, received: float = None, previous: tuple = None, submission: int = None,
+               **kwargs):
+        """
+        Queues orders without waiting for the exchange
+
+        :param orders: list(Order, ..) placed in given order
+        :param received: perf_counter() of the websocket message that triggered orders
+        :param previous: trader (long, short) flags before orders, restored if every order fails
+        :param submission: number of the submission, a merged batch carries the one of its last orders
+        :param kwargs: additional order parameters
+        """
+        self.queue.put((list(orders), received, previous, submission, kwargs))
+
+    def run(self):
+        while True:
+            orders, received, previous, submission, kwargs = self.queue.get()
+            while True:
+                try:
+                    more, more_received, more_previous, more_submission, more_kwargs = self.queue.get_nowait()
+                except Empty:
+                    break
+                if more_kwargs != kwargs:
+                    self._place(orders=orders, received=received, previous=previous, submission=submission,
+                                **kwargs)
+                    orders, received, previous, kwargs = [], more_received, more_previous, more_kwargs
+                orders.extend(more)
+                submission = more_submission
+            self._place(orders=orders, received=received, previous=previous, submission=submission, **kwargs)
+
+    def _place(self, orders: list, received: float, previous: tuple, submission: int, **kwargs):
+        try:
+            self.trader.place_orders(orders=orders, received=received, previous=previous, submission=submission,
+                                     **kwargs)
+        except Exception as exc:
+            log_warns.exception(exc)
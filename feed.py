@@ -0,0 +1,327 @@
+import argparse
+import signal
+import sys
+from multiprocessing import shared_memory
+from threading import Thread, Event
+from time import sleep
+import numpy as np
+from twisted.internet import reactor
+from config import DEFAULT_CONFIG, load_config
+from rest import RateLimitedClient
+from streams import FuturesSocketManager
+from supervisor import StreamSupervisor
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+KLINE_RECORD = np.dtype([
+    ('seq', np.uint64),
+    ('stream', np.uint32),
+    ('closed', np.uint32),
+    ('event_time', np.int64),
+    ('time', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+    ('close_time', np.int64),
+    ('quote_volume', np.float64),
+    ('trades', np.int64),
+    ('taker_base_volume', np.float64),
+    ('taker_quote_volume', np.float64),
+])
+
+
+class KlineRing:
+
+    MAGIC = 0x4b4c494e45524e47
+    HEADER = 8
+    MAGIC_SLOT, CAPACITY_SLOT, HEAD_SLOT, STREAMS_SLOT = 0, 1, 2, 3
+    MAX_STREAMS = 256
+    STREAM_NAME = np.dtype('S64')
+    CAPACITY = 65536
+
+    def __init__(self, name: str, streams: list = None, capacity: int = CAPACITY, create: bool = False):
+        """
+        Ring buffer of parsed klines in shared memory, written by one feeder process and read lock-free by
+        any amount of processes. Every record carries a sequence number, odd while the writer fills it,
+        so readers detect records that were overwritten during their copy
+
+        :param name: shared memory name
+        :param streams: kline stream names, e.g. btcusdt@kline_1m, written to the ring on create
+        :param capacity: amount of records kept
+        :param create: True in the feeder, False to attach to an existing ring
+        """
+        table = self.MAX_STREAMS * self.STREAM_NAME.itemsize
+        if create:
+            if not streams or len(streams) > self.MAX_STREAMS:
+                raise ValueError(f"Ring needs 1 to {self.MAX_STREAMS} streams, got {len(streams or [])}")
+            size = self.HEADER * 8 + table + capacity * KLINE_RECORD.itemsize
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.memory = self.attach(name=name)
+        self.header = np.ndarray((self.HEADER,), dtype=np.uint64, buffer=self.memory.buf)
+        self.table = np.ndarray((self.MAX_STREAMS,), dtype=self.STREAM_NAME, buffer=self.memory.buf,
+                                offset=self.HEADER * 8)
+        if create:
+            self.header[:] = 0
+            self.header[self.CAPACITY_SLOT] = capacity
+            self.header[self.STREAMS_SLOT] = len(streams)
+            self.table[:len(streams)] = [stream.encode() for stream in streams]
+            self.header[self.MAGIC_SLOT] = self.MAGIC
+        elif self.header[self.MAGIC_SLOT] != self.MAGIC:
+            self.memory.close()
+            raise ValueError(f"Shared memory {name} is not a kline ring")
+        self.name = name
+        self.capacity = int(self.header[self.CAPACITY_SLOT])
+        self.records = np.ndarray((self.capacity,), dtype=KLINE_RECORD, buffer=self.memory.buf,
+                                  offset=self.HEADER * 8 + table)
+        self.streams = [stream.decode() for stream in self.table[:int(self.header[self.STREAMS_SLOT])]]
+        self.owner = create
+
+    @staticmethod
+    def attach(name: str):
+        """
+        Opens existing shared memory without registering it with the resource tracker, which would
+        unlink the ring when a reader exits
+        """
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name=name)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, 'shared_memory')
+            return memory
+
+    @property
+    def head(self):
+        """
+        Amount of records ever written
+        """
+        return int(self.header[self.HEAD_SLOT])
+
+    def write(self, stream: int, kline: dict, event_time: int = 0):
+        """
+        Single writer only
+
+        :param stream: index of the stream in streams
+        :param kline: msg['k'] of kline stream
+        """
+        head = self.head
+        self.records[head % self.capacity] = (
+            2 * head + 1, stream, kline['x'], event_time, kline['t'], kline['o'], kline['h'], kline['l'], kline['c'],
+            kline['v'], kline['T'], kline['q'], kline['n'], kline['V'], kline['Q'],
+        )
+        self.records['seq'][head % self.capacity] = 2 * head + 2
+        self.header[self.HEAD_SLOT] = head + 1
+
+    def close(self):
+        """
+        Releases the mapping, the feeder also removes the shared memory
+        """
+        self.header = self.table = self.records = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class KlineReader:
+
+    def __init__(self, ring: KlineRing, streams: list = None):
+        """
+        Cursor over a ring starting at its newest record
+
+        :param streams: names of streams to read, all if None. Streams the ring is not fed with are logged
+        """
+        self.ring = ring
+        self.cursor = ring.head
+        self.lost = 0
+        self.wanted = None
+        if streams is not None:
+            missing = [stream for stream in streams if stream not in ring.streams]
+            if missing:
+                log_warns.warning('Kline feed %s has no streams %s, feeding %s', ring.name, ', '.join(missing),
+                                  ', '.join(ring.streams))
+            self.wanted = np.zeros(len(ring.streams), dtype=bool)
+            self.wanted[[ring.streams.index(stream) for stream in streams if stream in ring.streams]] = True
+
+    def read(self, limit: int = 1000):
+        """
+        Copies records written since the last read. Records the writer overwrote before they were copied
+        are skipped and counted in lost
+
+        :return: np.ndarray of KLINE_RECORD, oldest first
+        """
+        head = self.ring.head
+        if head - self.cursor > self.ring.capacity - 1:
+            self.lost += head - self.cursor - (self.ring.capacity - 1)
+            self.cursor = head - (self.ring.capacity - 1)
+        numbers = np.arange(self.cursor, min(head, self.cursor + limit), dtype=np.uint64)
+        if not len(numbers):
+            return np.empty(0, dtype=KLINE_RECORD)
+        slots = numbers % self.ring.capacity
+        records = self.ring.records[slots]
+        expected = 2 * numbers + 2
+        valid = (records['seq'] == expected) & (self.ring.records['seq'][slots] == expected)
+        self.lost += int(len(valid) - valid.sum())
+        self.cursor = int(numbers[-1]) + 1
+        if self.wanted is not None:
+            valid &= self.wanted[records['stream']]
+        return records[valid]
+
+
+class FeedSubscriber(Thread):
+
+    def __init__(self, name: str, streams: list, callback, poll_interval: float = 0.001, *args, **kwargs):
+        """
+        Polls a kline ring and hands records to callback as combined stream messages, so consumers of
+        the multiplex socket work unchanged. A missing ring is opened by reattach later
+
+        :param name: shared memory name of the ring
+        :param streams: kline stream names to receive
+        :param callback: callable(dict(stream=name, data=kline stream message))
+        :param poll_interval: seconds to sleep when the ring has no new records
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.ring_name = name
+        self.streams = streams
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.ring, self.reader = None, None
+        self._stopped = Event()
+        self.reattach()
+
+    def run(self):
+        while not self._stopped.is_set():
+            reader = self.reader
+            if reader is None:
+                sleep(self.poll_interval * 100)
+                continue
+            try:
+                records = reader.read()
+            except Exception as exc:
+                log_warns.exception(exc)
+                records = ()
+            if not len(records):
+                sleep(self.poll_interval)
+                continue
+            names = reader.ring.streams
+            for record in records.tolist():
+                try:
+                    self.callback(self.message(stream=names[record[1]], record=record))
+                except Exception as exc:
+                    log_warns.exception(exc)
+
+    @staticmethod
+    def message(stream: str, record: tuple):
+        """
+        :param record: KLINE_RECORD as tuple
+        :return: dict(stream=name, data=kline stream message) with float prices
+        """
+        _, _, closed, event_time, open_time, open_, high, low, close, volume, close_time, quote_volume, trades, \
+            taker_base_volume, taker_quote_volume = record
+        symbol = stream.split('@', 1)[0].upper()
+        return dict(stream=stream, data=dict(e='kline', E=event_time, s=symbol, k=dict(
+            t=open_time, T=close_time, s=symbol, i=stream.rsplit('_', 1)[-1], o=open_, c=close, h=high, l=low,
+            v=volume, n=trades, x=bool(closed), q=quote_volume, V=taker_base_volume, Q=taker_quote_volume,
+        )))
+
+    def reattach(self):
+        """
+        Opens the ring again, e.g. after the feeder process was restarted
+        """
+        try:
+            ring = KlineRing(name=self.ring_name)
+        except (FileNotFoundError, ValueError) as exc:
+            log_warns.warning('Kline feed %s is not available: %s', self.ring_name, exc)
+            return {'msg': exc}
+        self.ring, self.reader = ring, KlineReader(ring=ring, streams=self.streams)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class MarketFeed:
+
+    def __init__(self, name: str, streams: list, client=None, capacity: int = KlineRing.CAPACITY):
+        """
+        Feeder process side: one combined websocket for all kline streams, parsed once into a shared ring
+
+        :param name: shared memory name
+        :param streams: kline stream names, e.g. btcusdt@kline_1m
+        :param client: binance Client for the socket manager
+        """
+        self.client = client or RateLimitedClient()
+        self.ring = KlineRing(name=name, streams=streams, capacity=capacity, create=True)
+        self.index = {stream: number for number, stream in enumerate(streams)}
+        self.supervisor = StreamSupervisor(client=self.client)
+        self.socket_manager, self.socket_key = None, None
+
+    def start(self):
+        self.socket_manager = FuturesSocketManager(client=self.client, user_timeout=60)
+        self.socket_key = self.socket_manager.start_futures_multiplex_socket(streams=self.ring.streams,
+                                                                             callback=self.callback)
+        self.supervisor.watch(name='multiplex', expected_interval=0.25, restart=self.restart)
+        self.socket_manager.start()
+        self.supervisor.start()
+
+    def restart(self):
+        try:
+            self.socket_manager.stop_socket(conn_key=self.socket_key)
+        except Exception as exc:
+            log_warns.exception(exc)
+        self.socket_key = self.socket_manager.start_futures_multiplex_socket(streams=self.ring.streams,
+                                                                             callback=self.callback)
+
+    def callback(self, msg):
+        self.supervisor.beat(name='multiplex', event_time=msg.get('data', {}).get('E'))
+        stream = self.index.get(msg.get('stream'))
+        if stream is None or msg['data'].get('e') != 'kline':
+            log_warns.warning('Unrouted feed message: %s', msg)
+            return
+        self.ring.write(stream=stream, kline=msg['data']['k'], event_time=msg['data']['E'])
+
+    def close(self):
+        self.supervisor.stop()
+        if self.socket_manager:
+            self.socket_manager.close()
+        if reactor.running:
+            reactor.callFromThread(reactor.stop)
+        self.ring.close()
+
+
+def config_streams(config: dict):
+    return sorted({f"{symbol['symbol'].lower()}@kline_{symbol['interval']}" for symbol in config['symbols']})
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Kline feeder sharing one websocket with bot processes')
+    parser.add_argument('--config', help='bot config, kline streams of its symbols are fed')
+    parser.add_argument('--name', help='shared memory name, feed of the config by default')
+    parser.add_argument('--capacity', type=int, default=KlineRing.CAPACITY, help='klines kept in the ring')
+    parser.add_argument('streams', nargs='*', help='additional kline streams, e.g. btcusdt@kline_1m')
+    args = parser.parse_args(args)
+    config = load_config(args.config) if args.config else dict(DEFAULT_CONFIG, symbols=[])
+    name = args.name or config['feed']
+    if not name:
+        parser.error('shared memory name is missing, set feed in config or pass --name')
+    streams = sorted(set(config_streams(config=config)) | set(args.streams))
+    if not streams:
+        parser.error('no kline streams, pass --config or stream names')
+    feed = MarketFeed(name=name, streams=streams, capacity=args.capacity)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    feed.start()
+    print(f"Feeding {', '.join(streams)} into {name}", flush=True)
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        feed.close()
+
+
+if __name__ == '__main__':
+    main()
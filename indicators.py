@@ -0,0 +1,298 @@
+from collections import deque
+from math import sqrt
+
+
+class Indicator:
+    """
+    Streaming indicator. `add` takes the next candle, `revise` recomputes the last candle (the one still forming),
+    both are O(1) and return the current value or None while there is not enough data
+    """
+
+    value = None
+
+    def add(self, *args):
+        raise NotImplementedError
+
+    def revise(self, *args):
+        raise NotImplementedError
+
+    def update(self, *args, new_bar: bool = True):
+        return self.add(*args) if new_bar else self.revise(*args)
+
+    def seed(self, *columns):
+        """
+        Feeds history, e.g. seed(candles.close) or seed(candles.high, candles.low, candles.close)
+        """
+        for values in zip(*columns):
+            self.add(*values)
+        return self.value
+
+
+class SMA(Indicator):
+
+    def __init__(self, period: int):
+        """
+        Same values as pyti simple_moving_average / pandas rolling(period).mean()
+        """
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+        self.value = None
+
+    def add(self, value):
+        if len(self.window) == self.period:
+            self.total -= self.window.popleft()
+        self.window.append(value)
+        self.total += value
+        return self._compute()
+
+    def revise(self, value):
+        self.total += value - self.window[-1]
+        self.window[-1] = value
+        return self._compute()
+
+    def _compute(self):
+        self.value = self.total / self.period if len(self.window) == self.period else None
+        return self.value
+
+
+class EMA(Indicator):
+
+    def __init__(self, period: int):
+        """
+        Recursive ema, same values as pandas ewm(span=period, adjust=False).mean()
+        """
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.previous = None
+        self.value = None
+
+    def add(self, value):
+        self.previous = self.value
+        return self.revise(value)
+
+    def revise(self, value):
+        if self.previous is None:
+            self.value = value
+        else:
+            self.value = self.previous + self.alpha * (value - self.previous)
+        return self.value
+
+
+class WindowedEMA(Indicator):
+
+    def __init__(self, period: int):
+        """
+        Ema weighted over the last `period` values only, same values as pyti exponential_moving_average
+        """
+        self.period = period
+        self.decay = 1 - 2 / (period + 1)
+        self.tail = self.decay ** period
+        self.bottom = sum(self.decay ** idx for idx in range(period))
+        self.window = deque()
+        self.top = 0.0
+        self.previous_top = 0.0
+        self.value = None
+
+    def add(self, value):
+        self.previous_top = self.top * self.decay
+        if len(self.window) == self.period:
+            self.previous_top -= self.tail * self.window.popleft()
+        self.window.append(value)
+        return self._compute()
+
+    def revise(self, value):
+        self.window[-1] = value
+        return self._compute()
+
+    def _compute(self):
+        self.top = self.previous_top + self.window[-1]
+        self.value = self.top / self.bottom if len(self.window) == self.period else None
+        return self.value
+
+
+class RSI(Indicator):
+
+    def __init__(self, period: int):
+        """
+        Wilder rsi seeded with the mean of the first `period` changes, same values as pyti relative_strength_index
+        """
+        self.period = period
+        self.last_close = None
+        self.previous_close = None
+        self.changes = 0
+        self.gain = self.loss = 0.0
+        self.previous_gain = self.previous_loss = 0.0
+        self.value = None
+
+    def add(self, value):
+        self.previous_close = self.last_close
+        self.previous_gain, self.previous_loss = self.gain, self.loss
+        if self.previous_close is not None:
+            self.changes += 1
+        return self.revise(value)
+
+    def revise(self, value):
+        self.last_close = value
+        if self.previous_close is None:
+            return self.value
+        change = value - self.previous_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if self.changes <= self.period:
+            self.gain = self.previous_gain + gain / self.period
+            self.loss = self.previous_loss + loss / self.period
+        else:
+            self.gain = (self.previous_gain * (self.period - 1) + gain) / self.period
+            self.loss = (self.previous_loss * (self.period - 1) + loss) / self.period
+        if self.changes < self.period:
+            self.value = None
+        elif self.loss == 0:
+            self.value = 100.0
+        else:
+            self.value = 100 - 100 / (1 + self.gain / self.loss)
+        return self.value
+
+
+class ATR(Indicator):
+
+    def __init__(self, period: int):
+        """
+        Wilder atr over high/low/close, same values as pandas true range .ewm(alpha=1 / period, adjust=False).mean()
+        where the first true range is high - low
+        """
+        self.smoothing = EMA(period)
+        self.smoothing.alpha = 1 / period
+        self.close = None
+        self.previous_close = None
+        self.value = None
+
+    def add(self, high, low, close):
+        self.previous_close = self.close
+        self.close = close
+        self.value = self.smoothing.add(self._true_range(high, low))
+        return self.value
+
+    def revise(self, high, low, close):
+        self.close = close
+        self.value = self.smoothing.revise(self._true_range(high, low))
+        return self.value
+
+    def _true_range(self, high, low):
+        if self.previous_close is None:
+            return high - low
+        return max(high - low, abs(high - self.previous_close), abs(low - self.previous_close))
+
+
+class BollingerBands(Indicator):
+
+    def __init__(self, period: int, std_mult: float = 2.0):
+        """
+        Sma -/+ population standard deviation * std_mult, same values as pyti lower/middle/upper_bollinger_band.
+        Value is tuple(lower, middle, upper)
+        """
+        self.period = period
+        self.std_mult = std_mult
+        self.window = deque()
+        self.total = self.squares = 0.0
+        self.value = None
+
+    def add(self, value):
+        if len(self.window) == self.period:
+            old = self.window.popleft()
+            self.total -= old
+            self.squares -= old * old
+        self.window.append(value)
+        self.total += value
+        self.squares += value * value
+        return self._compute()
+
+    def revise(self, value):
+        old = self.window[-1]
+        self.window[-1] = value
+        self.total += value - old
+        self.squares += value * value - old * old
+        return self._compute()
+
+    def _compute(self):
+        if len(self.window) < self.period:
+            self.value = None
+            return self.value
+        middle = self.total / self.period
+        deviation = sqrt(max(self.squares / self.period - middle * middle, 0.0)) * self.std_mult
+        self.value = (middle - deviation, middle, middle + deviation)
+        return self.value
+
+
+class MACD(Indicator):
+
+    def __init__(self, short_period: int = 12, long_period: int = 26, signal_period: int = 9, ema=EMA):
+        """
+        Value is tuple(macd, signal, histogram). With ema=EMA macd line is pandas
+        ewm(span=short).mean() - ewm(span=long).mean() (adjust=False), with ema=WindowedEMA it is
+        pyti moving_average_convergence_divergence. Signal line is EMA(signal_period) of the macd line
+        """
+        self.short = ema(short_period)
+        self.long = ema(long_period)
+        self.signal = EMA(signal_period)
+        self.value = None
+
+    def add(self, value):
+        return self._compute(self.short.add(value), self.long.add(value), self.signal.add)
+
+    def revise(self, value):
+        return self._compute(self.short.revise(value), self.long.revise(value), self.signal.revise)
+
+    def _compute(self, short, long, signal_update):
+        if short is None or long is None:
+            self.value = None
+            return self.value
+        macd = short - long
+        signal = signal_update(macd)
+        self.value = (macd, signal, macd - signal)
+        return self.value
+
+
+class RollingExtreme(Indicator):
+
+    def __init__(self, period: int, maximum: bool):
+        """
+        Monotonic deque of (index, value), amortized O(1). Same values as pandas rolling(period).max()/.min()
+        """
+        self.period = period
+        self.better = (lambda a, b: a >= b) if maximum else (lambda a, b: a <= b)
+        self.candidates = deque()
+        self.dropped = []
+        self.index = -1
+        self.value = None
+
+    def add(self, value):
+        self.index += 1
+        if self.candidates and self.candidates[0][0] <= self.index - self.period:
+            self.candidates.popleft()
+        self.dropped = []
+        return self._push(value)
+
+    def revise(self, value):
+        self.candidates.pop()
+        self.candidates.extend(reversed(self.dropped))
+        self.dropped = []
+        return self._push(value)
+
+    def _push(self, value):
+        while self.candidates and self.better(value, self.candidates[-1][1]):
+            self.dropped.append(self.candidates.pop())
+        self.candidates.append((self.index, value))
+        self.value = self.candidates[0][1] if self.index >= self.period - 1 else None
+        return self.value
+
+
+class RollingMax(RollingExtreme):
+
+    def __init__(self, period: int):
+        super().__init__(period=period, maximum=True)
+
+
+class RollingMin(RollingExtreme):
+
+    def __init__(self, period: int):
+        super().__init__(period=period, maximum=False)
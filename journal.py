@@ -0,0 +1,237 @@
+import atexit
+from collections import OrderedDict
+from threading import Thread, Lock, Event
+from peewee import chunked, Tuple
+from Models import Orders, sqlite_db
+from utils import Order, configure_logging
+
+log_warns = configure_logging()
+
+
+class OrderJournal(Thread):
+
+    FIELDS = ['id', 'params', 'long', 'short', 'time', 'failed', 'price', 'track_price', 'status']
+
+    def __init__(self, model=Orders, max_pending: int = 100, flush_interval: float = 1.0, cache_size: int = 1000,
+                 *args, **kwargs):
+        """
+        Write-behind store for orders. Writes are kept in memory and flushed in one transaction by a background
+        thread when max_pending changes are buffered or every flush_interval seconds, pending writes are flushed
+        at interpreter exit. Recent orders are served from memory. Changes of orders that are neither buffered
+        nor cached are checked against the database by the flushing thread, so callers never wait for it
+
+        :param model: peewee model with Orders layout
+        :param max_pending: amount of buffered changes that triggers a flush
+        :param flush_interval: seconds between flushes
+        :param cache_size: amount of recent orders kept in memory
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.model = model
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._early = OrderedDict()
+        self._inserts, self._updates, self._deletes = {}, {}, set()
+        self._flushing = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._stopped = Event()
+        atexit.register(self.close)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def create(self, **fields):
+        """
+        Buffers a new order row, updates received before the order was created are applied on top of it
+        """
+        with self._lock:
+            row = dict(fields)
+            if row['id'] in self._early:
+                early = self._early.pop(row['id'])
+                if early is None:
+                    return
+                row.update(early)
+            self._deletes.discard(row['id'])
+            self._inserts[row['id']] = row
+            self._remember(row)
+            self._notify()
+
+    def update(self, id_: str, **fields):
+        """
+        Buffers changed fields of an order. Fields of an unknown order are kept until it is created
+        """
+        with self._lock:
+            if id_ in self._inserts:
+                self._inserts[id_].update(fields)
+            elif id_ in self._cache or id_ in self._flushing:
+                self._updates.setdefault(id_, {}).update(fields)
+            else:
+                self._early_update(id_, fields)
+                return
+            if id_ in self._cache:
+                self._cache[id_].update(fields)
+            self._notify()
+
+    def delete(self, id_: str):
+        with self._lock:
+            cached = self._cache.pop(id_, None) is not None
+            self._updates.pop(id_, None)
+            if self._inserts.pop(id_, None) is None:
+                if cached or id_ in self._flushing:
+                    self._deletes.add(id_)
+                else:
+                    self._early_update(id_, None)
+                    return
+            self._notify()
+
+    def get(self, id_: str):
+        """
+        :return: Order from memory or db, None if order is unknown
+        """
+        with self._lock:
+            if id_ in self._cache:
+                self._cache.move_to_end(id_)
+                return self._to_order(self._cache[id_])
+            if id_ in self._deletes or id_ in self._early and self._early[id_] is None:
+                return None
+        row = self.model.select().where(self.model.id == id_).dicts().first()
+        if row is None:
+            return None
+        with self._lock:
+            row.update(self._early.get(id_) or {})
+            row.update(self._updates.get(id_, {}))
+            self._remember(row)
+        return self._to_order(row)
+
+    def select(self):
+        """
+        Flushes pending writes and returns query over all stored orders
+        """
+        self.flush()
+        return self.model.select()
+
+    def page(self, limit: int = 20, before: tuple = None, after: tuple = None):
+        """
+        Flushes pending writes and returns one page of stored orders ordered by (time, id)
+
+        :param before: (time, id) cursor, newest orders older than it are returned
+        :param after: (time, id) cursor, oldest orders newer than it are returned
+        :return: list(Orders, ..) oldest first
+        """
+        self.flush()
+        key = Tuple(self.model.time, self.model.id)
+        query = self.model.select()
+        if after is not None:
+            cursor = Tuple(self.model.time.db_value(after[0]), after[1])
+            query = query.where(key > cursor).order_by(self.model.time, self.model.id)
+        else:
+            if before is not None:
+                query = query.where(key < Tuple(self.model.time.db_value(before[0]), before[1]))
+            query = query.order_by(self.model.time.desc(), self.model.id.desc())
+        orders = list(query.limit(limit))
+        return orders if after is not None else orders[::-1]
+
+    def flush(self):
+        """
+        Writes buffered changes in one transaction
+        """
+        with self._flush_lock:
+            self._resolve()
+            with self._lock:
+                inserts, updates, deletes = self._inserts, self._updates, self._deletes
+                self._inserts, self._updates, self._deletes = {}, {}, set()
+                self._flushing = inserts
+            if not (inserts or updates or deletes):
+                return
+            try:
+                with sqlite_db.atomic():
+                    rows = [[row.get(field) for field in self.FIELDS] for row in inserts.values()]
+                    fields = [getattr(self.model, field) for field in self.FIELDS]
+                    for batch in chunked(rows, 100):
+                        self.model.insert_many(batch, fields=fields).on_conflict_replace().execute()
+                    for id_, changed in updates.items():
+                        self.model.update(changed).where(self.model.id == id_).execute()
+                    if deletes:
+                        self.model.delete().where(self.model.id.in_(list(deletes))).execute()
+            except Exception as exc:
+                log_warns.exception(exc)
+                with self._lock:
+                    for id_, row in inserts.items():
+                        self._inserts.setdefault(id_, row)
+                    for id_, changed in updates.items():
+                        self._updates[id_] = dict(changed, **self._updates.get(id_, {}))
+                    self._deletes |= deletes
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def close(self):
+        """
+        Stops background flushing and writes everything still buffered
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        self.flush()
+
+    def _notify(self):
+        if len(self._inserts) + len(self._updates) + len(self._deletes) >= self.max_pending:
+            self._wakeup.set()
+
+    def _resolve(self):
+        """
+        Buffers changes that arrived for unknown orders as updates and deletes of orders found in the database,
+        changes of orders that were not created yet stay until create
+        """
+        with self._lock:
+            ids = list(self._early)
+        if not ids:
+            return
+        stored = set()
+        try:
+            for batch in chunked(ids, 500):
+                stored.update(row[0] for row in self.model.select(self.model.id).where(self.model.id.in_(batch))
+                              .tuples())
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        with self._lock:
+            for id_ in stored:
+                if id_ not in self._early:
+                    continue
+                fields = self._early.pop(id_)
+                if fields is None:
+                    self._cache.pop(id_, None)
+                    self._updates.pop(id_, None)
+                    self._deletes.add(id_)
+                else:
+                    self._updates.setdefault(id_, {}).update(fields)
+                    if id_ in self._cache:
+                        self._cache[id_].update(fields)
+
+    def _remember(self, row: dict):
+        self._cache[row['id']] = dict(row)
+        self._cache.move_to_end(row['id'])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _early_update(self, id_: str, fields):
+        if fields is None or self._early.get(id_, {}) is None:
+            self._early[id_] = None
+        else:
+            self._early.setdefault(id_, {}).update(fields)
+        while len(self._early) > self.cache_size:
+            self._early.popitem(last=False)
+
+    def _to_order(self, row: dict):
+        order = Order(params=row['params'], id_=row['id'], long=row['long'], short=row['short'], time=row['time'],
+                      failed=row['failed'], price=row['price'], db=self)
+        order.status = row['status']
+        order.track_price = row['track_price']
+        return order
@@ -0,0 +1,311 @@
+import os
+import sys
+from collections import Counter as Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock, Event, enumerate as threads, get_ident
+from urllib.parse import urlparse, parse_qs
+from utils import LatencyHistogram, configure_logging
+
+log_warns = configure_logging()
+
+SLIPPAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def get(self):
+        return self.value
+
+
+class Gauge:
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        """
+        :param function: callable returning current value, called on every scrape instead of the set value
+        """
+        self.function = function
+
+    def get(self):
+        if self.function is None:
+            return self.value
+        value = self.function()
+        return float('nan') if value is None else value
+
+
+class MetricFamily:
+
+    KINDS = ('counter', 'gauge', 'histogram')
+
+    def __init__(self, name: str, documentation: str, kind: str, labels: tuple = (),
+                 buckets: tuple = LatencyHistogram.BUCKETS):
+        """
+        Metrics of one name, a child per combination of label values
+
+        :param kind: one of KINDS
+        :param labels: label names
+        :param buckets: upper bounds of histogram buckets in seconds
+        """
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown metric kind {kind}")
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self.buckets = buckets
+        self.children = {}
+        self._lock = Lock()
+
+    def labels(self, **labels):
+        """
+        Child should be looked up once and kept by the caller on hot paths
+
+        :rtype: Counter or Gauge or LatencyHistogram
+        """
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self.children.get(key)
+        if child is None:
+            with self._lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self._create()
+                    self.children[key] = child
+        return child
+
+    def remove(self, **labels):
+        with self._lock:
+            self.children.pop(tuple(str(labels[name]) for name in self.label_names), None)
+
+    def render(self):
+        """
+        :return: list of lines in Prometheus text exposition format
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self.children.items()):
+            labels = [f'{name}="{value}"' for name, value in zip(self.label_names, key)]
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{self._labels(labels)} {child.get()}")
+                continue
+            with child._lock:
+                counts, count, sum_ = list(child.counts), child.count, child.sum
+            cumulative = 0
+            for bound, amount in zip(child.buckets, counts):
+                cumulative += amount
+                bucket = self._labels(labels + ['le="%g"' % bound])
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = self._labels(labels + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{bucket} {count}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {sum_}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {count}")
+        return lines
+
+    def _create(self):
+        if self.kind == 'counter':
+            return Counter()
+        if self.kind == 'gauge':
+            return Gauge()
+        return LatencyHistogram(buckets=self.buckets)
+
+    @staticmethod
+    def _labels(labels: list):
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.families = {}
+        self._lock = Lock()
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()):
+        return self._family(name=name, documentation=documentation, kind='counter', labels=labels)
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()):
+        return self._family(name=name, documentation=documentation, kind='gauge', labels=labels)
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LatencyHistogram.BUCKETS):
+        return self._family(name=name, documentation=documentation, kind='histogram', labels=labels, buckets=buckets)
+
+    def _family(self, name: str, kind: str, **kwargs):
+        """
+        Returns registered family of the name, so modules may declare the same metric independently
+        """
+        with self._lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = MetricFamily(name=name, kind=kind, **kwargs)
+            elif family.kind != kind:
+                raise ValueError(f"Metric {name} is already registered as {family.kind}")
+        return family
+
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+KLINE_MESSAGES = REGISTRY.counter('bot_kline_messages_total', 'Kline websocket messages', labels=('symbol',))
+CALLBACK_SECONDS = REGISTRY.histogram('bot_callback_seconds', 'Time spent in kline callback', labels=('symbol',),
+                                      buckets=FAST_BUCKETS)
+STRATEGY_SECONDS = REGISTRY.histogram('bot_strategy_seconds', 'Duration of strategy calls',
+                                      labels=('symbol', 'method'), buckets=FAST_BUCKETS)
+SIGNAL_AGE = REGISTRY.histogram('bot_signal_age_seconds', 'Time from kline message to strategy signal',
+                                labels=('symbol',), buckets=FAST_BUCKETS)
+PLACE_SECONDS = REGISTRY.histogram('bot_place_orders_seconds', 'Duration of place_orders', labels=('symbol',))
+EXPECTED_SLIPPAGE = REGISTRY.histogram('bot_expected_slippage_ratio', 'Order book estimate of MARKET order slippage',
+                                       labels=('symbol',), buckets=SLIPPAGE_BUCKETS)
+ORDERS = REGISTRY.counter('bot_orders_total', 'Orders by result', labels=('symbol', 'result'))
+EVENT_QUEUE = REGISTRY.gauge('bot_event_queue_size', 'Kline events waiting for strategy', labels=('symbol',))
+REST_SECONDS = REGISTRY.histogram('bot_rest_request_seconds', 'Duration of REST requests',
+                                  labels=('method', 'path'))
+REST_REQUESTS = REGISTRY.counter('bot_rest_requests_total', 'REST responses by status code',
+                                 labels=('method', 'path', 'status'))
+REST_RETRIES = REGISTRY.counter('bot_rest_retries_total', 'Retried REST requests', labels=('method', 'path'))
+
+
+class TraderMetrics:
+
+    def __init__(self, symbol: str, events=None):
+        """
+        Metric children of one symbol, bound once so hot paths skip label lookups
+
+        :param events: queue of kline events exported as its size
+        """
+        self.kline_messages = KLINE_MESSAGES.labels(symbol=symbol)
+        self.callback_seconds = CALLBACK_SECONDS.labels(symbol=symbol)
+        self.check_seconds = STRATEGY_SECONDS.labels(symbol=symbol, method='check')
+        self.stoploss_seconds = STRATEGY_SECONDS.labels(symbol=symbol, method='stoploss')
+        self.signal_age = SIGNAL_AGE.labels(symbol=symbol)
+        self.place_seconds = PLACE_SECONDS.labels(symbol=symbol)
+        self.expected_slippage = EXPECTED_SLIPPAGE.labels(symbol=symbol)
+        self.placed = ORDERS.labels(symbol=symbol, result='placed')
+        self.failed = ORDERS.labels(symbol=symbol, result='failed')
+        if events is not None:
+            EVENT_QUEUE.labels(symbol=symbol).set_function(events.qsize)
+
+
+class SamplingProfiler(Thread):
+
+    def __init__(self, interval: float = 0.005, *args, **kwargs):
+        """
+        Samples stacks of every other thread each interval seconds. Samples are counted in collapsed
+        format "thread;outer;..;inner count" read by flamegraph.pl and speedscope
+
+        :param interval: seconds between samples
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.samples = Tally()
+        self._stopped = Event()
+
+    def run(self):
+        own = get_ident()
+        while not self._stopped.wait(timeout=self.interval):
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.collapsed()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+def profile(seconds: float, interval: float = 0.005):
+    """
+    Samples running threads for given seconds
+
+    :return: str collapsed stacks
+    """
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    profiler._stopped.wait(timeout=seconds)
+    return profiler.stop()
+
+
+class MetricsServer(Thread):
+
+    MAX_PROFILE_SECONDS = 300
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY, *args, **kwargs):
+        """
+        Serves GET /metrics in Prometheus text format and GET /profile?seconds=10&interval=0.005 with
+        collapsed stacks sampled for the given time
+
+        :param port: listening port, 0 picks a free one
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.registry = registry
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                try:
+                    if url.path == '/metrics':
+                        body = server.registry.render()
+                    elif url.path == '/profile':
+                        seconds = min(float(query.get('seconds', [10])[0]), server.MAX_PROFILE_SECONDS)
+                        body = profile(seconds=seconds, interval=float(query.get('interval', [0.005])[0]))
+                    else:
+                        self.send_error(404)
+                        return
+                except ValueError as exc:
+                    self.send_error(400, str(exc))
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def run(self):
+        try:
+            self.server.serve_forever()
+        except Exception as exc:
+            log_warns.exception(exc)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,502 @@
+import argparse
+import json
+from itertools import count
+from time import time, perf_counter
+import numpy as np
+from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
+from autobahn.websocket.types import ConnectionDeny
+from binance.client import Client
+from binance.websockets import BinanceSocketManager
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from backtest import load_klines
+from streams import FuturesSocketManager
+from utils import LatencyHistogram, interval_to_ms
+
+
+def use_mock_exchange(host: str = '127.0.0.1', port: int = 8080, ws_port: int = 8081,
+                      database: str = 'mock_orders.db'):
+    """
+    Points Client, BinanceSocketManager and FuturesSocketManager at a running mock exchange and models at
+    their own database, so mock klines and orders never mix with live ones. Spot streams get a path the
+    mock refuses, a subscription to them fails instead of passing for a futures stream.
+    Has to be called before they are created
+
+    :param database: sqlite file for orders and klines of mock runs
+    """
+    Client.API_URL = f"http://{host}:{port}/api"
+    Client.FUTURES_URL = f"http://{host}:{port}/fapi"
+    BinanceSocketManager.STREAM_URL = f"ws://{host}:{ws_port}{MockStreamProtocol.SPOT_PREFIX}"
+    FuturesSocketManager.FSTREAM_URL = f"ws://{host}:{ws_port}/"
+    from Models import use_database
+    use_database(path=database)
+
+
+class MockError(Exception):
+
+    def __init__(self, code: int, msg: str):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+
+
+class MockExchange:
+
+    PRICE_PRECISION = 2
+    QUANTITY_PRECISION = 3
+    BOOK_LEVELS = 50
+    BOOK_STEP = 0.0001
+
+    def __init__(self, klines: dict, speed: float = 1.0, balance: float = 10000.0, fee: float = 0.0004,
+                 history: int = 500, ticks: int = 4):
+        """
+        Stand-in for binance futures REST api and websocket streams, replays historical klines
+
+        :param klines: dict((symbol, interval)=np.ndarray from backtest.load_klines)
+        :param speed: replay speed multiplier, 60 plays one 1m kline per second
+        :param balance: starting USDT wallet balance
+        :param fee: commission rate per fill
+        :param history: klines available over REST before replay starts
+        :param ticks: kline stream messages per kline, the last one closes it
+        """
+        self.speed = speed
+        self.fee = fee
+        self.ticks = ticks
+        self.cursors = {key: min(history, len(rows) - 1) for key, rows in klines.items()}
+        self.klines = {key: self._shift(rows=rows, interval=key[1], cursor=self.cursors[key])
+                       for key, rows in klines.items()}
+        self.prices = {symbol: float(rows[self.cursors[(symbol, interval)], 1])
+                       for (symbol, interval), rows in klines.items()}
+        self.balance = balance
+        self.positions = {symbol: [0.0, 0.0] for symbol in self.prices}
+        self.orders = {}
+        self.order_ids = count(1)
+        self.listen_keys = {}
+        self.subscribers = {}
+        self.latency = LatencyHistogram()
+        self.last_sent = {}
+        self.books = {symbol: dict(update_id=0, bids={}, asks={}) for symbol in self.prices}
+        self.trade_ids = count(1)
+        for symbol, price in self.prices.items():
+            self._update_book(symbol=symbol, price=price)
+        self.routes = {
+            ('get', 'ping'): lambda params: {},
+            ('get', 'time'): lambda params: {'serverTime': int(time() * 1000)},
+            ('get', 'exchangeInfo'): self.exchange_info,
+            ('get', 'klines'): self.get_klines,
+            ('get', 'depth'): self.depth,
+            ('get', 'account'): self.account,
+            ('get', 'balance'): self.account_balance,
+            ('get', 'positionRisk'): self.position_risk,
+            ('post', 'order'): self.create_order,
+            ('post', 'batchOrders'): self.create_batch_orders,
+            ('get', 'order'): self.get_order,
+            ('delete', 'order'): self.cancel_order,
+            ('get', 'openOrders'): self.open_orders,
+            ('post', 'listenKey'): self.create_listen_key,
+            ('put', 'listenKey'): lambda params: {},
+            ('delete', 'listenKey'): lambda params: {},
+            ('get', 'stats'): self.stats,
+        }
+
+    @staticmethod
+    def _shift(rows, interval: str, cursor: int):
+        """
+        Moves open times so the first replayed kline opens in the current interval, history then ends now
+        as the bot expects on a cold start
+
+        :return: shifted copy of rows
+        """
+        step = interval_to_ms(interval)
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        if len(rows):
+            rows[:, 0] += int(time() * 1000) // step * step - rows[cursor, 0]
+        return rows
+
+    def start(self):
+        for key in self.klines:
+            self._schedule_tick(key=key, tick=0)
+
+    def handle(self, method: str, endpoint: str, params: dict):
+        route = self.routes.get((method, endpoint))
+        if route is None:
+            raise MockError(-1000, f"Unknown endpoint {method.upper()} {endpoint}")
+        return route(params)
+
+    def exchange_info(self, params):
+        symbols = []
+        for symbol in self.prices:
+            symbols.append(dict(
+                symbol=symbol, status='TRADING', pricePrecision=self.PRICE_PRECISION,
+                quantityPrecision=self.QUANTITY_PRECISION, filters=[
+                    dict(filterType='PRICE_FILTER', tickSize=f"{10 ** -self.PRICE_PRECISION:f}",
+                         minPrice='0.01', maxPrice='1000000'),
+                    dict(filterType='LOT_SIZE', stepSize=f"{10 ** -self.QUANTITY_PRECISION:f}",
+                         minQty=f"{10 ** -self.QUANTITY_PRECISION:f}", maxQty='100000'),
+                    dict(filterType='MARKET_LOT_SIZE', stepSize=f"{10 ** -self.QUANTITY_PRECISION:f}",
+                         minQty=f"{10 ** -self.QUANTITY_PRECISION:f}", maxQty='100000'),
+                    dict(filterType='MIN_NOTIONAL', notional='5'),
+                ],
+            ))
+        return dict(timezone='UTC', serverTime=int(time() * 1000), symbols=symbols)
+
+    def get_klines(self, params):
+        key = (params['symbol'], params['interval'])
+        if key not in self.klines:
+            raise MockError(-1121, 'Invalid symbol.')
+        rows = self.klines[key][:self.cursors[key]]
+        if 'startTime' in params:
+            rows = rows[rows[:, 0] >= int(params['startTime'])]
+        if 'endTime' in params:
+            rows = rows[rows[:, 0] <= int(params['endTime'])]
+        limit = int(params.get('limit', 500))
+        rows = rows[:limit] if 'startTime' in params else rows[-limit:]
+        step = interval_to_ms(params['interval'])
+        return [[int(row[0]), f"{row[1]}", f"{row[2]}", f"{row[3]}", f"{row[4]}", f"{row[5]}",
+                 int(row[0]) + step - 1, '0', 0, '0', '0', '0'] for row in rows.tolist()]
+
+    def depth(self, params):
+        if params['symbol'] not in self.books:
+            raise MockError(-1121, 'Invalid symbol.')
+        book, limit = self.books[params['symbol']], int(params.get('limit', 500))
+        bids = sorted(book['bids'].items(), reverse=True)[:limit]
+        asks = sorted(book['asks'].items())[:limit]
+        return dict(
+            lastUpdateId=book['update_id'], E=int(time() * 1000), T=int(time() * 1000),
+            bids=[[f"{price}", f"{quantity}"] for price, quantity in bids],
+            asks=[[f"{price}", f"{quantity}"] for price, quantity in asks],
+        )
+
+    def account(self, params):
+        return dict(
+            totalWalletBalance=f"{self.balance}",
+            assets=[dict(asset='USDT', walletBalance=f"{self.balance}", marginBalance=f"{self.balance}",
+                         availableBalance=f"{self.balance}")],
+            positions=[dict(symbol=position['symbol'], positionAmt=position['positionAmt'],
+                            entryPrice=position['entryPrice'], unrealizedProfit=position['unRealizedProfit'],
+                            positionSide='BOTH') for position in self.position_risk({})],
+        )
+
+    def account_balance(self, params):
+        return [dict(asset='USDT', balance=f"{self.balance}", availableBalance=f"{self.balance}")]
+
+    def position_risk(self, params):
+        positions = []
+        for symbol, (amount, entry) in self.positions.items():
+            if params.get('symbol', symbol) != symbol:
+                continue
+            positions.append(dict(
+                symbol=symbol, positionAmt=f"{amount}", entryPrice=f"{entry}", markPrice=f"{self.prices[symbol]}",
+                unRealizedProfit=f"{amount * (self.prices[symbol] - entry)}", marginType='cross',
+                positionSide='BOTH', leverage='20',
+            ))
+        return positions
+
+    def create_order(self, params):
+        symbol = params.get('symbol')
+        if symbol not in self.prices:
+            raise MockError(-1121, 'Invalid symbol.')
+        if symbol in self.last_sent:
+            self.latency.observe(perf_counter() - self.last_sent[symbol])
+        client_id = params.get('newClientOrderId') or f"mock{next(self.order_ids)}"
+        if client_id in self.orders:
+            raise MockError(-4015, 'Client order id is not valid.')
+        order = dict(
+            orderId=next(self.order_ids), clientOrderId=client_id, symbol=symbol, side=params['side'],
+            type=params['type'], status='NEW', origQty=params.get('quantity', '0'), executedQty='0',
+            price=params.get('price', '0'), avgPrice='0', stopPrice=params.get('stopPrice', '0'),
+            activatePrice=params.get('activationPrice', f"{self.prices[symbol]}"),
+            priceRate=params.get('callbackRate'), reduceOnly=params.get('reduceOnly') == 'true',
+            closePosition=params.get('closePosition') == 'true', updateTime=int(time() * 1000),
+            timeInForce=params.get('timeInForce', 'GTC'),
+        )
+        order['extreme'] = float(order['activatePrice'])
+        self.orders[client_id] = order
+        price = self.prices[symbol]
+        if order['type'] == 'MARKET':
+            self._fill(order=order, price=price)
+        elif order['type'] == 'LIMIT' and order['timeInForce'] in ('IOC', 'FOK'):
+            if price <= float(order['price']) if order['side'] == 'BUY' else price >= float(order['price']):
+                self._fill(order=order, price=price)
+            else:
+                order['status'] = 'EXPIRED'
+                self._order_event(order=order, execution='EXPIRED')
+        else:
+            self._order_event(order=order, execution='NEW')
+        return self._public(order)
+
+    def create_batch_orders(self, params):
+        responses = []
+        for order in json.loads(params['batchOrders']):
+            try:
+                responses.append(self.create_order(order))
+            except MockError as exc:
+                responses.append(dict(code=exc.code, msg=exc.msg))
+        return responses
+
+    def get_order(self, params):
+        return self._public(self._find(params))
+
+    def cancel_order(self, params):
+        order = self._find(params)
+        if order['status'] not in ('NEW', 'PARTIALLY_FILLED'):
+            raise MockError(-2011, 'Unknown order sent.')
+        order['status'] = 'CANCELED'
+        self._order_event(order=order, execution='CANCELED')
+        return self._public(order)
+
+    def open_orders(self, params):
+        return [self._public(order) for order in self.orders.values()
+                if order['status'] == 'NEW' and params.get('symbol', order['symbol']) == order['symbol']]
+
+    def create_listen_key(self, params):
+        listen_key = f"mock{next(self.order_ids):060d}"
+        self.listen_keys[listen_key] = True
+        return {'listenKey': listen_key}
+
+    def stats(self, params):
+        return dict(orders=len(self.orders), latency=self.latency.summary(),
+                    cursors={f"{symbol}@{interval}": cursor for (symbol, interval), cursor in self.cursors.items()})
+
+    def subscribe(self, protocol, path: str, params: dict):
+        if path.startswith('/stream'):
+            for stream in params.get('streams', [''])[0].split('/'):
+                self.subscribers.setdefault(stream, []).append((protocol, True))
+        else:
+            self.subscribers.setdefault(path[len('/ws/'):], []).append((protocol, False))
+
+    def unsubscribe(self, protocol):
+        for stream, protocols in self.subscribers.items():
+            self.subscribers[stream] = [item for item in protocols if item[0] is not protocol]
+
+    def publish(self, stream: str, payload: dict):
+        raw, wrapped = None, None
+        for protocol, combined in self.subscribers.get(stream, []):
+            if combined:
+                wrapped = wrapped or json.dumps({'stream': stream, 'data': payload}).encode('utf8')
+                protocol.sendMessage(wrapped)
+            else:
+                raw = raw or json.dumps(payload).encode('utf8')
+                protocol.sendMessage(raw)
+
+    def _schedule_tick(self, key: tuple, tick: int):
+        delay = interval_to_ms(key[1]) / 1000 / self.speed / self.ticks
+        reactor.callLater(delay, self._tick, key, tick)
+
+    def _tick(self, key: tuple, tick: int):
+        symbol, interval = key
+        cursor = self.cursors[key]
+        if cursor >= len(self.klines[key]):
+            return
+        time_, open_, high, low, close, volume = self.klines[key][cursor].tolist()
+        path = (open_, high, low, close) if close < open_ else (open_, low, high, close)
+        seen = path[:int(len(path) * (tick + 1) / self.ticks) or 1]
+        price = close if tick == self.ticks - 1 else seen[-1]
+        closed = tick == self.ticks - 1
+        previous = self.prices[symbol]
+        self.prices[symbol] = price
+        self._match(symbol=symbol, price=price)
+        self._publish_book(symbol=symbol, price=price)
+        now = int(time() * 1000)
+        self.publish(f"{symbol.lower()}@aggTrade", {
+            'e': 'aggTrade', 'E': now, 's': symbol, 'a': next(self.trade_ids), 'p': f"{price}",
+            'q': f"{round(volume / self.ticks, self.QUANTITY_PRECISION)}", 'f': 0, 'l': 0, 'T': now,
+            'm': price < previous,
+        })
+        self.last_sent[symbol] = perf_counter()
+        step = interval_to_ms(interval)
+        self.publish(f"{symbol.lower()}@kline_{interval}", {
+            'e': 'kline', 'E': int(time() * 1000), 's': symbol, 'k': {
+                't': int(time_), 'T': int(time_) + step - 1, 's': symbol, 'i': interval, 'o': f"{open_}",
+                'c': f"{price}", 'h': f"{max(seen + (price,))}", 'l': f"{min(seen + (price,))}",
+                'v': f"{volume * (tick + 1) / self.ticks}", 'n': 0, 'x': closed, 'q': '0', 'V': '0', 'Q': '0',
+                'B': '0',
+            },
+        })
+        if closed:
+            self.cursors[key] += 1
+        self._schedule_tick(key=key, tick=0 if closed else tick + 1)
+
+    def _update_book(self, symbol: str, price: float):
+        """
+        Rebuilds synthetic book of BOOK_LEVELS levels per side around price
+
+        :return: tuple(changed bids, changed asks) as lists of [price, quantity], removed levels have quantity 0
+        """
+        book = self.books[symbol]
+        step = max(round(price * self.BOOK_STEP, self.PRICE_PRECISION), 10 ** -self.PRICE_PRECISION)
+        changes = []
+        for side, direction in (('bids', -1), ('asks', 1)):
+            levels = {round(price + direction * step * (level + 1), self.PRICE_PRECISION):
+                      round(0.05 * (level + 1), self.QUANTITY_PRECISION) for level in range(self.BOOK_LEVELS)}
+            old = book[side]
+            changed = [[f"{level}", f"{quantity}"] for level, quantity in levels.items() if old.get(level) != quantity]
+            changed += [[f"{level}", "0"] for level in old if level not in levels]
+            book[side] = levels
+            changes.append(changed)
+        return changes
+
+    def _publish_book(self, symbol: str, price: float):
+        book = self.books[symbol]
+        bids, asks = self._update_book(symbol=symbol, price=price)
+        previous = book['update_id']
+        book['update_id'] += len(bids) + len(asks) or 1
+        self.publish(f"{symbol.lower()}@depth@100ms", {
+            'e': 'depthUpdate', 'E': int(time() * 1000), 'T': int(time() * 1000), 's': symbol,
+            'U': previous + 1, 'u': book['update_id'], 'pu': previous, 'b': bids, 'a': asks,
+        })
+
+    def _match(self, symbol: str, price: float):
+        for order in list(self.orders.values()):
+            if order['symbol'] != symbol or order['status'] != 'NEW':
+                continue
+            buy = order['side'] == 'BUY'
+            if order['type'] == 'LIMIT':
+                triggered = price <= float(order['price']) if buy else price >= float(order['price'])
+            elif order['type'] in ('STOP_MARKET', 'STOP'):
+                triggered = price >= float(order['stopPrice']) if buy else price <= float(order['stopPrice'])
+            elif order['type'] == 'TRAILING_STOP_MARKET':
+                rate = float(order['priceRate']) / 100
+                order['extreme'] = min(order['extreme'], price) if buy else max(order['extreme'], price)
+                triggered = price >= order['extreme'] * (1 + rate) if buy else \
+                    price <= order['extreme'] * (1 - rate)
+            else:
+                triggered = False
+            if triggered:
+                self._fill(order=order, price=price)
+
+    def _fill(self, order: dict, price: float):
+        symbol = order['symbol']
+        amount, entry = self.positions[symbol]
+        direction = 1 if order['side'] == 'BUY' else -1
+        quantity = abs(amount) if order['closePosition'] else float(order['origQty'])
+        if order['reduceOnly'] or order['closePosition']:
+            quantity = min(quantity, abs(amount)) if amount * direction < 0 else 0.0
+        realized = 0.0
+        if amount and amount * direction < 0:
+            realized = min(quantity, abs(amount)) * (price - entry) * (1 if amount > 0 else -1)
+        new_amount = round(amount + direction * quantity, 12)
+        if not new_amount:
+            entry = 0.0
+        elif amount * direction >= 0:
+            entry = (abs(amount) * entry + quantity * price) / abs(new_amount)
+        elif new_amount * amount < 0:
+            entry = price
+        commission = quantity * price * self.fee
+        self.balance += realized - commission
+        self.positions[symbol] = [new_amount, entry]
+        order.update(status='FILLED', executedQty=f"{quantity}", avgPrice=f"{price}", updateTime=int(time() * 1000))
+        self._order_event(order=order, execution='TRADE', last_quantity=quantity, price=price, commission=commission,
+                          realized=realized)
+        self._user_event({
+            'e': 'ACCOUNT_UPDATE', 'E': int(time() * 1000), 'T': int(time() * 1000), 'a': {
+                'm': 'ORDER',
+                'B': [{'a': 'USDT', 'wb': f"{self.balance}", 'cw': f"{self.balance}"}],
+                'P': [{'s': symbol, 'pa': f"{new_amount}", 'ep': f"{entry}", 'cr': '0',
+                       'up': f"{new_amount * (price - entry)}", 'mt': 'cross', 'iw': '0', 'ps': 'BOTH'}],
+            },
+        })
+
+    def _order_event(self, order: dict, execution: str, last_quantity: float = 0.0, price: float = 0.0,
+                     commission: float = 0.0, realized: float = 0.0):
+        now = int(time() * 1000)
+        self._user_event({'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now, 'o': {
+            's': order['symbol'], 'c': order['clientOrderId'], 'S': order['side'], 'o': order['type'],
+            'f': order['timeInForce'], 'q': order['origQty'], 'p': order['price'], 'ap': order['avgPrice'],
+            'sp': order['stopPrice'], 'x': execution, 'X': order['status'], 'i': order['orderId'],
+            'l': f"{last_quantity}", 'z': order['executedQty'], 'L': f"{price}", 'n': f"{commission}", 'N': 'USDT',
+            'T': now, 't': 0, 'b': '0', 'a': '0', 'm': False, 'R': order['reduceOnly'], 'wt': 'CONTRACT_PRICE',
+            'ot': order['type'], 'ps': 'BOTH', 'cp': order['closePosition'], 'rp': f"{realized}",
+        }})
+
+    def _user_event(self, payload: dict):
+        for listen_key in self.listen_keys:
+            self.publish(listen_key, payload)
+
+    def _find(self, params: dict):
+        order = self.orders.get(params.get('origClientOrderId'))
+        if order is None:
+            for candidate in self.orders.values():
+                if str(candidate['orderId']) == params.get('orderId'):
+                    order = candidate
+        if order is None:
+            raise MockError(-2013, 'Order does not exist.')
+        return order
+
+    @staticmethod
+    def _public(order: dict):
+        return {key: value for key, value in order.items() if key != 'extreme'}
+
+
+class MockRestResource(Resource):
+
+    isLeaf = True
+
+    def __init__(self, exchange: MockExchange):
+        super().__init__()
+        self.exchange = exchange
+
+    def render(self, request):
+        params = {key.decode(): values[0].decode() for key, values in request.args.items()}
+        endpoint = request.path.decode().rstrip('/').rsplit('/', 1)[-1]
+        try:
+            body = self.exchange.handle(method=request.method.decode().lower(), endpoint=endpoint, params=params)
+        except MockError as exc:
+            request.setResponseCode(400)
+            body = {'code': exc.code, 'msg': exc.msg}
+        except (KeyError, ValueError) as exc:
+            request.setResponseCode(400)
+            body = {'code': -1102, 'msg': f"Mandatory parameter missing or malformed: {exc}"}
+        request.setHeader(b'content-type', b'application/json')
+        return json.dumps(body).encode('utf8')
+
+
+class MockStreamProtocol(WebSocketServerProtocol):
+
+    SPOT_PREFIX = '/spot/'
+
+    def onConnect(self, request):
+        if request.path.startswith(self.SPOT_PREFIX):
+            print(f"Refused spot stream {request.path[len(self.SPOT_PREFIX):]}", flush=True)
+            raise ConnectionDeny(ConnectionDeny.NOT_FOUND, 'Mock exchange serves futures streams only')
+        self.factory.exchange.subscribe(protocol=self, path=request.path, params=request.params)
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.exchange.unsubscribe(protocol=self)
+
+
+def serve(exchange: MockExchange, port: int = 8080, ws_port: int = 8081):
+    """
+    Starts REST and websocket listeners and replay on the twisted reactor, reactor has to be run by caller
+    """
+    reactor.listenTCP(port, Site(MockRestResource(exchange=exchange)))
+    factory = WebSocketServerFactory(f"ws://127.0.0.1:{ws_port}")
+    factory.protocol = MockStreamProtocol
+    factory.exchange = exchange
+    reactor.listenTCP(ws_port, factory)
+    exchange.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock binance futures exchange replaying historical klines')
+    parser.add_argument('klines', nargs='+', help='SYMBOL:INTERVAL:path to csv, parquet or kline store db')
+    parser.add_argument('--speed', type=float, default=60.0, help='replay speed multiplier')
+    parser.add_argument('--balance', type=float, default=10000.0)
+    parser.add_argument('--history', type=int, default=500, help='klines available before replay starts')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ws-port', type=int, default=8081)
+    args = parser.parse_args()
+
+    klines = {}
+    for source in args.klines:
+        symbol, interval, path = source.split(':', 2)
+        klines[(symbol, interval)] = load_klines(path=path, symbol=symbol, interval=interval)
+    exchange = MockExchange(klines=klines, speed=args.speed, balance=args.balance, history=args.history)
+    serve(exchange=exchange, port=args.port, ws_port=args.ws_port)
+    print(f"Mock exchange on http://127.0.0.1:{args.port} ws://127.0.0.1:{args.ws_port}")
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import csv
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import numpy as np
+from backtest import Backtester, resample_klines
+
+_klines = {}
+
+
+def _init_worker(paths: dict):
+    """
+    Memory maps candle arrays once per worker process, tasks only carry parameters and time bounds
+    """
+    for interval, path in paths.items():
+        _klines[interval] = np.load(path, mmap_mode='r')
+
+
+def _evaluate(strategy_cls, symbol: str, params: dict, start: float, end: float, vectorized: bool,
+              backtest_kwargs: dict):
+    klines = _klines[params['interval']]
+    times = klines[:, 0]
+    warmup = backtest_kwargs.get('warmup', 500)
+    first = max(int(np.searchsorted(times, start)) - warmup, 0)
+    last = int(np.searchsorted(times, end))
+    tester = Backtester(strategy_cls=strategy_cls, klines=klines[first:last], symbol=symbol,
+                        leverage=params['leverage'], tracker=params['tracker'], **backtest_kwargs)
+    report = tester.run_vectorized() if vectorized else tester.run()
+    return dict(**params, start=float(start), end=float(end), pnl=report.pnl, max_drawdown=report.max_drawdown,
+                trades=len(report.trades), win_rate=report.win_rate, fees=report.fees)
+
+
+class Optimizer:
+
+    COLUMNS = ['interval', 'leverage', 'tracker', 'start', 'end', 'pnl', 'max_drawdown', 'trades', 'win_rate', 'fees']
+
+    def __init__(self, strategy_cls, klines: np.ndarray, symbol: str, intervals: tuple = ('1m',),
+                 results_path: str = 'sweep.csv', workers: int = None, metric: str = 'pnl', vectorized: bool = False,
+                 **backtest_kwargs):
+        """
+        Runs Backtester over parameter combinations in a process pool
+
+        :param strategy_cls: Strategy class, must be importable by worker processes
+        :param klines: base klines from backtest.load_klines, resampled for every interval of the sweep
+        :param intervals: intervals that can appear in combinations
+        :param results_path: csv file every finished backtest is appended to
+        :param workers: amount of processes, os.cpu_count() if None
+        :param metric: report attribute maximized by walk_forward
+        :param vectorized: use Backtester.run_vectorized
+        :param backtest_kwargs: balance, fee, warmup for Backtester
+        """
+        self.strategy_cls = strategy_cls
+        self.klines = np.asarray(klines, dtype=np.float64)
+        self.symbol = symbol
+        self.intervals = intervals
+        self.results_path = results_path
+        self.workers = workers or os.cpu_count()
+        self.metric = metric
+        self.vectorized = vectorized
+        self.backtest_kwargs = backtest_kwargs
+
+    @staticmethod
+    def grid(space: dict):
+        """
+        :param space: dict(interval=[..], leverage=[..], tracker=[..])
+        :return: list of every combination
+        """
+        return [dict(zip(space, values)) for values in product(*space.values())]
+
+    @staticmethod
+    def random(space: dict, samples: int, seed: int = None):
+        """
+        :param space: parameter -> list of choices or tuple(low, high) for uniform sampling
+        :param samples: amount of combinations
+        """
+        generator = random.Random(seed)
+        combinations = []
+        for _ in range(samples):
+            combination = {}
+            for name, values in space.items():
+                if isinstance(values, tuple):
+                    low, high = values
+                    combination[name] = generator.randint(low, high) if isinstance(low, int) else \
+                        generator.uniform(low, high)
+                else:
+                    combination[name] = generator.choice(values)
+            combinations.append(combination)
+        return combinations
+
+    def walk_forward_splits(self, train: int, test: int):
+        """
+        Rolling splits in milliseconds over the base klines
+
+        :param train: in-sample length in ms
+        :param test: out-of-sample length in ms
+        :return: list(tuple(train_start, train_end, test_end), ..)
+        """
+        first, last = self.klines[0, 0], self.klines[-1, 0]
+        splits, start = [], first
+        while start + train + test <= last:
+            splits.append((start, start + train, start + train + test))
+            start += test
+        return splits
+
+    def run(self, combinations: list, start: float = None, end: float = None):
+        """
+        Evaluates combinations on [start, end) and streams results to results_path as they finish
+
+        :rtype: list(dict)
+        """
+        return self._sweep(tasks=[(combination, start, end) for combination in combinations])
+
+    def walk_forward(self, combinations: list, train: int, test: int):
+        """
+        Picks the best combination by metric on every in-sample window and evaluates it on the next
+        out-of-sample window
+
+        :return: list(dict(train=result, test=result), ..)
+        """
+        splits = self.walk_forward_splits(train=train, test=test)
+        tasks = [(combination, split[0], split[1]) for split in splits for combination in combinations]
+        in_sample = self._sweep(tasks=tasks)
+        best = []
+        for train_start, train_end, test_end in splits:
+            results = [result for result in in_sample if result['start'] == train_start]
+            best.append(max(results, key=lambda result: result[self.metric]))
+        params = [{key: result[key] for key in ('interval', 'leverage', 'tracker')} for result in best]
+        out_sample = self._sweep(tasks=[
+            (combination, split[1], split[2]) for combination, split in zip(params, splits)
+        ])
+        out_sample.sort(key=lambda result: result['start'])
+        return [dict(train=train_result, test=test_result) for train_result, test_result in zip(best, out_sample)]
+
+    def _sweep(self, tasks: list):
+        directory = tempfile.mkdtemp(prefix='sweep')
+        try:
+            paths = {}
+            for interval in {task[0].get('interval', self.intervals[0]) for task in tasks}:
+                paths[interval] = os.path.join(directory, f"{interval}.npy")
+                np.save(paths[interval], resample_klines(klines=self.klines, interval=interval))
+            results = []
+            write_header = not os.path.isfile(self.results_path)
+            with open(self.results_path, 'a', newline='') as file, \
+                    ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                        initargs=(paths,)) as pool:
+                writer = csv.DictWriter(file, fieldnames=self.COLUMNS, extrasaction='ignore')
+                if write_header:
+                    writer.writeheader()
+                futures = []
+                for params, start, end in tasks:
+                    params = dict(params)
+                    params.setdefault('interval', self.intervals[0])
+                    futures.append(pool.submit(
+                        _evaluate, self.strategy_cls, self.symbol, params,
+                        self.klines[0, 0] if start is None else start,
+                        self.klines[-1, 0] + 1 if end is None else end,
+                        self.vectorized, self.backtest_kwargs,
+                    ))
+                for future in as_completed(futures):
+                    result = future.result()
+                    writer.writerow(result)
+                    file.flush()
+                    results.append(result)
+            return results
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,290 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+import numpy as np
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+
+class BookSide:
+
+    WALK_LEVELS = 64
+
+    def __init__(self, descending: bool = False):
+        """
+        Price levels of one side kept sorted best first in numpy arrays
+
+        :param descending: True for bids, prices are stored negated so both sides sort ascending
+        """
+        self.sign = -1.0 if descending else 1.0
+        self.keys = np.empty(0, dtype=np.float64)
+        self.quantities = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def prices(self):
+        return self.keys * self.sign
+
+    def load(self, levels: list):
+        """
+        :param levels: list([price str, quantity str], ..) of REST depth snapshot
+        """
+        rows = np.asarray(levels, dtype=np.float64).reshape(-1, 2)
+        rows = rows[rows[:, 1] > 0]
+        order = np.argsort(rows[:, 0] * self.sign, kind='stable')
+        self.keys = rows[order, 0] * self.sign
+        self.quantities = rows[order, 1]
+
+    def apply(self, levels: list):
+        """
+        Sets quantities of changed levels, zero quantity removes the level
+
+        :param levels: list([price str, quantity str], ..) of depth update
+        """
+        if not levels:
+            return
+        rows = np.asarray(levels, dtype=np.float64).reshape(-1, 2)
+        keys = rows[:, 0] * self.sign
+        index = np.searchsorted(self.keys, keys)
+        found = index < len(self.keys)
+        found[found] = self.keys[index[found]] == keys[found]
+        self.quantities[index[found]] = rows[found, 1]
+        new = ~found & (rows[:, 1] > 0)
+        if new.any():
+            keys = np.concatenate((self.keys, keys[new]))
+            quantities = np.concatenate((self.quantities, rows[new, 1]))
+            order = np.argsort(keys, kind='stable')
+            self.keys, self.quantities = keys[order], quantities[order]
+        if found.any() and not rows[found, 1].all():
+            keep = self.quantities > 0
+            self.keys, self.quantities = self.keys[keep], self.quantities[keep]
+
+    def best(self):
+        return float(self.keys[0] * self.sign) if len(self.keys) else None
+
+    def fill(self, quantity: float):
+        """
+        Walks levels from the best one
+
+        :return: tuple(average price, worst price) of filling quantity, (None, None) if side is too thin
+        """
+        end = min(len(self.quantities), self.WALK_LEVELS)
+        filled = np.cumsum(self.quantities[:end])
+        while end < len(self.quantities) and filled[-1] < quantity:
+            end = min(len(self.quantities), end * 4)
+            filled = np.cumsum(self.quantities[:end])
+        last = int(np.searchsorted(filled, quantity))
+        if not quantity or last >= len(filled):
+            return None, None
+        taken = self.quantities[:last + 1].copy()
+        taken[-1] -= filled[last] - quantity
+        prices = self.keys[:last + 1] * self.sign
+        return float(np.dot(prices, taken) / quantity), float(prices[-1])
+
+
+class TradeTape:
+
+    FIELDS = ('time', 'price', 'quantity', 'sell')
+
+    def __init__(self, capacity: int = 1000):
+        """
+        Ring buffer of the latest aggregated trades
+
+        :param capacity: amount of trades kept
+        """
+        self.capacity = capacity
+        self.size = 0
+        self._head = 0
+        self._data = np.zeros((len(self.FIELDS), capacity), dtype=np.float64)
+
+    def add(self, trade: dict):
+        """
+        :param trade: aggTrade stream message
+        """
+        self._data[:, self._head] = (trade['T'], float(trade['p']), float(trade['q']), trade['m'])
+        self._head = (self._head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    @property
+    def last_price(self):
+        return self._data[1, self._head - 1] if self.size else None
+
+    def vwap(self, since: int):
+        """
+        :param since: trade time in milliseconds
+        :return: volume weighted price of trades since given time, None if there were none
+        """
+        time, price, quantity = self._data[0, :self.size], self._data[1, :self.size], self._data[2, :self.size]
+        recent = time >= since
+        volume = quantity[recent].sum()
+        return float(np.dot(price[recent], quantity[recent]) / volume) if volume else None
+
+    def imbalance(self, since: int):
+        """
+        :return: (buy volume - sell volume) / volume of taker trades since given time, None if there were none
+        """
+        time, quantity, sell = self._data[0, :self.size], self._data[2, :self.size], self._data[3, :self.size]
+        recent = time >= since
+        volume = quantity[recent].sum()
+        return float(np.dot(quantity[recent], 1 - 2 * sell[recent]) / volume) if volume else None
+
+
+class OrderBook:
+
+    DEPTH = 1000
+    MAX_BUFFERED = 1000
+    RETRY_DELAY = 0.5
+    MAX_RETRY_DELAY = 30.0
+
+    def __init__(self, symbol: str, client, depth: int = DEPTH):
+        """
+        Local futures order book built from a REST snapshot and the diff depth stream. Updates are
+        sequenced by U/u/pu, a gap drops the book and loads a new snapshot on a worker thread. A failed
+        snapshot request or a snapshot older than the buffered updates is retried with growing delay
+
+        :param client: binance Client
+        :param depth: levels requested with the snapshot
+        """
+        self.symbol = symbol
+        self.client = client
+        self.depth = depth
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide()
+        self.trades = TradeTape()
+        self.last_update_id = None
+        self.synced = False
+        self.resyncs = 0
+        self._first = False
+        self._pending = False
+        self._failures = 0
+        self._buffer = []
+        self._lock = Lock()
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'book-{symbol}')
+
+    @property
+    def depth_stream(self):
+        return f"{self.symbol.lower()}@depth@100ms"
+
+    @property
+    def trade_stream(self):
+        return f"{self.symbol.lower()}@aggTrade"
+
+    def on_depth(self, msg: dict):
+        """
+        Handles depthUpdate message, buffers it while snapshot is loading
+        """
+        with self._lock:
+            if not self.synced:
+                self._buffer.append(msg)
+                del self._buffer[:-self.MAX_BUFFERED]
+                self._request_snapshot()
+                return
+            if not self._apply(msg=msg):
+                self._reset(msg=msg)
+
+    def on_trade(self, msg: dict):
+        self.trades.add(trade=msg)
+
+    def resync(self):
+        """
+        Drops the book and loads a new snapshot, e.g. after the depth stream reconnected
+        """
+        with self._lock:
+            self._reset()
+
+    def snapshot(self):
+        try:
+            data = self.client.futures_order_book(symbol=self.symbol, limit=self.depth)
+        except Exception as exc:
+            log_warns.exception(exc)
+            with self._lock:
+                self._retry()
+            return {'msg': exc}
+        with self._lock:
+            self.bids.load(levels=data['bids'])
+            self.asks.load(levels=data['asks'])
+            self.last_update_id = data['lastUpdateId']
+            self.synced, self._first = True, True
+            buffered, self._buffer = self._buffer, []
+            for position, msg in enumerate(buffered):
+                if not self._apply(msg=msg):
+                    self.synced = False
+                    self._buffer = buffered[position:]
+                    self._retry()
+                    return
+            self._pending, self._failures = False, 0
+
+    def estimate(self, side: str, quantity: float):
+        """
+        Expected fill of a MARKET order against the book
+
+        :param side: BUY or SELL
+        :return: tuple(average price, slippage of average price from best price as fraction),
+                 (None, None) if book is not synced or too thin for the quantity
+        """
+        with self._lock:
+            if not self.synced:
+                return None, None
+            book_side = self.asks if side == 'BUY' else self.bids
+            best = book_side.best()
+            price, _ = book_side.fill(quantity=quantity)
+        if price is None:
+            return None, None
+        return price, abs(price - best) / best
+
+    def best_prices(self):
+        """
+        :return: tuple(best bid, best ask), None for a side that is empty or not synced
+        """
+        with self._lock:
+            if not self.synced:
+                return None, None
+            return self.bids.best(), self.asks.best()
+
+    def mid_price(self):
+        bid, ask = self.best_prices()
+        return (bid + ask) / 2 if bid and ask else None
+
+    def _apply(self, msg: dict):
+        """
+        :return: False if msg does not continue the book
+        """
+        if msg['u'] < self.last_update_id:
+            return True
+        if self._first:
+            if msg['U'] > self.last_update_id:
+                return False
+            self._first = False
+        elif msg.get('pu') != self.last_update_id:
+            return False
+        self.bids.apply(levels=msg['b'])
+        self.asks.apply(levels=msg['a'])
+        self.last_update_id = msg['u']
+        return True
+
+    def _reset(self, msg: dict = None):
+        if self.synced:
+            log_warns.warning('Order book %s out of sync at update %s, reloading snapshot', self.symbol,
+                              self.last_update_id)
+            self.resyncs += 1
+        self.synced = False
+        self._buffer = [msg] if msg else []
+        self._request_snapshot()
+
+    def _request_snapshot(self):
+        if not self._pending:
+            self._pending = True
+            self._worker.submit(self.snapshot)
+
+    def _retry(self):
+        """
+        Loads the snapshot again after a delay doubling with every consecutive failure, updates are buffered
+        meanwhile
+        """
+        delay = min(self.MAX_RETRY_DELAY, self.RETRY_DELAY * 2 ** self._failures)
+        self._failures += 1
+        timer = Timer(delay, self._worker.submit, args=(self.snapshot,))
+        timer.daemon = True
+        timer.start()
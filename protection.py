@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+from time import time
+from utils import Order, configure_logging
+
+log_warns = configure_logging()
+
+
+class ProtectiveOrders:
+
+    MODE_TRAILING = 'trailing'
+    MODE_STOP = 'stop'
+    TYPES = {MODE_TRAILING: 'TRAILING_STOP_MARKET', MODE_STOP: 'STOP_MARKET'}
+    CALLBACK_RATE_RANGE = (0.1, 5.0)
+    UNKNOWN_ORDER = -2011
+    RETRY_DELAY = 1.0
+    MAX_RETRY_DELAY = 60.0
+
+    def __init__(self, trader, mode: str = MODE_TRAILING):
+        """
+        Keeps one exchange-side stop for the position of trader symbol, derived from trader tracker.
+        Orders are placed and cancelled from a single worker thread, never from the stream threads. A check that
+        fails, e.g. because the old stop could not be cancelled, is repeated with growing delay
+
+        :param trader: BinanceTrader
+        :param mode: MODE_TRAILING for TRAILING_STOP_MARKET with callbackRate = tracker,
+                     MODE_STOP for STOP_MARKET closing position at tracker distance from entry price
+        """
+        self.trader = trader
+        self.mode = mode
+        self.order = None
+        self.wanted = None
+        self.amount = 0.0
+        self.pending = False
+        self._failures = 0
+        self._lock = Lock()
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'protect-{trader.symbol}')
+
+    def adopt(self):
+        """
+        Takes over protective order left on exchange by a previous run, cancels extra ones
+        """
+        try:
+            open_orders = self.trader.client.futures_get_open_orders(
+                symbol=self.trader.symbol,
+                timestamp=int(round(time()) * 1000) + self.trader.time_offset,
+                recvWindow=5000,
+            )
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        for info in open_orders:
+            if info['type'] != self.TYPES[self.mode] or not (info.get('reduceOnly') or info.get('closePosition')):
+                continue
+            order = Order(params=info, id_=info['clientOrderId'], db=self.trader.orders)
+            if self.order is None:
+                self.order = order
+            else:
+                self.trader.close_order(order=order)
+
+    def state(self):
+        """
+        :return: dict(amount=float, order=dict(id=str, params=dict) or None, wanted=dict or None) for snapshots
+        """
+        order = self.order
+        return dict(amount=self.amount, wanted=self.wanted,
+                    order=dict(id=order.id, params=order.params) if order is not None else None)
+
+    def restore(self, state: dict, amount: float):
+        """
+        Takes protective order from a snapshot if position did not change since, adopts open orders otherwise
+
+        :param amount: current position amount
+        """
+        if state is None or state['amount'] != amount:
+            return self.adopt()
+        self.amount, self.wanted = state['amount'], state['wanted']
+        if state['order'] is not None:
+            self.order = Order(params=state['order']['params'], id_=state['order']['id'], db=self.trader.orders)
+
+    def reconcile(self):
+        """
+        Schedules check of the protective order against cached position
+        """
+        with self._lock:
+            if self.pending:
+                return
+            self.pending = True
+        self._worker.submit(self._reconcile)
+
+    def supervise(self):
+        """
+        Called from kline loop, restores protection if an open position has none
+        """
+        if self.amount and self.order is None and not self.pending:
+            self.reconcile()
+
+    def on_order_update(self, response: dict):
+        """
+        Handles ORDER_TRADE_UPDATE of the protective order
+
+        :param response: 'o' field of the event with 'C' set to client order id
+        """
+        if self.order is None or response['C'] != self.order.id:
+            return
+        if response['X'] == self.trader.ORDER_STATUS_FILLED:
+            self.order, self.wanted = None, None
+            self.trader.long, self.trader.short = False, False
+        elif response['X'] in (self.trader.ORDER_STATUS_CANCELED, self.trader.ORDER_STATUS_EXPIRED,
+                               self.trader.ORDER_STATUS_REJECTED):
+            self.order, self.wanted = None, None
+            self.reconcile()
+
+    def _reconcile(self):
+        with self._lock:
+            self.pending = False
+        try:
+            position = next(iter(self.trader.positions()), None)
+            self.amount = float(position['positionAmt']) if position else 0.0
+            wanted = self.params(amount=self.amount, entry=float(position['entryPrice'])) if self.amount else None
+            if wanted == self.wanted and (wanted is None or self.order is not None):
+                self._failures = 0
+                return
+            if self.order is not None:
+                closed = self.trader.close_order(order=self.order)
+                if isinstance(closed, dict) and getattr(closed['msg'], 'code', None) != self.UNKNOWN_ORDER:
+                    log_warns.warning('Cancelling protective order %s of %s failed: %s', self.order.id,
+                                      self.trader.symbol, closed['msg'])
+                    return self._retry()
+                self.order, self.wanted = None, None
+            if wanted is not None:
+                self.place(params=wanted)
+            self._failures = 0
+        except Exception as exc:
+            log_warns.exception(exc)
+            self._retry()
+
+    def _retry(self):
+        """
+        Repeats the check after a delay doubling with every consecutive failure, reconcile calls meanwhile
+        are left to it
+        """
+        with self._lock:
+            if self.pending:
+                return
+            self.pending = True
+        delay = min(self.MAX_RETRY_DELAY, self.RETRY_DELAY * 2 ** self._failures)
+        self._failures += 1
+        timer = Timer(delay, self._worker.submit, args=(self._reconcile,))
+        timer.daemon = True
+        timer.start()
+
+    def params(self, amount: float, entry: float):
+        """
+        :return: dict of protective order parameters for position amount opened at entry price
+        """
+        side = 'SELL' if amount > 0 else 'BUY'
+        if self.mode == self.MODE_TRAILING:
+            low, high = self.CALLBACK_RATE_RANGE
+            return dict(symbol=self.trader.symbol, side=side, type=self.TYPES[self.mode], quantity=abs(amount),
+                        callbackRate=round(min(max(self.trader.tracker * 100, low), high), 1), reduceOnly='true')
+        stop_price = entry * (1 - self.trader.tracker) if amount > 0 else entry * (1 + self.trader.tracker)
+        return dict(symbol=self.trader.symbol, side=side, type=self.TYPES[self.mode], stopPrice=stop_price,
+                    closePosition='true')
+
+    def place(self, params: dict):
+        order = Order(params=dict(params), long=self.trader.long, short=self.trader.short)
+        error = self.trader.build_params(order=order, test=self.trader.test)
+        if error:
+            self.trader.order_failed(order=order, error=error)
+            return
+        self.trader.bus.publish(key="Order", value=f"Protecting position with: {order.params}")
+        try:
+            self.trader.client.futures_create_order(**order.params)
+        except Exception as exc:
+            log_warns.exception(exc)
+            self.trader.order_failed(order=order, error=exc)
+            return
+        self.order, self.wanted = order, params
+        order.to_db()
@@ -0,0 +1,342 @@
+import argparse
+import atexit
+import base64
+import gzip
+import importlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+from collections import defaultdict, deque
+from functools import wraps
+from threading import Thread, Event
+from time import time, sleep, perf_counter
+from urllib.parse import parse_qsl
+import requests
+from config import load_config
+from rest import RateLimitedClient, TokenBucket
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+KIND_WEBSOCKET = 'ws'
+KIND_REST = 'rest'
+KIND_CONFIG = 'config'
+
+
+def recorded(callback):
+    """
+    Decorates websocket callback methods, messages are recorded under the method name when the instance
+    has a recorder, so replay can call the same method again
+    """
+    name = callback.__name__
+
+    @wraps(callback)
+    def wrapper(self, msg):
+        if self.recorder is not None:
+            self.recorder.record(kind=KIND_WEBSOCKET, name=name, payload=msg)
+        return callback(self, msg)
+    return wrapper
+
+
+def encode_state(state):
+    """
+    Engine snapshot state as text for a config record, it holds numpy arrays and strategy objects
+    """
+    return base64.b64encode(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)).decode()
+
+
+def decode_state(text: str):
+    return pickle.loads(base64.b64decode(text))
+
+
+class TrafficRecorder(Thread):
+
+    FLUSH_INTERVAL = 1.0
+    ENCODER = json.JSONEncoder(separators=(',', ':'), default=str)
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL, *args, **kwargs):
+        """
+        Appends websocket messages and REST exchanges to a gzipped file of json lines
+        [time, kind, name, payload]. Callers only append to a deque, records are serialized and compressed
+        in this thread and flushed every flush_interval seconds, a crash loses at most the last interval.
+        Every run appends a new gzip member, so the file stays readable as one stream
+
+        :param path: log file, e.g. traffic.jsonl.gz
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._records = deque()
+        self._stopped = Event()
+        self._file = gzip.open(path, 'ab', compresslevel=1)
+        atexit.register(self.close)
+
+    def record(self, kind: str, name: str, payload):
+        """
+        Hot path, payload must not be changed afterwards as it is serialized later
+        """
+        self._records.append((time(), kind, name, payload))
+
+    def run(self):
+        while not self._stopped.wait(timeout=self.flush_interval):
+            self.write()
+
+    def write(self):
+        records, encode = self._records, self.ENCODER.encode
+        lines = []
+        while records:
+            lines.append(encode(records.popleft()))
+        if not lines:
+            return 0
+        try:
+            self._file.write(('\n'.join(lines) + '\n').encode())
+            self._file.flush()
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        self.written += len(lines)
+        return len(lines)
+
+    def close(self):
+        """
+        Writes remaining records and closes the file
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        self.write()
+        self._file.close()
+
+
+def read_traffic(path: str):
+    """
+    Reads records of a traffic log, a tail cut off by a crash is skipped
+
+    :return: generator of tuple(time, kind, name, payload)
+    """
+    with gzip.open(path, 'rb') as file:
+        try:
+            for line in file:
+                try:
+                    yield tuple(json.loads(line))
+                except ValueError:
+                    log_warns.warning('Traffic log %s ends with an incomplete record', path)
+                    return
+        except (EOFError, zlib.error, gzip.BadGzipFile) as exc:
+            log_warns.warning('Traffic log %s is truncated: %s', path, exc)
+
+
+class ReplayResponse:
+
+    def __init__(self, status_code: int, text: str, headers: dict = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplaySession:
+
+    NOT_RECORDED = json.dumps({'code': -1, 'msg': 'Not recorded'})
+
+    def __init__(self, records: list):
+        """
+        Stands in for requests.Session, answers every request with the next recorded response to the same
+        method, endpoint and symbol. Requests without one get a 400 error response
+
+        :param records: rest records of a traffic log
+        """
+        self.headers = {}
+        self.responses = defaultdict(deque)
+        for _, _, path, payload in records:
+            self.responses[(payload['method'], path, payload['params'].get('symbol'))].append(payload)
+        self.missing = defaultdict(int)
+
+    def request(self, method: str, uri: str, params=None, data=None, **kwargs):
+        path = uri.rstrip('/').rsplit('/', 1)[-1]
+        sent = dict(parse_qsl(params) if isinstance(params, str) else data or ())
+        key = (method, path, sent.get('symbol'))
+        responses = self.responses.get(key)
+        if not responses:
+            if not self.missing[key]:
+                log_warns.warning('No recorded response to %s %s %s', method.upper(), path, key[2] or '')
+            self.missing[key] += 1
+            return ReplayResponse(status_code=400, text=self.NOT_RECORDED)
+        payload = responses.popleft()
+        if 'error' in payload:
+            raise requests.ConnectionError(payload['error'])
+        return ReplayResponse(status_code=payload['status'], text=payload['body'], headers=payload['headers'])
+
+    def get(self, uri, **kwargs):
+        return self.request('get', uri, **kwargs)
+
+    def post(self, uri, **kwargs):
+        return self.request('post', uri, **kwargs)
+
+    def put(self, uri, **kwargs):
+        return self.request('put', uri, **kwargs)
+
+    def delete(self, uri, **kwargs):
+        return self.request('delete', uri, **kwargs)
+
+
+class ReplayClient(RateLimitedClient):
+
+    weights = TokenBucket(capacity=10 ** 9, period=1)
+    orders = TokenBucket(capacity=10 ** 9, period=1)
+
+    def __init__(self, records: list, api_key: str = 'replay', api_secret: str = 'replay', **kwargs):
+        """
+        RateLimitedClient served by a ReplaySession. Retries and parsing run as recorded, pacing, rate limit
+        pauses and backoff sleeps are skipped. Requests are signed with the placeholder keys
+
+        :param records: rest records of a traffic log
+        """
+        self.replay_session = ReplaySession(records=records)
+        kwargs.setdefault('sync_interval', 0)
+        super().__init__(api_key=api_key, api_secret=api_secret, **kwargs)
+
+    def _init_session(self):
+        return self.replay_session
+
+    def ping(self):
+        return {}
+
+    def _observe(self, response):
+        return 0.0
+
+    def _backoff(self, attempt: int, minimum: float = 0.0):
+        pass
+
+
+class ReplayClock:
+
+    MODULES = ('BinanceFuturesBot', 'store', 'protection', 'symbols')
+
+    def __init__(self, now: float = None):
+        """
+        Stands in for time.time of the bot modules, returns the recorded time of the message being replayed
+        """
+        self.now = time() if now is None else now
+
+    def __call__(self):
+        return self.now
+
+    def install(self, modules: tuple = MODULES):
+        for name in modules:
+            importlib.import_module(name).time = self
+
+
+class TrafficReplay:
+
+    def __init__(self, path: str):
+        """
+        Records of a traffic log for replay
+
+        :param path: file written by TrafficRecorder
+        """
+        records = list(read_traffic(path=path))
+        self.messages = [record for record in records if record[1] == KIND_WEBSOCKET]
+        self.rest = [record for record in records if record[1] == KIND_REST]
+        configs = {record[2]: record[3] for record in reversed(records) if record[1] == KIND_CONFIG}
+        self.config = configs.get('engine')
+        self.startup = configs.get('startup')
+        if self.startup is not None:
+            self.startup = dict(self.startup, state=decode_state(self.startup['state']))
+        self.clock = ReplayClock(now=self.startup['time'] if self.startup else records[0][0] if records else None)
+
+    def client(self, **kwargs):
+        return ReplayClient(records=self.rest, **kwargs)
+
+    def run(self, target, speed: float = 1.0, settle=None):
+        """
+        Calls websocket callbacks of target with recorded messages in their order
+
+        :param target: TradingEngine or BinanceTrader
+        :param speed: multiplier of recorded pace, 0 sends messages as fast as possible
+        :param settle: callable run after every message, waiting for its processing makes replay deterministic
+                       at any speed
+        :return: dict(messages=int, seconds=float, behind=float max seconds a message was late)
+        """
+        started, behind = perf_counter(), 0.0
+        first = self.messages[0][0] if self.messages else 0.0
+        for received, _, name, msg in self.messages:
+            self.clock.now = received
+            if speed:
+                delay = (received - first) / speed - (perf_counter() - started)
+                if delay > 0:
+                    sleep(delay)
+                else:
+                    behind = max(behind, -delay)
+            try:
+                getattr(target, name)(msg)
+            except Exception as exc:
+                log_warns.exception(exc)
+            if settle is not None:
+                settle()
+        return dict(messages=len(self.messages), seconds=perf_counter() - started, behind=behind)
+
+
+def wait_idle(engine, timeout: float = 30.0, poll_interval: float = 0.0002):
+    """
+    Waits until strategy workers processed all queued events and executors took all orders
+    """
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if not engine._scheduled and all(trader.events.empty() and trader.executor.queue.empty()
+                                         for trader in engine.traders.values()):
+            return True
+        sleep(poll_interval)
+    return False
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Replays a traffic log recorded with record in config '
+                                                 'against the bot with network stubbed')
+    parser.add_argument('path', help='traffic log, e.g. traffic.jsonl.gz')
+    parser.add_argument('--config', help='symbols to trade, the recorded ones by default')
+    parser.add_argument('--speed', type=float, default=1.0, help='pace multiplier, 0 replays as fast as possible')
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--overlap', action='store_true',
+                        help='do not wait for processing of a message before the next one, as live')
+    options = parser.parse_args(args)
+    replay = TrafficReplay(path=options.path)
+    config = load_config(options.config) if options.config else replay.config
+    if not config:
+        parser.error('traffic log has no recorded config, pass --config')
+    if replay.startup is None:
+        log_warns.warning('Traffic log %s has no recorded startup, klines are taken from recorded requests',
+                          options.path)
+    directory = tempfile.mkdtemp(prefix='replay')
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    from Models import use_database
+    use_database(os.path.join(directory, 'Orders.db'))
+    replay.clock.install()
+    from BinanceFuturesBot import TradingEngine
+    from events import EventBus
+    engine = TradingEngine(configs=config['symbols'], api_key=None, api_secret=None, bus=EventBus(),
+                           test=config['test'], max_workers=options.max_workers, client=replay.client(), daemon=True)
+    engine.prepare(startup=replay.startup)
+    result = replay.run(target=engine, speed=options.speed,
+                        settle=None if options.overlap else lambda: wait_idle(engine=engine))
+    wait_idle(engine=engine)
+    engine.orders.close()
+    print(f"Replayed {result['messages']} messages in {result['seconds']:.3f}s "
+          f"({result['messages'] / max(result['seconds'], 1e-9):.0f}/s), at most {result['behind']:.3f}s late")
+    print(f"Order latency: {engine.order_latency.summary()}")
+    missing = engine.client.replay_session.missing
+    if missing:
+        print(f"Requests without recorded response: {sum(missing.values())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import json
+import requests
+from random import uniform
+from threading import Lock, Timer
+from time import time, monotonic, sleep, perf_counter
+from binance.client import Client
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+from requests.adapters import HTTPAdapter
+from metrics import REST_SECONDS, REST_REQUESTS, REST_RETRIES
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+RECORDED_HEADERS = ('X-MBX-USED-WEIGHT-1M', 'X-MBX-ORDER-COUNT-10S', 'Retry-After')
+
+
+class TokenBucket:
+
+    def __init__(self, capacity: int, period: float):
+        """
+        Refills capacity tokens evenly over period seconds
+
+        :param capacity: limit of the exchange window
+        :param period: window length in seconds
+        """
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self._lock = Lock()
+
+    def acquire(self, amount: int = 1):
+        """
+        Blocks until amount tokens are available or a pause is over
+        """
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._refill(now=now)
+                if now >= self.paused_until and self.tokens >= min(amount, self.capacity):
+                    self.tokens -= amount
+                    return
+                wait = max(self.paused_until - now, (min(amount, self.capacity) - self.tokens) / self.rate)
+            sleep(wait)
+
+    def observe(self, used: int):
+        """
+        Lowers available tokens to what the exchange reports as left in the current window
+        """
+        with self._lock:
+            self._refill(now=monotonic())
+            self.tokens = min(self.tokens, self.capacity - used)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+            self.tokens = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimitedClient(Client):
+
+    WEIGHT_LIMIT = 2400
+    ORDER_LIMIT = 300
+    WEIGHTS = {
+        'account': 5,
+        'balance': 5,
+        'positionRisk': 5,
+        'allOrders': 5,
+        'userTrades': 5,
+        'batchOrders': 5,
+    }
+    RETRY_METHODS = ('get', 'put', 'delete')
+    RETRY_STATUS = (418, 429, 500, 502, 503, 504)
+    MAX_RETRIES = 4
+    BACKOFF = 0.25
+    BACKOFF_CAP = 8.0
+    SYNC_INTERVAL = 10 * 60
+    POOL_SIZE = 20
+
+    weights = TokenBucket(capacity=WEIGHT_LIMIT, period=60)
+    orders = TokenBucket(capacity=ORDER_LIMIT, period=10)
+    _session = None
+    _session_lock = Lock()
+
+    def __init__(self, api_key: str = None, api_secret: str = None, requests_params: dict = None, tld: str = 'com',
+                 sync_interval: float = SYNC_INTERVAL, time_offset: int = None, recorder=None):
+        """
+        Client that paces requests by futures request weight and order count shared by all instances,
+        signs requests with server time offset synced every sync_interval seconds, retries idempotent
+        requests with jittered backoff and reuses one pooled keep-alive session
+
+        :param sync_interval: seconds between server time syncs, no periodic sync if 0
+        :param time_offset: offset known from a previous run, first sync then happens in background
+        :param recorder: TrafficRecorder, every request and response is recorded
+        """
+        self.time_offset = time_offset or 0
+        self.recorder = recorder
+        self.sync_interval = sync_interval
+        self._sync_timer = None
+        super().__init__(api_key=api_key, api_secret=api_secret, requests_params=requests_params, tld=tld)
+        if time_offset is None:
+            self.sync_time()
+        else:
+            self._schedule_sync(delay=0)
+
+    def _init_session(self):
+        with RateLimitedClient._session_lock:
+            if RateLimitedClient._session is None:
+                session = requests.session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Accept': 'application/json', 'User-Agent': 'binance/python'})
+                RateLimitedClient._session = session
+        return RateLimitedClient._session
+
+    def sync_time(self):
+        """
+        Sets time_offset to difference between futures server time and local time
+        """
+        try:
+            sent = time()
+            server_time = self.futures_time()['serverTime']
+            self.time_offset = int(server_time - (sent + time()) * 500)
+        except Exception as exc:
+            log_warns.exception(exc)
+        if self.sync_interval:
+            self._schedule_sync(delay=self.sync_interval)
+
+    def _schedule_sync(self, delay: float):
+        if self._sync_timer:
+            self._sync_timer.cancel()
+        self._sync_timer = Timer(delay, self.sync_time)
+        self._sync_timer.daemon = True
+        self._sync_timer.start()
+
+    def request_weight(self, path: str, data: dict):
+        if path == 'klines':
+            limit = int(data.get('limit', 500))
+            return 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+        if path == 'depth':
+            limit = int(data.get('limit', 500))
+            return 2 if limit <= 50 else 5 if limit <= 100 else 10 if limit <= 500 else 20
+        if path == 'openOrders':
+            return 1 if data.get('symbol') else 40
+        return self.WEIGHTS.get(path, 1)
+
+    def _request(self, method, uri, signed, force_params=False, **kwargs):
+        path = uri.rstrip('/').rsplit('/', 1)[-1]
+        data = kwargs.get('data') or {}
+        weight = self.request_weight(path=path, data=data)
+        order_count = 0
+        if method == 'post' and path == 'order':
+            order_count = 1
+        elif method == 'post' and path == 'batchOrders':
+            order_count = len(json.loads(data['batchOrders']))
+
+        duration = REST_SECONDS.labels(method=method, path=path)
+        attempt = 0
+        while True:
+            if attempt:
+                REST_RETRIES.labels(method=method, path=path).inc()
+            self.weights.acquire(amount=weight)
+            if order_count:
+                self.orders.acquire(amount=order_count)
+            started = perf_counter()
+            try:
+                response = getattr(self.session, method)(uri, **self._prepare(method, signed, force_params, kwargs))
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                REST_REQUESTS.labels(method=method, path=path, status=type(exc).__name__).inc()
+                if self.recorder is not None:
+                    self.recorder.record(kind='rest', name=path, payload=dict(method=method, params=data,
+                                                                              error=f"{type(exc).__name__}: {exc}"))
+                if method not in self.RETRY_METHODS or attempt >= self.MAX_RETRIES:
+                    raise
+                log_warns.warning('Retrying %s %s after %s', method.upper(), path, exc)
+                self._backoff(attempt=attempt)
+                attempt += 1
+                continue
+            duration.observe(perf_counter() - started)
+            REST_REQUESTS.labels(method=method, path=path, status=response.status_code).inc()
+            if self.recorder is not None:
+                self.recorder.record(kind='rest', name=path, payload=dict(
+                    method=method, params=data, status=response.status_code, body=response.text,
+                    headers={key: response.headers[key] for key in RECORDED_HEADERS if key in response.headers},
+                ))
+            self.response = response
+            retry_after = self._observe(response=response)
+            if str(response.status_code).startswith('2'):
+                try:
+                    return response.json()
+                except ValueError:
+                    raise BinanceRequestException('Invalid Response: %s' % response.text)
+            error = BinanceAPIException(response)
+            if attempt >= self.MAX_RETRIES:
+                raise error
+            if error.code == -1021:
+                self.sync_time()
+            elif method in self.RETRY_METHODS and response.status_code in self.RETRY_STATUS:
+                self._backoff(attempt=attempt, minimum=retry_after)
+            else:
+                raise error
+            log_warns.warning('Retrying %s %s after %s', method.upper(), path, error)
+            attempt += 1
+
+    def _prepare(self, method, signed, force_params, kwargs):
+        """
+        Builds requests arguments like Client._request does, signed with offset timestamp
+        """
+        kwargs = dict(kwargs, timeout=10)
+        if self._requests_params:
+            kwargs.update(self._requests_params)
+        if self.API_KEY:
+            kwargs['headers'] = {'X-MBX-APIKEY': self.API_KEY}
+        data = kwargs.get('data')
+        if isinstance(data, dict):
+            data = dict(data)
+            if 'requests_params' in data:
+                kwargs.update(data.pop('requests_params'))
+            if signed:
+                data['timestamp'] = int(time() * 1000) + self.time_offset
+                data['signature'] = self._generate_signature(data)
+            kwargs['data'] = [(key, value) for key, value in self._order_params(data) if value is not None]
+        if kwargs.get('data') and (method == 'get' or force_params):
+            kwargs['params'] = '&'.join('%s=%s' % (key, value) for key, value in kwargs.pop('data'))
+        return kwargs
+
+    def _observe(self, response):
+        """
+        Syncs buckets with used weight and order count headers, pauses them on 429 and 418
+
+        :return: seconds to wait before retrying
+        """
+        used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M')
+        if used_weight is not None:
+            self.weights.observe(used=int(used_weight))
+        order_count = response.headers.get('X-MBX-ORDER-COUNT-10S')
+        if order_count is not None:
+            self.orders.observe(used=int(order_count))
+        if response.status_code in (418, 429):
+            retry_after = float(response.headers.get('Retry-After', 60))
+            log_warns.warning('Rate limit hit with status %s, pausing requests for %ss', response.status_code,
+                              retry_after)
+            self.weights.pause(seconds=retry_after)
+            return retry_after
+        return 0.0
+
+    def _backoff(self, attempt: int, minimum: float = 0.0):
+        delay = min(self.BACKOFF_CAP, self.BACKOFF * 2 ** attempt)
+        sleep(max(minimum, uniform(delay / 2, delay)))
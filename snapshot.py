@@ -0,0 +1,106 @@
+import atexit
+import os
+import pickle
+from threading import Thread, Event
+from time import time
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+
+class StateSnapshot(Thread):
+
+    PATH = 'bot_state.pickle'
+    VERSION = 1
+    INTERVAL = 10.0
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, engine, path: str = PATH, interval: float = INTERVAL, max_age: float = MAX_AGE, *args,
+                 **kwargs):
+        """
+        Writes engine state every interval seconds and at interpreter exit. The file is replaced atomically,
+        so a crash leaves either the previous or the new snapshot
+
+        :param engine: TradingEngine
+        :param path: snapshot file
+        :param max_age: seconds after which a snapshot is ignored on start
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.engine = engine
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self._stopped = Event()
+        atexit.register(self.close)
+
+    def run(self):
+        while not self._stopped.wait(timeout=self.interval):
+            self.save()
+
+    def collect(self):
+        """
+        :return: dict(version=int, time=float, time_offset=int, balances=dict, traders=dict(stream=trader state))
+        """
+        return dict(
+            version=self.VERSION,
+            time=time(),
+            time_offset=getattr(self.engine.client, 'time_offset', 0),
+            balances=dict(self.engine.account.balances),
+            traders={name: trader.state() for name, trader in self.engine.traders.items() if trader.strategy},
+        )
+
+    def save(self):
+        """
+        Pickles state to a temporary file, syncs it to disk and renames it over the snapshot
+        """
+        temporary = f"{self.path}.tmp"
+        try:
+            data = pickle.dumps(self.collect(), protocol=pickle.HIGHEST_PROTOCOL)
+            with open(temporary, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+            if hasattr(os, 'O_DIRECTORY'):
+                directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+        except Exception as exc:
+            log_warns.exception(exc)
+            return {'msg': exc}
+        return self.path
+
+    def load(self):
+        """
+        :return: state saved by a previous run, None if there is none or it is unusable
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                state = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            log_warns.warning('Snapshot %s is unreadable: %s', self.path, exc)
+            return None
+        if not isinstance(state, dict) or state.get('version') != self.VERSION:
+            log_warns.warning('Snapshot %s has unknown format, ignoring it', self.path)
+            return None
+        if time() - state['time'] > self.max_age:
+            log_warns.warning('Snapshot %s is older than %ss, ignoring it', self.path, self.max_age)
+            return None
+        return state
+
+    def close(self):
+        """
+        Stops periodic snapshots and writes the last one
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        if self.engine.traders and any(trader.strategy for trader in self.engine.traders.values()):
+            self.save()
@@ -0,0 +1,203 @@
+from time import time
+import numpy as np
+from peewee import chunked, fn
+from Models import Klines, EmptyKlines, sqlite_db
+from utils import configure_logging, interval_to_ms
+
+log_warns = configure_logging()
+
+
+class KlineStore:
+
+    BATCH = 1500
+    COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_volume', 'trades',
+               'taker_base_volume', 'taker_quote_volume']
+
+    def __init__(self, client, model=Klines, empty_model=EmptyKlines):
+        """
+        Local candle history kept in Orders.db, downloads only what is missing. Ranges the exchange has no
+        klines for, e.g. before listing or during outages, are kept too, so they are requested only once
+
+        :param client: binance Client
+        :param model: peewee model with Klines layout
+        :param empty_model: peewee model with EmptyKlines layout
+        """
+        self.client = client
+        self.model = model
+        self.empty_model = empty_model
+
+    def last_time(self, symbol: str, interval: str):
+        return (self.model
+                .select(fn.MAX(self.model.time))
+                .where((self.model.symbol == symbol) & (self.model.interval == interval))
+                .scalar())
+
+    def time_range(self, symbol: str, interval: str):
+        """
+        :return: tuple(first open time, last open time) of stored klines, (None, None) if there are none
+        """
+        return (self.model
+                .select(fn.MIN(self.model.time), fn.MAX(self.model.time))
+                .where((self.model.symbol == symbol) & (self.model.interval == interval))
+                .tuples()
+                .get())
+
+    def sync(self, symbol: str, interval: str, history: int = 500):
+        """
+        Downloads klines after the last stored one with paginated futures_klines calls, backfills the ones
+        before the first stored one until history klines are covered and fills gaps. Requests nothing for
+        the latest kline while it is forming and for ranges known to be empty
+
+        :param history: amount of latest klines that have to be stored
+        :return: int amount of downloaded klines
+        """
+        step = interval_to_ms(interval)
+        now = int(time() * 1000)
+        first, last = self.time_range(symbol=symbol, interval=interval)
+        if last is None:
+            return self.download(symbol=symbol, interval=interval, start=now - history * step)
+        downloaded = 0
+        if last + step <= now:
+            downloaded += self.download(symbol=symbol, interval=interval, start=last)
+        missing = self.gaps(symbol=symbol, interval=interval)
+        if first > now - history * step:
+            missing.insert(0, (now - history * step, first - step))
+        for start, end in missing:
+            downloaded += self.fill(symbol=symbol, interval=interval, start=start, end=end)
+        return downloaded
+
+    def fill(self, symbol: str, interval: str, start: int, end: int):
+        """
+        Downloads missing klines with open time in [start, end] except known empty ranges and remembers
+        the ones the exchange does not have
+
+        :return: int amount of downloaded klines
+        """
+        unknown = self.unknown(symbol=symbol, interval=interval, start=start, end=end)
+        if unknown is None:
+            return 0
+        start, end = unknown
+        downloaded, complete = self._download(symbol=symbol, interval=interval, start=start, end=end)
+        if complete:
+            step = interval_to_ms(interval)
+            times = self.array(symbol=symbol, interval=interval, start=start, end=end, columns=('time',))[:, 0]
+            bounds = np.concatenate(([start - step], times, [end + step]))
+            holes = np.flatnonzero(np.diff(bounds) > step)
+            rows = [(symbol, interval, int(bounds[idx] + step), int(bounds[idx + 1] - step)) for idx in holes
+                    if bounds[idx] + step <= bounds[idx + 1] - step]
+            fields = [self.empty_model.symbol, self.empty_model.interval, self.empty_model.start,
+                      self.empty_model.end]
+            with sqlite_db.atomic():
+                for batch in chunked(rows, 200):
+                    self.empty_model.insert_many(batch, fields=fields).on_conflict_replace().execute()
+        return downloaded
+
+    def unknown(self, symbol: str, interval: str, start: int, end: int):
+        """
+        Trims known empty ranges off [start, end]
+
+        :return: tuple(start, end) left to request, None if the whole range is known to be empty
+        """
+        step = interval_to_ms(interval)
+        model = self.empty_model
+        overlapping = (model
+                       .select(model.start, model.end)
+                       .where((model.symbol == symbol) & (model.interval == interval) & (model.start <= end) &
+                              (model.end >= start))
+                       .order_by(model.end.desc())
+                       .tuples())
+        for empty_start, empty_end in overlapping:
+            if empty_start <= start and empty_end >= end:
+                return None
+            if empty_end >= end:
+                end = empty_start - step
+            elif empty_start <= start:
+                start = empty_end + step
+        return (start, end) if start <= end else None
+
+    def download(self, symbol: str, interval: str, start: int, end: int = None):
+        """
+        Downloads and saves klines with open time in [start, end]
+
+        :return: int amount of downloaded klines
+        """
+        return self._download(symbol=symbol, interval=interval, start=start, end=end)[0]
+
+    def _download(self, symbol: str, interval: str, start: int, end: int = None):
+        """
+        :return: tuple(int amount of downloaded klines, bool False if a request failed)
+        """
+        step = interval_to_ms(interval)
+        downloaded = 0
+        while end is None or start <= end:
+            params = dict(symbol=symbol, interval=interval, startTime=start, limit=self.BATCH)
+            if end is not None:
+                params['endTime'] = end
+            try:
+                data = self.client.futures_klines(**params)
+            except Exception as exc:
+                log_warns.exception(exc)
+                return downloaded, False
+            self.save(symbol=symbol, interval=interval, klines=data)
+            downloaded += len(data)
+            if len(data) < self.BATCH:
+                break
+            start = data[-1][0] + step
+        return downloaded, True
+
+    def save(self, symbol: str, interval: str, klines: list):
+        """
+        :param klines: list(list(open_time, open, ..), ..) in futures_klines layout
+        """
+        rows = [(symbol, interval, *kline[:11]) for kline in klines]
+        fields = [self.model.symbol, self.model.interval] + [getattr(self.model, column) for column in self.COLUMNS]
+        with sqlite_db.atomic():
+            for batch in chunked(rows, 70):
+                self.model.insert_many(batch, fields=fields).on_conflict_replace().execute()
+
+    def gaps(self, symbol: str, interval: str):
+        """
+        Checks continuity of stored klines
+
+        :return: list(tuple(first_missing_time, last_missing_time), ..)
+        """
+        times = self.array(symbol=symbol, interval=interval, columns=('time',))[:, 0]
+        step = interval_to_ms(interval)
+        holes = np.flatnonzero(np.diff(times) > step)
+        return [(int(times[idx] + step), int(times[idx + 1] - step)) for idx in holes]
+
+    def array(self, symbol: str, interval: str, limit: int = None, start: int = None, end: int = None,
+              columns: tuple = ('time', 'open', 'high', 'low', 'close', 'volume')):
+        """
+        Loads stored klines in one query, oldest first
+
+        :param limit: amount of latest klines, all if None
+        :param start: minimal open time
+        :param end: maximal open time
+        :return: np.ndarray shape (n, len(columns))
+        """
+        query = (self.model
+                 .select(*[getattr(self.model, column) for column in columns])
+                 .where((self.model.symbol == symbol) & (self.model.interval == interval)))
+        if start is not None:
+            query = query.where(self.model.time >= start)
+        if end is not None:
+            query = query.where(self.model.time <= end)
+        query = query.order_by(self.model.time.desc())
+        if limit:
+            query = query.limit(limit)
+        rows = sqlite_db.execute(query).fetchall()
+        return np.array(rows[::-1], dtype=np.float64).reshape(-1, len(columns))
+
+    def history(self, symbol: str, interval: str, limit: int = None, start: int = None, end: int = None):
+        """
+        Stored klines in futures_klines layout, works with utils.to_dataframe and Strategy
+
+        :rtype: list(list(open_time, open, high, low, close, volume, close_time, ..), ..)
+        """
+        klines = []
+        for row in self.array(symbol=symbol, interval=interval, limit=limit, start=start, end=end,
+                              columns=tuple(self.COLUMNS)).tolist():
+            row[0], row[6], row[8] = int(row[0]), int(row[6]), int(row[8])
+            klines.append(row + [0])
+        return klines
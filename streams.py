@@ -0,0 +1,90 @@
+from threading import Timer
+from autobahn.twisted.websocket import connectWS
+from binance.websockets import BinanceSocketManager, BinanceClientFactory, BinanceClientProtocol
+from twisted.internet import ssl
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+
+class FuturesSocketManager(BinanceSocketManager):
+
+    FSTREAM_URL = 'wss://fstream.binance.com/'
+    KEEPALIVE_INTERVAL = 30 * 60
+    USER_SOCKET = 'futures_user'
+
+    def __init__(self, client, user_timeout=BinanceSocketManager.DEFAULT_USER_TIMEOUT):
+        """
+        BinanceSocketManager with futures market and user data streams
+        """
+        super().__init__(client=client, user_timeout=user_timeout)
+        self._timers['futures'] = None
+        self._listen_keys['futures'] = None
+        self._account_callbacks['futures'] = None
+
+    def start_futures_socket(self, path, callback, prefix='ws/'):
+        if path in self._conns:
+            return False
+
+        factory = BinanceClientFactory(self.FSTREAM_URL + prefix + path)
+        factory.protocol = BinanceClientProtocol
+        factory.callback = callback
+        factory.reconnect = True
+        context_factory = ssl.ClientContextFactory()
+
+        self._conns[path] = connectWS(factory, context_factory)
+        return path
+
+    def start_futures_multiplex_socket(self, streams, callback):
+        """
+        Combined futures market stream, messages are wrapped as {"stream": name, "data": payload}
+        """
+        return self.start_futures_socket('streams={}'.format('/'.join(streams)), callback, 'stream?')
+
+    def start_futures_kline_socket(self, symbol, interval, callback):
+        """
+        Futures kline stream of symbol, e.g. btcusdt@kline_1m
+        """
+        return self.start_futures_socket('{}@kline_{}'.format(symbol.lower(), interval), callback)
+
+    def start_futures_user_socket(self, callback):
+        """
+        Starts futures user data stream (ORDER_TRADE_UPDATE, ACCOUNT_UPDATE, listenKeyExpired events)
+        and keeps its listen key alive. The socket is restarted under a new listen key when keepalive fails,
+        the returned USER_SOCKET key stays valid for stop_socket across such restarts
+
+        :returns: USER_SOCKET if successful, False otherwise
+        """
+        listen_key = self._client._request_futures_api('post', 'listenKey')['listenKey']
+        if self._listen_keys['futures'] in self._conns:
+            self.stop_socket(self._listen_keys['futures'])
+        self._listen_keys['futures'] = listen_key
+        self._account_callbacks['futures'] = callback
+        if not self.start_futures_socket(listen_key, callback):
+            return False
+        self._start_futures_timer()
+        return self.USER_SOCKET
+
+    def _start_futures_timer(self):
+        self._timers['futures'] = Timer(self.KEEPALIVE_INTERVAL, self._keepalive_futures_socket)
+        self._timers['futures'].daemon = True
+        self._timers['futures'].start()
+
+    def _keepalive_futures_socket(self):
+        try:
+            self._client._request_futures_api('put', 'listenKey')
+        except Exception as exc:
+            log_warns.exception(exc)
+            self.start_futures_user_socket(callback=self._account_callbacks['futures'])
+        else:
+            self._start_futures_timer()
+
+    def stop_socket(self, conn_key):
+        if conn_key == self.USER_SOCKET:
+            conn_key = self._listen_keys['futures']
+        if conn_key is not None and conn_key == self._listen_keys['futures']:
+            if self._timers['futures']:
+                self._timers['futures'].cancel()
+                self._timers['futures'] = None
+            self._listen_keys['futures'] = None
+        super().stop_socket(conn_key=conn_key)
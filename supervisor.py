@@ -0,0 +1,139 @@
+from math import exp
+from threading import Thread, Lock, Event
+from time import time, monotonic
+from twisted.internet import reactor
+from twisted.internet.threads import blockingCallFromThread
+from metrics import REGISTRY
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+STREAM_RATE = REGISTRY.gauge('bot_stream_messages_per_second', 'Decayed message rate of stream', labels=('stream',))
+STREAM_LAG = REGISTRY.gauge('bot_stream_lag_seconds', 'Smoothed delay of stream event time', labels=('stream',))
+STREAM_RECONNECTS = REGISTRY.gauge('bot_stream_reconnects', 'Reconnects of stream', labels=('stream',))
+
+
+class StreamState:
+
+    def __init__(self, name: str, expected_interval: float = None, restart=None, backfill=None):
+        """
+        :param name: stream name
+        :param expected_interval: seconds between messages of a healthy stream, None if stream may stay silent
+        :param restart: callable reconnecting the stream
+        :param backfill: callable fetching data missed while the stream was down
+        """
+        self.name = name
+        self.expected_interval = expected_interval
+        self.restart = restart
+        self.backfill = backfill
+        self.last = monotonic()
+        self.messages = 0
+        self.rate = 0.0
+        self.lag = None
+        self.reconnects = 0
+        self.attempts = 0
+        self.next_attempt = 0.0
+
+
+class StreamSupervisor(Thread):
+
+    RATE_WINDOW = 10.0
+    LAG_SMOOTHING = 0.1
+    BACKOFF = 1.0
+    BACKOFF_CAP = 60.0
+
+    def __init__(self, client=None, stale_factor: float = 40, check_interval: float = 1.0, *args, **kwargs):
+        """
+        Watches websocket streams, reconnects the ones that stopped sending messages and backfills
+        what was missed
+
+        :param client: RateLimitedClient, its time_offset is used for lag of event times
+        :param stale_factor: stream is stale after stale_factor * expected_interval seconds without messages
+        :param check_interval: seconds between staleness checks
+        """
+        kwargs.setdefault('daemon', True)
+        super().__init__(*args, **kwargs)
+        self.client = client
+        self.stale_factor = stale_factor
+        self.check_interval = check_interval
+        self.streams = {}
+        self._lock = Lock()
+        self._stopped = Event()
+
+    def watch(self, name: str, expected_interval: float = None, restart=None, backfill=None):
+        with self._lock:
+            stream = StreamState(name=name, expected_interval=expected_interval, restart=restart, backfill=backfill)
+            self.streams[name] = stream
+        STREAM_RATE.labels(stream=name).set_function(
+            lambda: stream.rate * exp((stream.last - monotonic()) / self.RATE_WINDOW))
+        STREAM_LAG.labels(stream=name).set_function(lambda: None if stream.lag is None else stream.lag / 1000)
+        STREAM_RECONNECTS.labels(stream=name).set_function(lambda: stream.reconnects)
+
+    def beat(self, name: str, event_time: int = None):
+        """
+        Records a message of the stream
+
+        :param event_time: 'E' field of the message in milliseconds
+        """
+        stream = self.streams.get(name)
+        if stream is None:
+            return
+        now = monotonic()
+        stream.rate = stream.rate * exp((stream.last - now) / self.RATE_WINDOW) + 1 / self.RATE_WINDOW
+        stream.last = now
+        stream.messages += 1
+        stream.attempts = 0
+        if event_time:
+            lag = time() * 1000 + getattr(self.client, 'time_offset', 0) - event_time
+            stream.lag = lag if stream.lag is None else stream.lag + self.LAG_SMOOTHING * (lag - stream.lag)
+
+    def run(self):
+        while not self._stopped.wait(timeout=self.check_interval):
+            for stream in list(self.streams.values()):
+                try:
+                    self.check(stream=stream)
+                except Exception as exc:
+                    log_warns.exception(exc)
+
+    def check(self, stream: StreamState):
+        """
+        Backfills and reconnects the stream if it is stale, attempts are spaced with exponential backoff
+        """
+        if stream.expected_interval is None or stream.restart is None:
+            return
+        now = monotonic()
+        if now - stream.last < stream.expected_interval * self.stale_factor or now < stream.next_attempt:
+            return
+        log_warns.warning('Stream %s is silent for %.1fs, reconnecting', stream.name, now - stream.last)
+        stream.attempts += 1
+        stream.reconnects += 1
+        stream.next_attempt = now + min(self.BACKOFF_CAP, self.BACKOFF * 2 ** stream.attempts)
+        if stream.backfill:
+            stream.backfill()
+        if reactor.running:
+            blockingCallFromThread(reactor, stream.restart)
+        else:
+            stream.restart()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        """
+        :return: dict(name=dict(rate=messages per second, lag=smoothed ms, reconnects=int, age=seconds), ..)
+        """
+        now = monotonic()
+        return {name: dict(
+            rate=stream.rate * exp((stream.last - now) / self.RATE_WINDOW),
+            lag=stream.lag,
+            reconnects=stream.reconnects,
+            age=now - stream.last,
+        ) for name, stream in self.streams.items()}
+
+    def summary(self):
+        lines = []
+        for name, stats in self.stats().items():
+            lag = '-' if stats['lag'] is None else f"{stats['lag']:.0f}ms"
+            lines.append(f"{name}: {stats['rate']:.1f} msg/s - Lag: {lag} - Last: {stats['age']:.1f}s ago - "
+                         f"Reconnects: {stats['reconnects']}")
+        return '\n'.join(lines) or 'No streams watched'
@@ -0,0 +1,147 @@
+import json
+import os
+from math import floor
+from threading import Lock
+from time import time
+from utils import configure_logging
+
+log_warns = configure_logging()
+
+
+def _scale(step: str):
+    """
+    :param step: tickSize or stepSize string, e.g. '0.010'
+    :return: tuple(decimals, step in units of 10 ** -decimals)
+    """
+    step = step.rstrip('0').rstrip('.') if '.' in step else step
+    decimals = len(step.split('.')[1]) if '.' in step else 0
+    return decimals, int(step.replace('.', ''))
+
+
+class SymbolInfo:
+
+    def __init__(self, info: dict):
+        """
+        Filters of one symbol with integer-scaled rounding
+
+        :param info: symbol entry of futures_exchange_info
+        """
+        self.symbol = info['symbol']
+        self.price_precision = info['pricePrecision']
+        self.quantity_precision = info['quantityPrecision']
+        filters = {filter_['filterType']: filter_ for filter_ in info['filters']}
+        price_filter = filters.get('PRICE_FILTER', {})
+        lot_size = filters.get('LOT_SIZE', {})
+        market_lot_size = filters.get('MARKET_LOT_SIZE', lot_size)
+        self.tick_size = price_filter.get('tickSize', f"{10 ** -self.price_precision:.{self.price_precision}f}")
+        self.step_size = lot_size.get('stepSize', f"{10 ** -self.quantity_precision:.{self.quantity_precision}f}")
+        self.min_price = float(price_filter.get('minPrice', 0))
+        self.max_price = float(price_filter.get('maxPrice', 0))
+        self.min_qty = float(lot_size.get('minQty', 0))
+        self.max_qty = float(lot_size.get('maxQty', 0))
+        self.market_min_qty = float(market_lot_size.get('minQty', self.min_qty))
+        self.market_max_qty = float(market_lot_size.get('maxQty', self.max_qty))
+        self.min_notional = float(filters.get('MIN_NOTIONAL', {}).get('notional', 0))
+        self._price_decimals, self._tick = _scale(self.tick_size)
+        self._quantity_decimals, self._step = _scale(self.step_size)
+        self._price_factor = 10 ** self._price_decimals / self._tick
+        self._price_unit = self._tick / 10 ** self._price_decimals
+        self._price_format = f"%.{self._price_decimals}f"
+        self._quantity_factor = 10 ** self._quantity_decimals / self._step
+        self._quantity_unit = self._step / 10 ** self._quantity_decimals
+        self._quantity_format = f"%.{self._quantity_decimals}f"
+
+    def round_price(self, value: float):
+        """
+        Rounds price to the nearest tick
+        """
+        return round(float(value) * self._price_factor) * self._price_unit
+
+    def round_quantity(self, value: float):
+        """
+        Rounds quantity down to the step so it never exceeds requested amount
+        """
+        return floor(float(value) * self._quantity_factor + 1e-9) * self._quantity_unit
+
+    def format_price(self, value: float):
+        return self._price_format % self.round_price(value)
+
+    def format_quantity(self, value: float):
+        return self._quantity_format % self.round_quantity(value)
+
+    def check(self, params: dict, price: float = None):
+        """
+        Checks formatted order parameters against symbol filters
+
+        :param price: reference price for notional of orders without price
+        :return: error message if order would be rejected, None otherwise
+        """
+        for param in ('price', 'stopPrice', 'activationPrice'):
+            if param in params and self.max_price and not self.min_price <= float(params[param]) <= self.max_price:
+                return f"{param} {params[param]} is out of [{self.min_price}, {self.max_price}]"
+        if 'quantity' not in params:
+            return
+        quantity = float(params['quantity'])
+        market = params.get('type', '').endswith('MARKET')
+        low, high = (self.market_min_qty, self.market_max_qty) if market else (self.min_qty, self.max_qty)
+        if quantity < low or (high and quantity > high):
+            return f"Quantity {params['quantity']} is out of [{low}, {high}]"
+        price = float(params.get('price') or params.get('stopPrice') or price or 0)
+        reduce_only = params.get('reduceOnly') in (True, 'true')
+        if price and not reduce_only and quantity * price < self.min_notional:
+            return f"Notional {quantity * price:.2f} is below {self.min_notional}"
+
+
+class SymbolRegistry:
+
+    TTL = 24 * 60 * 60
+    PATH = 'exchange_info.json'
+
+    _symbols = {}
+    _loaded = 0.0
+    _lock = Lock()
+
+    def __init__(self, client, path: str = PATH, ttl: float = TTL):
+        """
+        Exchange info of every futures symbol, fetched once per process and cached on disk for ttl seconds
+
+        :param client: binance Client
+        :param path: json cache file
+        """
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+
+    def get(self, symbol: str):
+        """
+        :rtype: SymbolInfo
+        """
+        with self._lock:
+            if time() - SymbolRegistry._loaded > self.ttl:
+                self._load()
+            if symbol not in SymbolRegistry._symbols:
+                self._load(refresh=True)
+        return SymbolRegistry._symbols[symbol]
+
+    def _load(self, refresh: bool = False):
+        """
+        Reads disk cache if it is fresh, downloads exchange info otherwise
+
+        :param refresh: download even if disk cache is fresh
+        """
+        data, loaded = None, time()
+        if not refresh and os.path.exists(self.path) and loaded - os.path.getmtime(self.path) < self.ttl:
+            try:
+                with open(self.path) as file:
+                    data = json.load(file)
+                loaded = os.path.getmtime(self.path)
+            except ValueError as exc:
+                log_warns.exception(exc)
+        if not data or not data.get('symbols'):
+            data, loaded = self.client.futures_exchange_info(), time()
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w') as file:
+                json.dump(data, file)
+            os.replace(temporary, self.path)
+        SymbolRegistry._symbols = {info['symbol']: SymbolInfo(info=info) for info in data['symbols']}
+        SymbolRegistry._loaded = loaded
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+# Models opens Orders.db of the working directory on import, tests must not touch the one of the bot
+os.chdir(tempfile.mkdtemp(prefix='bot_tests'))
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    Points the models at an empty database of the test
+    """
+    from Models import use_database
+    use_database(str(tmp_path / 'Orders.db'))
+    return tmp_path / 'Orders.db'
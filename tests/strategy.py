@@ -0,0 +1,28 @@
+from utils import Order
+
+
+class Strategy:
+
+    def __init__(self, klines, symbol, leverage, quantity):
+        """
+        Buys on every closed candle while not long, stands in for the strategy module the bot is published without
+        """
+        self.klines, self.symbol, self.leverage, self.quantity = klines, symbol, leverage, quantity
+        self.checks = 0
+
+    def timer(self):
+        return False
+
+    def check(self, on_long, on_short, ohlc):
+        self.checks += 1
+        if not on_long:
+            return [Order(params=dict(symbol=self.symbol, side='BUY', type='MARKET', quantity=0.01), long=True)]
+
+    def stoploss(self, ohlc, on_long, on_short, tracker):
+        return None
+
+    def get_state(self):
+        return dict(checks=self.checks)
+
+    def set_state(self, state):
+        self.checks = state['checks']
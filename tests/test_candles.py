@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from candles import CandleBuffer
+
+CAPACITY = 7
+
+
+def kline(number: int, close: float = None, closed: bool = True):
+    close = number + 0.5 if close is None else close
+    return dict(t=number * 60000, o=number, h=number + 1, l=number - 1, c=close, v=number * 10, x=closed)
+
+
+def expected(numbers: list):
+    """
+    :return: np.ndarray shape (len(numbers), 6) of plain candles
+    """
+    return np.array([[number * 60000, number, number + 1, number - 1, number + 0.5, number * 10]
+                     for number in numbers], dtype=np.float64).reshape(-1, 6)
+
+
+def assert_holds(buffer: CandleBuffer, numbers: list):
+    rows = expected(numbers[-CAPACITY:])
+    assert len(buffer) == len(rows)
+    for column, field in enumerate(CandleBuffer.FIELDS):
+        np.testing.assert_array_equal(buffer.view(field), rows[:, column])
+        np.testing.assert_array_equal(buffer.view(field, length=3), rows[-3:, column])
+    np.testing.assert_array_equal(buffer.tail(), rows)
+    if len(rows):
+        assert buffer.last() == dict(zip(CandleBuffer.FIELDS, rows[-1]))
+
+
+@pytest.mark.parametrize('amount', [1, CAPACITY - 1, CAPACITY, CAPACITY + 1, 3 * CAPACITY + 2])
+def test_updates_past_capacity(amount):
+    buffer, numbers = CandleBuffer(capacity=CAPACITY), []
+    for number in range(amount):
+        assert buffer.update(kline(number, close=0.0, closed=False))
+        assert not buffer.update(kline(number))
+        numbers.append(number)
+        assert_holds(buffer, numbers)
+
+
+def test_seed_more_than_capacity_then_update():
+    buffer = CandleBuffer(capacity=CAPACITY)
+    buffer.seed(klines=expected(range(20)).tolist())
+    assert_holds(buffer, list(range(20)))
+    numbers = list(range(20))
+    for number in range(20, 20 + 2 * CAPACITY):
+        buffer.update(kline(number))
+        numbers.append(number)
+        assert_holds(buffer, numbers)
+
+
+def test_seed_from_tail_and_closed_flag():
+    buffer = CandleBuffer(capacity=CAPACITY)
+    for number in range(CAPACITY + 3):
+        buffer.update(kline(number))
+    buffer.update(kline(CAPACITY + 3, closed=False))
+    assert not buffer.closed
+    copy = CandleBuffer(capacity=CAPACITY)
+    copy.seed(klines=buffer.tail())
+    np.testing.assert_array_equal(copy.tail(), buffer.tail())
+    assert copy.closed
+
+
+def test_views_are_read_only():
+    buffer = CandleBuffer(capacity=CAPACITY)
+    buffer.update(kline(0))
+    with pytest.raises(ValueError):
+        buffer.close[0] = 1.0
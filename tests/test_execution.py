@@ -0,0 +1,122 @@
+from json import loads
+from time import perf_counter, sleep
+from types import SimpleNamespace
+from BinanceFuturesBot import BinanceTrader
+from execution import OrderExecutor
+from utils import Order
+
+
+class Journal:
+
+    def create(self, **fields):
+        pass
+
+
+class Measure:
+
+    def inc(self):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+class BatchClient:
+
+    def __init__(self, failing: set = frozenset()):
+        """
+        :param failing: client order ids rejected by the exchange
+        """
+        self.failing = failing
+        self.batches = []
+
+    def _request_futures_api(self, method: str, path: str, signed: bool, data: dict):
+        batch = loads(data['batchOrders'])
+        self.batches.append(batch)
+        return [{'code': -2019, 'msg': 'Margin is insufficient.'} if params['newClientOrderId'] in self.failing
+                else dict(params, status='NEW') for params in batch]
+
+
+class Trader:
+
+    BATCH_ORDERS_LIMIT = BinanceTrader.BATCH_ORDERS_LIMIT
+    submit_orders = BinanceTrader.submit_orders
+    batch_params = staticmethod(BinanceTrader.batch_params)
+
+    def __init__(self, client: BatchClient):
+        self.symbol, self.test, self.time_offset = 'BTCUSDT', False, 0
+        self.long, self.short = False, False
+        self.submitted = 0
+        self.client = client
+        self.bus = SimpleNamespace(publish=lambda key, value, topic=None: None)
+        self.metrics = SimpleNamespace(placed=Measure(), failed=Measure(), place_seconds=Measure())
+        self.order_latency = Measure()
+        self.executor = OrderExecutor(trader=self, daemon=True)
+        self.failed = []
+        self.placed = 0
+
+    def place_orders(self, orders: list, **kwargs):
+        BinanceTrader.place_orders(self, orders=orders, **kwargs)
+        self.placed += 1
+
+    def build_params(self, order: Order, **kwargs):
+        order.params.update(symbol=self.symbol, newClientOrderId=order.id)
+
+    def order_failed(self, order: Order, error):
+        self.failed.append(order.id)
+
+
+def order(id_: str, side: str, quantity: float, long: bool = False, short: bool = False):
+    return Order(params=dict(side=side, type='MARKET', quantity=quantity), id_=id_, long=long, short=short,
+                 db=Journal())
+
+
+def run_merged(trader: Trader):
+    """
+    Queues an entry into long and a reversal into short before the executor runs, so both are merged
+    """
+    trader.submit_orders(orders=[order('long', 'BUY', 0.01, long=True)])
+    trader.submit_orders(orders=[order('close', 'SELL', 0.01), order('short', 'SELL', 0.02, short=True)])
+    assert (trader.long, trader.short) == (False, True)
+    trader.executor.start()
+    deadline = perf_counter() + 5
+    while not trader.placed:
+        assert perf_counter() < deadline
+        sleep(0.005)
+    assert trader.placed == 1 and trader.executor.queue.empty()
+
+
+def test_opposite_submissions_are_merged_into_one_batch():
+    trader = Trader(client=BatchClient())
+    run_merged(trader)
+    assert len(trader.client.batches) == 1
+    batch = trader.client.batches[0]
+    assert [(params['side'], params['quantity']) for params in batch] == \
+        [('BUY', '0.01'), ('SELL', '0.01'), ('SELL', '0.02')]
+    assert sum(float(params['quantity']) * (1 if params['side'] == 'BUY' else -1) for params in batch) == \
+        -0.02
+    assert (trader.long, trader.short) == (False, True)
+
+
+def test_flags_of_last_placed_order_win_when_reversal_fails():
+    trader = Trader(client=BatchClient(failing={'short'}))
+    run_merged(trader)
+    assert trader.failed == ['short']
+    assert (trader.long, trader.short) == (False, False)
+
+
+def test_flags_are_restored_when_every_order_fails():
+    trader = Trader(client=BatchClient(failing={'long', 'close', 'short'}))
+    trader.long = True
+    run_merged(trader)
+    assert trader.failed == ['long', 'close', 'short']
+    assert (trader.long, trader.short) == (True, False)
+
+
+def test_later_submission_keeps_its_flags():
+    trader = Trader(client=BatchClient(failing={'long'}))
+    trader.submitted = 1
+    trader.long, trader.short = False, True
+    trader.place_orders(orders=[order('long', 'BUY', 0.01, long=True), order('x', 'BUY', 0.01, long=True)],
+                        previous=(False, False), submission=0)
+    assert (trader.long, trader.short) == (False, True)
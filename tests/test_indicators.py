@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyti.bollinger_bands import lower_bollinger_band, middle_bollinger_band, upper_bollinger_band
+from pyti.exponential_moving_average import exponential_moving_average
+from pyti.moving_average_convergence_divergence import moving_average_convergence_divergence
+from pyti.relative_strength_index import relative_strength_index
+from pyti.simple_moving_average import simple_moving_average
+from indicators import SMA, EMA, WindowedEMA, RSI, ATR, BollingerBands, MACD, RollingMax, RollingMin
+
+SIZE = 300
+PERIODS = (2, 9, 14, 26)
+
+
+@pytest.fixture(params=[1, 2, 3])
+def candles(request):
+    """
+    Random walk high/low/close with the provisional values a forming candle passes through before it closes
+    """
+    rng = np.random.default_rng(request.param)
+    close = 100 + np.cumsum(rng.normal(0, 1, SIZE))
+    high = close + rng.uniform(0, 1, SIZE)
+    low = close - rng.uniform(0, 1, SIZE)
+    ticks = close[:, None] + rng.normal(0, 1, (SIZE, 3))
+    return dict(close=close, high=high, low=low, ticks=ticks)
+
+
+def stream(indicator, columns, ticks=None):
+    """
+    Feeds candles one by one, with ticks every candle is added with provisional values first and revised
+    to its final values
+
+    :return: list of values after every closed candle
+    """
+    values = []
+    for number, row in enumerate(zip(*columns)):
+        if ticks is None:
+            values.append(indicator.add(*row))
+            continue
+        provisional = [tuple(tick if column is columns[-1] else value for column, value in zip(columns, row))
+                       for tick in ticks[number]]
+        indicator.add(*provisional[0])
+        for revision in provisional[1:]:
+            indicator.revise(*revision)
+        values.append(indicator.revise(*row))
+    return values
+
+
+def assert_matches(values, expected):
+    """
+    Streaming values equal batch values, None where the batch result is nan
+    """
+    expected = np.asarray(expected, dtype=np.float64)
+    assert len(values) == len(expected)
+    missing = np.isnan(expected)
+    assert all(value is None for value in np.asarray(values, dtype=object)[missing])
+    assert all(value is not None for value in np.asarray(values, dtype=object)[~missing])
+    np.testing.assert_allclose(np.array([value for value in values if value is not None], dtype=np.float64),
+                               expected[~missing], rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_sma(candles, period, revise):
+    # pyti checks signs with `is True`, which numpy booleans fail, so it gets python floats
+    values = stream(SMA(period), [candles['close']], candles['ticks'] if revise else None)
+    assert_matches(values, simple_moving_average(candles['close'].tolist(), period))
+    assert_matches(values, pd.Series(candles['close']).rolling(period).mean())
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_ema(candles, period, revise):
+    values = stream(EMA(period), [candles['close']], candles['ticks'] if revise else None)
+    assert_matches(values, pd.Series(candles['close']).ewm(span=period, adjust=False).mean())
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_windowed_ema(candles, period, revise):
+    values = stream(WindowedEMA(period), [candles['close']], candles['ticks'] if revise else None)
+    assert_matches(values, exponential_moving_average(candles['close'].tolist(), period))
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_rsi(candles, period, revise):
+    values = stream(RSI(period), [candles['close']], candles['ticks'] if revise else None)
+    assert_matches(values, relative_strength_index(candles['close'].tolist(), period))
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_atr(candles, period, revise):
+    high, low, close = (pd.Series(candles[column]) for column in ('high', 'low', 'close'))
+    previous = close.shift()
+    true_range = pd.concat([high - low, (high - previous).abs(), (low - previous).abs()], axis=1).max(axis=1)
+    values = stream(ATR(period), [candles['high'], candles['low'], candles['close']],
+                    candles['ticks'] if revise else None)
+    assert_matches(values, true_range.ewm(alpha=1 / period, adjust=False).mean())
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_bollinger_bands(candles, period, revise):
+    close = candles['close'].tolist()
+    values = stream(BollingerBands(period), [candles['close']], candles['ticks'] if revise else None)
+    for band, expected in enumerate((lower_bollinger_band(close, period), middle_bollinger_band(close, period),
+                                     upper_bollinger_band(close, period))):
+        assert_matches([value if value is None else value[band] for value in values], expected)
+
+
+@pytest.mark.parametrize('revise', [False, True])
+def test_macd(candles, revise):
+    close = pd.Series(candles['close'])
+    values = stream(MACD(12, 26, 9), [candles['close']], candles['ticks'] if revise else None)
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    for line, expected in enumerate((macd, signal, macd - signal)):
+        assert_matches([value[line] for value in values], expected)
+
+
+@pytest.mark.parametrize('revise', [False, True])
+def test_macd_windowed(candles, revise):
+    values = stream(MACD(12, 26, 9, ema=WindowedEMA), [candles['close']], candles['ticks'] if revise else None)
+    macd = np.asarray(moving_average_convergence_divergence(candles['close'].tolist(), 12, 26), dtype=np.float64)
+    assert_matches([value if value is None else value[0] for value in values], macd)
+    defined = ~np.isnan(macd)
+    signal = np.full(len(macd), np.nan)
+    signal[defined] = pd.Series(macd[defined]).ewm(span=9, adjust=False).mean()
+    assert_matches([value if value is None else value[1] for value in values], signal)
+
+
+@pytest.mark.parametrize('revise', [False, True])
+@pytest.mark.parametrize('period', PERIODS)
+def test_rolling_extremes(candles, period, revise):
+    close = pd.Series(candles['close'])
+    ticks = candles['ticks'] if revise else None
+    assert_matches(stream(RollingMax(period), [candles['close']], ticks), close.rolling(period).max())
+    assert_matches(stream(RollingMin(period), [candles['close']], ticks), close.rolling(period).min())
+
+
+def test_seed_matches_add(candles):
+    seeded, added = SMA(14), SMA(14)
+    assert seeded.seed(candles['close']) == stream(added, [candles['close']])[-1]
@@ -0,0 +1,122 @@
+from datetime import datetime
+import pytest
+from Models import Orders
+from journal import OrderJournal
+
+
+def fields(id_: str, second: int = 0, **changed):
+    row = dict(id=id_, params=dict(symbol='BTCUSDT', side='BUY'), long=True, short=False,
+               time=datetime(2026, 1, 1, 0, 0, second), failed=False, price=1.0, track_price=0.0, status='NEW')
+    row.update(changed)
+    return row
+
+
+def stored(id_: str):
+    return Orders.select().where(Orders.id == id_).dicts().first()
+
+
+@pytest.fixture
+def journal(database):
+    return OrderJournal(max_pending=10 ** 6, flush_interval=3600)
+
+
+def during_flush(monkeypatch, action):
+    """
+    Runs action while flush writes, after buffered changes were taken
+    """
+    insert_many = Orders.insert_many
+    monkeypatch.setattr(Orders, 'insert_many', classmethod(
+        lambda cls, *args, **kwargs: (action(), insert_many(*args, **kwargs))[1]))
+
+
+def test_update_before_create(journal):
+    journal.update('a', status='FILLED', price=2.0)
+    assert journal.get('a') is None
+    journal.create(**fields('a'))
+    assert (journal.get('a').status, journal.get('a').price) == ('FILLED', 2.0)
+    journal.flush()
+    assert (stored('a')['status'], stored('a')['price']) == ('FILLED', 2.0)
+
+
+def test_delete_before_create(journal):
+    journal.delete('a')
+    journal.create(**fields('a'))
+    journal.flush()
+    assert journal.get('a') is None and stored('a') is None
+
+
+def test_update_while_flushing_evicted_order(journal, monkeypatch):
+    journal.cache_size = 1
+    journal.create(**fields('a'))
+    journal.create(**fields('b', 1))
+    during_flush(monkeypatch, lambda: journal.update('a', status='FILLED'))
+    journal.flush()
+    assert stored('a')['status'] == 'NEW'
+    journal.flush()
+    assert stored('a')['status'] == 'FILLED'
+
+
+def test_delete_while_flushing(journal, monkeypatch):
+    journal.create(**fields('a'))
+    during_flush(monkeypatch, lambda: journal.delete('a'))
+    journal.flush()
+    assert journal.get('a') is None
+    journal.flush()
+    assert stored('a') is None
+
+
+def test_changes_of_stored_order_are_resolved(journal):
+    journal.create(**fields('a'))
+    journal.create(**fields('b', 1))
+    journal.flush()
+    restarted = OrderJournal()
+    restarted.update('a', status='CANCELED')
+    restarted.delete('b')
+    assert restarted.get('b') is None
+    assert restarted.get('a').status == 'CANCELED'
+    restarted.flush()
+    assert stored('a')['status'] == 'CANCELED'
+    assert stored('b') is None
+    assert not restarted._early
+
+
+def test_delete_of_stored_order_only(journal):
+    journal.create(**fields('a'))
+    journal.flush()
+    restarted = OrderJournal()
+    restarted.delete('a')
+    assert 'a' in restarted._early
+    restarted.flush()
+    assert stored('a') is None
+
+
+def test_failed_flush_keeps_changes(journal, monkeypatch):
+    journal.create(**fields('a'))
+    journal.flush()
+    journal.create(**fields('b', 1))
+    journal.update('a', status='PARTIALLY_FILLED')
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(Orders, 'insert_many', classmethod(fail))
+    journal.flush()
+    assert stored('b') is None and stored('a')['status'] == 'NEW'
+    journal.update('a', status='FILLED')
+    monkeypatch.undo()
+    journal.flush()
+    assert stored('b') is not None
+    assert stored('a')['status'] == 'FILLED'
+
+
+def test_page_cursors(journal):
+    for second in range(5):
+        journal.create(**fields(f'o{second}', second))
+    newest = journal.page(limit=2)
+    assert [order.id for order in newest] == ['o3', 'o4']
+    older = journal.page(limit=2, before=(newest[0].time, newest[0].id))
+    assert [order.id for order in older] == ['o1', 'o2']
+    oldest = journal.page(limit=2, before=(older[0].time, older[0].id))
+    assert [order.id for order in oldest] == ['o0']
+    newer = journal.page(limit=3, after=(oldest[0].time, oldest[0].id))
+    assert [order.id for order in newer] == ['o1', 'o2', 'o3']
+    assert journal.page(limit=2, after=(newest[-1].time, newest[-1].id)) == []
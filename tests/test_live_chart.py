@@ -0,0 +1,35 @@
+from random import Random
+import numpy as np
+import pytest
+from utils import LiveChart, reduce_ohlc
+
+
+def make_kline(number: int, random: Random):
+    open_ = random.uniform(100, 200)
+    close = random.uniform(100, 200)
+    return [number * 60000, open_, max(open_, close) + random.random(), min(open_, close) - random.random(), close]
+
+
+@pytest.mark.parametrize('width, max_candles', [(16, 50), (8, 200), (1000, 30)])
+def test_keeps_newest_candles(tmp_path, width, max_candles):
+    random = Random(width)
+    chart = LiveChart(symbol='BTCUSDT', width=width, directory=str(tmp_path), max_candles=max_candles)
+    candles, number = [], 0
+    for _ in range(300):
+        batch = []
+        if candles and random.random() < 0.3:
+            batch.append(make_kline(number - 1, random))
+            candles[-1] = batch[-1]
+        for _ in range(random.choice([1, 1, 1, 3, 40])):
+            batch.append(make_kline(number, random))
+            candles.append(batch[-1])
+            number += 1
+        chart.append(klines=batch)
+        assert chart.size <= max_candles
+        assert chart.size > max_candles - chart.step or chart.size == len(candles)
+        kept = np.array(candles[-chart.size:], dtype=np.float64).T
+        np.testing.assert_array_equal(chart._rows[:, chart._start:chart._start + chart.size], kept)
+        _, *values = reduce_ohlc(*kept, step=chart.step)
+        assert chart.buckets == len(values[0]) <= width
+        np.testing.assert_array_equal(chart._decimated[:, :chart.buckets], values)
+    assert chart._rows.shape[1] <= 2 * max_candles
@@ -0,0 +1,89 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+from queue import Queue, Empty
+from threading import Thread
+from time import perf_counter, sleep
+from urllib.request import urlopen
+import numpy as np
+import pytest
+
+pytest.importorskip('autobahn')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS = os.path.join(ROOT, 'tests')
+CONFIG = '''headless = true
+snapshot = ""
+[[symbols]]
+symbol = "BTCUSDT"
+interval = "1m"
+leverage = 1
+tracker = 0.01
+order_book = false
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_listening(port: int, timeout: float = 15.0):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise TimeoutError(f"Nothing listens on {port}")
+
+
+def write_klines(path, amount: int = 600):
+    rng = np.random.default_rng(1)
+    close = 20000 + np.cumsum(rng.normal(0, 10, amount))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    rows = np.column_stack((1600000000000 + np.arange(amount) * 60000, open_, np.maximum(open_, close) + 5,
+                            np.minimum(open_, close) - 5, close, np.ones(amount)))
+    np.savetxt(path, rows, delimiter=',', fmt='%.2f')
+
+
+def test_bot_places_order_on_mock_exchange(tmp_path):
+    write_klines(tmp_path / 'klines.csv')
+    (tmp_path / 'config.toml').write_text(CONFIG)
+    port, ws_port = free_port(), free_port()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([TESTS, ROOT]), PYTHONUNBUFFERED='1')
+    exchange = subprocess.Popen([sys.executable, os.path.join(ROOT, 'mock_exchange.py'), 'BTCUSDT:1m:klines.csv',
+                                 '--speed', '120', '--port', str(port), '--ws-port', str(ws_port)],
+                                cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    bot = None
+    try:
+        wait_listening(port)
+        wait_listening(ws_port)
+        bot = subprocess.Popen([sys.executable, os.path.join(ROOT, 'BinanceFuturesBot.py'), '--config',
+                                'config.toml', '--mock', f'127.0.0.1:{port}:{ws_port}'],
+                               cwd=tmp_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        lines = Queue()
+        Thread(target=lambda: [lines.put(line) for line in bot.stdout], daemon=True).start()
+        output, deadline = [], perf_counter() + 60
+        while perf_counter() < deadline:
+            try:
+                output.append(lines.get(timeout=1))
+            except Empty:
+                continue
+            if output[-1].startswith('Order: Placing order'):
+                break
+        assert output and output[-1].startswith('Order: Placing order'), ''.join(output)
+        assert "'symbol': 'BTCUSDT'" in output[-1]
+        deadline = perf_counter() + 10
+        while json.load(urlopen(f'http://127.0.0.1:{port}/fapi/stats'))['orders'] < 1:
+            assert perf_counter() < deadline, 'mock exchange got no order'
+            sleep(0.1)
+        assert (tmp_path / 'mock_orders.db').exists()
+    finally:
+        for process in (bot, exchange):
+            if process is not None:
+                process.kill()
+                process.wait()
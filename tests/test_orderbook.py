@@ -0,0 +1,117 @@
+from threading import Event
+from time import perf_counter, sleep
+import pytest
+from orderbook import OrderBook
+
+
+class BookClient:
+
+    def __init__(self, *snapshots):
+        """
+        Answers snapshot requests with the given snapshots in turn, exceptions are raised
+
+        :param snapshots: lastUpdateId int or Exception
+        """
+        self.snapshots = list(snapshots)
+        self.calls = 0
+        self.release = Event()
+        self.release.set()
+
+    def futures_order_book(self, symbol: str, limit: int):
+        self.release.wait(timeout=5)
+        answer = self.snapshots[min(self.calls, len(self.snapshots) - 1)]
+        self.calls += 1
+        if isinstance(answer, Exception):
+            raise answer
+        return dict(lastUpdateId=answer, bids=[['99', '1'], ['98', '2']], asks=[['101', '1'], ['102', '2']])
+
+
+def depth(first: int, last: int, previous: int, bids: list = (), asks: list = ()):
+    return dict(e='depthUpdate', U=first, u=last, pu=previous, b=list(bids), a=list(asks))
+
+
+def wait(condition, timeout: float = 5.0):
+    deadline = perf_counter() + timeout
+    while not condition():
+        assert perf_counter() < deadline, 'condition not met'
+        sleep(0.005)
+
+
+@pytest.fixture
+def book():
+    def make(*snapshots):
+        book = OrderBook(symbol='BTCUSDT', client=BookClient(*snapshots))
+        book.RETRY_DELAY = 0.01
+        return book
+    return make
+
+
+def test_buffered_updates_bridge_snapshot(book):
+    book = book(100)
+    book.client.release.clear()
+    book.on_depth(depth(90, 95, 89, bids=[['97', '5']]))
+    book.on_depth(depth(96, 105, 95, bids=[['99', '3']]))
+    book.on_depth(depth(106, 110, 105, asks=[['101', '0']]))
+    book.client.release.set()
+    wait(lambda: book.synced)
+    assert book.last_update_id == 110
+    assert book.best_prices() == (99.0, 102.0)
+    assert list(book.bids.quantities) == [3.0, 2.0]
+    book.on_depth(depth(111, 115, 110, bids=[['100', '1']]))
+    assert book.last_update_id == 115 and book.best_prices() == (100.0, 102.0)
+    assert book.client.calls == 1
+
+
+def test_first_update_has_to_cover_snapshot(book):
+    book = book(100)
+    book.client.release.clear()
+    book.on_depth(depth(102, 105, 101))
+    book.client.release.set()
+    wait(lambda: book.client.calls == 1)
+    assert not book.synced
+    book.client.snapshots = [104]
+    wait(lambda: book.synced)
+    assert book.last_update_id == 105 and book.client.calls == 2
+
+
+def test_gap_resets_book(book):
+    book = book(100, 122)
+    book.on_depth(depth(99, 101, 98))
+    wait(lambda: book.synced)
+    book.on_depth(depth(110, 112, 108))
+    assert not book.synced and book.resyncs == 1
+    wait(lambda: book.synced)
+    assert book.client.calls == 2 and book.last_update_id == 122
+    book.on_depth(depth(121, 125, 120))
+    book.on_depth(depth(126, 130, 125))
+    assert book.synced and book.last_update_id == 130
+
+
+def test_buffer_overflow_retries_with_newer_snapshot(book):
+    book = book(100, 118)
+    book.MAX_BUFFERED = 3
+    book.client.release.clear()
+    for update in range(5):
+        first = 101 + update * 5
+        book.on_depth(depth(first, first + 4, first - 1))
+    assert [msg['U'] for msg in book._buffer] == [111, 116, 121]
+    book.client.release.set()
+    wait(lambda: book.synced)
+    assert book.client.calls == 2
+    assert book.last_update_id == 125
+
+
+def test_failed_snapshot_is_retried(book):
+    book = book(ConnectionError('timeout'), ConnectionError('timeout'), 100)
+    book.on_depth(depth(99, 101, 98))
+    wait(lambda: book.synced)
+    assert book.client.calls == 3 and book.last_update_id == 101
+
+
+def test_estimate(book):
+    book = book(100)
+    book.on_depth(depth(99, 101, 98))
+    wait(lambda: book.synced)
+    price, slippage = book.estimate(side='BUY', quantity=2)
+    assert price == pytest.approx(101.5) and slippage == pytest.approx(0.5 / 101)
+    assert book.estimate(side='SELL', quantity=10) == (None, None)
@@ -0,0 +1,107 @@
+from time import perf_counter, sleep
+from binance.exceptions import BinanceAPIException
+from protection import ProtectiveOrders
+from utils import Order
+
+
+class Response:
+
+    def __init__(self, code: int):
+        self.status_code = 400
+        self.code = code
+        self.text = f'{{"code": {code}, "msg": "error"}}'
+
+    def json(self):
+        return {'code': self.code, 'msg': 'error'}
+
+
+class Journal:
+
+    def create(self, **fields):
+        pass
+
+    def update(self, id_, **fields):
+        pass
+
+
+class Client:
+
+    def __init__(self):
+        self.created = []
+
+    def futures_create_order(self, **params):
+        self.created.append(params)
+
+
+class Bus:
+
+    def publish(self, key, value, topic=None):
+        pass
+
+
+class Trader:
+
+    ORDER_STATUS_FILLED, ORDER_STATUS_CANCELED, ORDER_STATUS_EXPIRED, ORDER_STATUS_REJECTED = \
+        'FILLED', 'CANCELED', 'EXPIRED', 'REJECTED'
+
+    def __init__(self, cancel_errors: list):
+        """
+        :param cancel_errors: error codes returned by the next close_order calls, then cancels succeed
+        """
+        self.symbol, self.tracker, self.test, self.time_offset = 'BTCUSDT', 0.01, False, 0
+        self.long, self.short = True, False
+        self.client, self.bus, self.orders = Client(), Bus(), Journal()
+        self.cancel_errors = list(cancel_errors)
+        self.cancelled = []
+        self.amount = 0.5
+
+    def positions(self):
+        return [dict(symbol=self.symbol, positionAmt=str(self.amount), entryPrice='100')]
+
+    def close_order(self, order):
+        self.cancelled.append(order.id)
+        if self.cancel_errors:
+            return {'msg': BinanceAPIException(Response(self.cancel_errors.pop(0)))}
+        return 'closed'
+
+    def build_params(self, order, **kwargs):
+        order.id, order.db = f'stop{len(self.client.created)}', self.orders
+
+    def order_failed(self, order, error):
+        raise AssertionError(error)
+
+
+def wait(condition, timeout: float = 5.0):
+    deadline = perf_counter() + timeout
+    while not condition():
+        assert perf_counter() < deadline, 'condition not met'
+        sleep(0.005)
+
+
+def protected(trader: Trader):
+    protection = ProtectiveOrders(trader=trader, mode=ProtectiveOrders.MODE_TRAILING)
+    protection.RETRY_DELAY = 0.01
+    protection.reconcile()
+    wait(lambda: protection.order is not None and not protection.pending)
+    return protection
+
+
+def test_failed_cancel_is_retried():
+    trader = Trader(cancel_errors=[-1001, -1001])
+    protection = protected(trader)
+    trader.amount = 1.0
+    protection.reconcile()
+    wait(lambda: len(trader.client.created) == 2)
+    assert trader.cancelled == ['stop0'] * 3
+    assert protection.order.id == 'stop1' and not protection.pending
+    assert protection._failures == 0
+
+
+def test_unknown_order_is_replaced_at_once():
+    trader = Trader(cancel_errors=[ProtectiveOrders.UNKNOWN_ORDER])
+    protection = protected(trader)
+    trader.amount = -1.0
+    protection.reconcile()
+    wait(lambda: len(trader.client.created) == 2)
+    assert trader.cancelled == ['stop0']
+    assert trader.client.created[-1]['side'] == 'BUY'
@@ -0,0 +1,55 @@
+from time import time
+from types import SimpleNamespace
+import numpy as np
+from BinanceFuturesBot import BinanceTrader
+
+STEP = 60000
+
+
+def kline(open_time: int):
+    return [open_time, 1.0, 1.0, 1.0, 1.0, 1.0, open_time + STEP - 1]
+
+
+def is_current(candle: int, closed: bool, klines: list):
+    """
+    :param candle: open time of the last snapshot candle
+    :param closed: True if it was closed when the snapshot was taken
+    """
+    candles = np.array([[candle - STEP, 1, 1, 1, 1, 1], [candle, 1, 1, 1, 1, 1]], dtype=float)
+    state = dict(interval='1m', candles=candles, closed=closed)
+    return BinanceTrader.is_current(SimpleNamespace(interval='1m'), state=state, klines=klines)
+
+
+def forming():
+    """
+    :return: open time of the candle forming now
+    """
+    return int(time() * 1000) // STEP * STEP
+
+
+def test_forming_candle_still_forming():
+    now = forming()
+    assert is_current(candle=now, closed=False, klines=[kline(now - STEP), kline(now)])
+
+
+def test_closed_candle_followed_by_forming_one():
+    now = forming()
+    assert is_current(candle=now - STEP, closed=True, klines=[kline(now - STEP), kline(now)])
+
+
+def test_forming_candle_closed_during_downtime():
+    now = forming()
+    assert not is_current(candle=now - STEP, closed=False, klines=[kline(now - STEP), kline(now)])
+
+
+def test_candle_closed_during_downtime_after_closed_snapshot():
+    now = forming()
+    assert not is_current(candle=now - 2 * STEP, closed=True,
+                          klines=[kline(now - 2 * STEP), kline(now - STEP), kline(now)])
+
+
+def test_other_interval_or_no_state():
+    now = forming()
+    assert not BinanceTrader.is_current(SimpleNamespace(interval='5m'), state=None, klines=[kline(now)])
+    state = dict(interval='1m', candles=np.array([[now, 1, 1, 1, 1, 1]], dtype=float), closed=False)
+    assert not BinanceTrader.is_current(SimpleNamespace(interval='5m'), state=state, klines=[kline(now)])
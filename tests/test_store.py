@@ -0,0 +1,111 @@
+from time import time
+import pytest
+from Models import EmptyKlines
+from store import KlineStore
+
+STEP = 60000
+
+
+class KlineClient:
+
+    def __init__(self, first: int, last: int, missing: set = frozenset()):
+        """
+        Exchange with 1m klines opening from first to last except missing open times
+        """
+        self.first, self.last, self.missing = first, last, set(missing)
+        self.requests = []
+        self.failing = False
+
+    def futures_klines(self, symbol: str, interval: str, startTime: int, limit: int, endTime: int = None):
+        self.requests.append((startTime, endTime))
+        if self.failing:
+            raise ConnectionError('timeout')
+        end = self.last if endTime is None else min(endTime, self.last)
+        start = max(startTime, self.first)
+        start += -start % STEP
+        return [[open_time, '1', '2', '0.5', '1.5', '10', open_time + STEP - 1, '15', 3, '5', '7', '0']
+                for open_time in range(start, end + 1, STEP) if open_time not in self.missing][:limit]
+
+
+@pytest.fixture
+def now():
+    return int(time() * 1000) // STEP * STEP
+
+
+def stored_times(store: KlineStore):
+    return [kline[0] for kline in store.history(symbol='BTCUSDT', interval='1m')]
+
+
+def empty_ranges():
+    return [(start, end) for start, end in EmptyKlines.select(EmptyKlines.start, EmptyKlines.end)
+            .order_by(EmptyKlines.start).tuples()]
+
+
+def test_backfill_before_listing_is_requested_once(database, now):
+    client = KlineClient(first=now - 100 * STEP, last=now)
+    store = KlineStore(client=client)
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=50) == 50
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=200) == 51
+    assert stored_times(store)[0] == now - 100 * STEP
+    assert len(empty_ranges()) == 1 and empty_ranges()[0][1] == now - 101 * STEP
+    client.requests.clear()
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=200) == 0
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=150) == 0
+    assert client.requests == []
+
+
+def test_gaps_are_filled(database, now):
+    client = KlineClient(first=now - 100 * STEP, last=now)
+    store = KlineStore(client=client)
+    everything = client.futures_klines(symbol='BTCUSDT', interval='1m', startTime=now - 100 * STEP, limit=1500)
+    store.save(symbol='BTCUSDT', interval='1m', klines=everything[:40] + everything[45:70] + everything[90:])
+    assert store.gaps(symbol='BTCUSDT', interval='1m') == [(now - 60 * STEP, now - 56 * STEP),
+                                                           (now - 30 * STEP, now - 11 * STEP)]
+    client.requests.clear()
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=50) == 25
+    assert client.requests == [(now - 60 * STEP, now - 56 * STEP), (now - 30 * STEP, now - 11 * STEP)]
+    assert store.gaps(symbol='BTCUSDT', interval='1m') == [] and empty_ranges() == []
+    assert stored_times(store) == list(range(now - 100 * STEP, now + 1, STEP))
+
+
+def test_gap_the_exchange_cannot_fill_is_requested_once(database, now):
+    outage = set(range(now - 30 * STEP, now - 20 * STEP, STEP))
+    client = KlineClient(first=now - 100 * STEP, last=now, missing=outage)
+    store = KlineStore(client=client)
+    store.save(symbol='BTCUSDT', interval='1m', klines=client.futures_klines(
+        symbol='BTCUSDT', interval='1m', startTime=now - 100 * STEP, limit=1500))
+    client.requests.clear()
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=50) == 0
+    assert client.requests == [(now - 30 * STEP, now - 21 * STEP)]
+    assert empty_ranges() == [(now - 30 * STEP, now - 21 * STEP)]
+    client.requests.clear()
+    store.sync(symbol='BTCUSDT', interval='1m', history=50)
+    assert client.requests == []
+
+
+def test_known_empty_ranges_trim_requested_range(database, now):
+    client = KlineClient(first=now - 1000 * STEP, last=now)
+    store = KlineStore(client=client)
+    EmptyKlines.insert_many([('BTCUSDT', '1m', now - 100 * STEP, now - 90 * STEP),
+                             ('BTCUSDT', '1m', now - 60 * STEP, now - 50 * STEP)],
+                            fields=[EmptyKlines.symbol, EmptyKlines.interval, EmptyKlines.start,
+                                    EmptyKlines.end]).execute()
+    assert store.unknown(symbol='BTCUSDT', interval='1m', start=now - 95 * STEP, end=now - 55 * STEP) == \
+        (now - 89 * STEP, now - 61 * STEP)
+    assert store.unknown(symbol='BTCUSDT', interval='1m', start=now - 98 * STEP, end=now - 92 * STEP) is None
+    assert store.unknown(symbol='BTCUSDT', interval='5m', start=now - 98 * STEP, end=now - 92 * STEP) == \
+        (now - 98 * STEP, now - 92 * STEP)
+    store.fill(symbol='BTCUSDT', interval='1m', start=now - 95 * STEP, end=now - 55 * STEP)
+    assert client.requests == [(now - 89 * STEP, now - 61 * STEP)]
+
+
+def test_failed_request_records_no_empty_range(database, now):
+    client = KlineClient(first=now - 100 * STEP, last=now)
+    store = KlineStore(client=client)
+    store.sync(symbol='BTCUSDT', interval='1m', history=50)
+    client.failing = True
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=80) == 0
+    assert empty_ranges() == []
+    client.failing = False
+    assert store.sync(symbol='BTCUSDT', interval='1m', history=80) == 30
+    assert empty_ranges() == []
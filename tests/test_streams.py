@@ -0,0 +1,56 @@
+from itertools import count
+from streams import FuturesSocketManager
+
+
+class Connection:
+
+    def __init__(self):
+        self.factory = None
+        self.disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class ListenKeyClient:
+
+    def __init__(self):
+        self.keys = count(1)
+        self.keepalive_fails = False
+
+    def _request_futures_api(self, method: str, path: str):
+        if method == 'put' and self.keepalive_fails:
+            raise ConnectionError('listen key expired')
+        return {'listenKey': f'{next(self.keys):060d}'}
+
+
+class Manager(FuturesSocketManager):
+
+    KEEPALIVE_INTERVAL = 3600
+
+    def start_futures_socket(self, path, callback, prefix='ws/'):
+        self._conns[path] = Connection()
+        return path
+
+
+def test_user_socket_key_survives_keepalive_restart():
+    client = ListenKeyClient()
+    manager = Manager(client=client)
+    key = manager.start_futures_user_socket(callback=print)
+    first = manager._listen_keys['futures']
+    assert key == FuturesSocketManager.USER_SOCKET and first in manager._conns
+    client.keepalive_fails = True
+    manager._keepalive_futures_socket()
+    second = manager._listen_keys['futures']
+    assert second != first and list(manager._conns) == [second]
+    manager.stop_socket(conn_key=key)
+    assert manager._conns == {} and manager._listen_keys['futures'] is None
+    assert manager._timers['futures'] is None
+
+
+def test_close_stops_user_socket():
+    manager = Manager(client=ListenKeyClient())
+    manager.start_futures_user_socket(callback=print)
+    manager.start_futures_kline_socket(symbol='BTCUSDT', interval='1m', callback=print)
+    manager.close()
+    assert manager._conns == {} and manager._timers['futures'] is None
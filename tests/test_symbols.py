@@ -0,0 +1,63 @@
+import pytest
+from symbols import SymbolInfo
+
+
+def symbol_info(tick_size: str = '0.10', step_size: str = '0.001', min_notional: str = '100'):
+    return SymbolInfo(dict(symbol='BTCUSDT', pricePrecision=2, quantityPrecision=3, filters=[
+        dict(filterType='PRICE_FILTER', tickSize=tick_size, minPrice='0.10', maxPrice='1000000'),
+        dict(filterType='LOT_SIZE', stepSize=step_size, minQty='0.001', maxQty='1000'),
+        dict(filterType='MARKET_LOT_SIZE', stepSize=step_size, minQty='0.001', maxQty='120'),
+        dict(filterType='MIN_NOTIONAL', notional=min_notional),
+    ]))
+
+
+@pytest.mark.parametrize('tick_size, price, expected', [
+    ('0.10', 123.456, '123.5'),
+    ('0.10', 123.44, '123.4'),
+    ('0.010', 0.1 + 0.2, '0.30'),
+    ('0.50', 100.74, '100.5'),
+    ('0.50', 100.76, '101.0'),
+    ('1', 20000.6, '20001'),
+])
+def test_price_rounds_to_nearest_tick(tick_size, price, expected):
+    assert symbol_info(tick_size=tick_size).format_price(price) == expected
+
+
+@pytest.mark.parametrize('step_size, quantity, expected', [
+    ('0.001', 0.0019, '0.001'),
+    ('0.001', 1.2345, '1.234'),
+    ('0.1', 0.2999, '0.2'),
+    ('1', 5.9, '5'),
+    ('0.010', 0.029, '0.02'),
+])
+def test_quantity_rounds_down_to_step(step_size, quantity, expected):
+    assert symbol_info(step_size=step_size).format_quantity(quantity) == expected
+
+
+@pytest.mark.parametrize('step_size, quantity, expected', [
+    ('0.1', 0.1 + 0.2, '0.3'),
+    ('0.1', 0.3 - 0.1, '0.2'),
+    ('0.01', 0.29, '0.29'),
+    ('0.001', 0.7 - 0.1 - 0.1, '0.500'),
+])
+def test_quantity_float_error_does_not_lose_a_step(step_size, quantity, expected):
+    # 0.3 - 0.1 is 0.19999999999999998, scaling it to integer steps must not floor it to 0.1
+    assert symbol_info(step_size=step_size).format_quantity(quantity) == expected
+
+
+def test_min_notional():
+    info = symbol_info(min_notional='100')
+    assert info.check(dict(type='LIMIT', quantity='0.010', price='20000')) is None
+    assert 'Notional' in info.check(dict(type='LIMIT', quantity='0.004', price='20000'))
+    assert 'Notional' in info.check(dict(type='MARKET', quantity='0.004'), price=20000)
+    assert info.check(dict(type='MARKET', quantity='0.004')) is None
+    assert info.check(dict(type='MARKET', quantity='0.004', reduceOnly='true'), price=20000) is None
+
+
+def test_quantity_and_price_limits():
+    info = symbol_info()
+    assert 'Quantity' in info.check(dict(type='LIMIT', quantity='0.0005', price='20000'))
+    assert 'Quantity' in info.check(dict(type='MARKET', quantity='500'), price=20000)
+    assert info.check(dict(type='LIMIT', quantity='500', price='20000')) is None
+    assert 'price' in info.check(dict(type='LIMIT', quantity='1', price='0.01'))
+    assert 'stopPrice' in info.check(dict(type='STOP_MARKET', stopPrice='2000000', closePosition='true'))
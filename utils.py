@@ -1,10 +1,11 @@
+import json
 import logging
 import os
 import re
-import pandas as pd
 import decimal
-from plotly import graph_objs as go
-from plotly.offline import plot
+import numpy as np
+from bisect import bisect_left
+from threading import Lock
 
 
 class Order:
@@ -18,7 +19,7 @@ class Order:
         :param long: True if order will change market position to long, False otherwise
         :param short: True if order will change market position to short, False otherwise
         :param time: departure time in UTC
-        :param db: DataBase
+        :param db: OrderJournal
         """
         self.id = id_
         self.params = params
@@ -36,15 +37,70 @@ class Order:
                        failed=self.failed, status=self.status, price=self.price, track_price=self.track_price)
 
     def update(self, **kwargs):
-        self.db.update(kwargs).where(self.db.id == self.id).execute()
+        self.db.update(self.id, **kwargs)
 
     def delete(self):
-        to_del = self.db.get(self.db.id == self.id)
-        to_del.delete_instance()
+        self.db.delete(self.id)
+
+
+class LatencyHistogram:
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        """
+        Thread safe histogram of latencies
+
+        :param buckets: upper bounds of buckets in seconds, sorted ascending
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def percentile(self, q: float):
+        """
+        Estimates percentile as upper bound of the bucket it falls into
+
+        :param q: percentile in range 0..100
+        :return: float seconds, None if nothing observed
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank, seen = q / 100 * self.count, 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return self.max
+
+    def summary(self):
+        if not self.count:
+            return "No orders placed yet"
+        buckets = ", ".join(
+            f"<={bound * 1000:g}ms: {count}" for bound, count in zip(self.buckets, self.counts) if count
+        )
+        if self.counts[-1]:
+            buckets += f", >{self.buckets[-1] * 1000:g}ms: {self.counts[-1]}"
+        return (f"Orders: {self.count} - Avg: {self.sum / self.count * 1000:.1f}ms - "
+                f"P50: {self.percentile(50) * 1000:g}ms - P99: {self.percentile(99) * 1000:g}ms - "
+                f"Max: {self.max * 1000:.1f}ms\n{buckets}")
 
 
 def configure_logging():
     log = logging.getLogger('warns')
+    if log.handlers:
+        return log
     log.setLevel(level='WARNING')
 
     file_path = os.path.join(os.path.dirname(__file__), 'botwarns.log')
@@ -63,6 +119,35 @@ def configure_logging():
     return log
 
 
+class JsonFormatter(logging.Formatter):
+
+    RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        """
+        Formats record as one json object per line, fields passed with extra= are kept as keys
+        """
+        entry = dict(
+            time=self.formatTime(record, datefmt='%Y-%m-%dT%H:%M:%S'),
+            level=record.levelname,
+            logger=record.name,
+            thread=record.threadName,
+            message=record.getMessage(),
+        )
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RECORD_FIELDS})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def enable_json_logs():
+    """
+    Switches handlers of the warnings log to one json object per line
+    """
+    for handler in configure_logging().handlers:
+        handler.setFormatter(JsonFormatter())
+
+
 def get_interval(interval):
     checker = re.compile('^([0-9]{1,2})([mhdwM])$')
     result = re.match(checker, interval)
@@ -70,14 +155,22 @@ def get_interval(interval):
     return int_interval
 
 
+def interval_to_ms(interval):
+    """
+    Converts kline interval to milliseconds, 1M is taken as 30 days
+
+    :param interval: constant from BinanceTrader.KLINE_INTERVALS
+    :rtype: int
+    """
+    amount, unit = get_interval(interval)
+    return amount * {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'M': 2592000}[unit] * 1000
+
+
 def to_dataframe(data):
-    df = pd.DataFrame.from_records(data)
-    df = df.drop(range(5, 12), axis=1)
-    col_names = ['time', 'open', 'high', 'low', 'close']
-    df.columns = col_names
-    for col in col_names:
-        df[col] = df[col].astype(float)
-    df['date'] = pd.to_datetime(df['time'] * 1000000, infer_datetime_format=True)
+    import pandas as pd
+    values = np.asarray([row[:5] for row in data], dtype=np.float64).reshape(-1, 5)
+    df = pd.DataFrame(values, columns=['time', 'open', 'high', 'low', 'close'])
+    df['date'] = pd.to_datetime(df['time'], unit='ms')
     return df
 
 
@@ -88,35 +181,72 @@ def to_string(value, precision):
     return format(new_value, "f")
 
 
-def plot_data(df, symbol, graphs=None):
-    candle = go.Candlestick(
-        x=df['date'],
-        open=df['open'],
-        close=df['close'],
-        high=df['high'],
-        low=df['low'],
-        name="Candlesticks")
-    data = [candle]
-
-    if graphs:
-        for graph in graphs:
-            if graph['dot']:
-                dot = go.Scatter(
-                    x=[i[0] for i in graph['values']],
-                    y=[i[1] for i in graph['values']],
-                    name=graph['name'],
-                    mode='markers',
-                    marker={'color': graph['color'], 'size': 10},
-                )
-                data.append(dot)
-            else:
-                line = go.Scatter(
-                    x=df['date'],
-                    y=graph['values'],
-                    name=graph['name'],
-                    line={'color': graph['color']}
-                )
-                data.append(line)
+def decimate_ohlc(time, open_, high, low, close, width: int):
+    """
+    Merges runs of consecutive candles into at most width buckets of equal length, every bucket keeps
+    time and open of its first candle, highest high, lowest low and close of its last candle
+
+    :param time, open_, high, low, close: np.ndarray of candle values
+    :param width: maximal amount of buckets, about the chart width in pixels
+    :return: tuple(starts, time, open, high, low, close), starts are indexes of the first candle of buckets
+    """
+    return reduce_ohlc(time, open_, high, low, close, step=max(1, -(-len(time) // width)))
+
+
+def reduce_ohlc(time, open_, high, low, close, step: int):
+    """
+    Merges every step consecutive candles into one, the last bucket may hold fewer candles
+
+    :return: tuple(starts, time, open, high, low, close)
+    """
+    size = len(time)
+    starts = np.arange(0, size, step)
+    if step == 1 or not size:
+        return starts, time, open_, high, low, close
+    ends = np.append(starts[1:], size) - 1
+    return (starts, time[starts], open_[starts], np.maximum.reduceat(high, starts), np.minimum.reduceat(low, starts),
+            close[ends])
+
+
+def plot_data(df, symbol, graphs=None, width: int = 2000, include_plotlyjs='directory', auto_open: bool = True):
+    """
+    Writes candlestick chart to symbol.html, candles are decimated to width buckets so big histories
+    stay light. Line graphs are sampled at the last candle of every bucket, dots are drawn as is
+
+    :param df: DataFrame from to_dataframe
+    :param graphs: list(dict(name=str, color=str, dot=bool, values=list), ..), values of a line have one value
+                   per candle, values of dots are (date, price) pairs
+    :param include_plotlyjs: 'directory' writes plotly.min.js once next to the html and references it,
+                             'cdn' loads it from the internet, True inlines it into every file
+    :return: str html file name
+    """
+    from plotly import graph_objs as go
+    from plotly.offline import plot
+    dates = df['date'].to_numpy()
+    starts, _, open_, high, low, close = decimate_ohlc(
+        time=dates, open_=df['open'].to_numpy(dtype=np.float64), high=df['high'].to_numpy(dtype=np.float64),
+        low=df['low'].to_numpy(dtype=np.float64), close=df['close'].to_numpy(dtype=np.float64), width=width,
+    )
+    ends = np.append(starts[1:], len(dates)) - 1
+    data = [go.Candlestick(x=dates[starts], open=open_, close=close, high=high, low=low, name="Candlesticks")]
+
+    for graph in graphs or []:
+        if graph['dot']:
+            values = np.asarray(graph['values'], dtype=object).reshape(-1, 2)
+            data.append(go.Scatter(
+                x=values[:, 0],
+                y=values[:, 1].astype(np.float64),
+                name=graph['name'],
+                mode='markers',
+                marker={'color': graph['color'], 'size': 10},
+            ))
+        else:
+            data.append(go.Scatter(
+                x=dates[starts],
+                y=np.asarray(graph['values'], dtype=np.float64)[ends],
+                name=graph['name'],
+                line={'color': graph['color']}
+            ))
 
     layout = go.Layout(
         title=symbol,
@@ -125,4 +255,124 @@ def plot_data(df, symbol, graphs=None):
     )
 
     fig = go.Figure(data=data, layout=layout)
-    plot(fig, filename=symbol + '.html')
+    return plot(fig, filename=symbol + '.html', include_plotlyjs=include_plotlyjs, auto_open=auto_open)
+
+
+class LiveChart:
+
+    CAPACITY = 1024
+    MAX_CANDLES = 100000
+    PAGE = """<html><head><meta charset="utf-8"><script src="plotly.min.js"></script></head>
+<body style="margin:0"><div id="chart" style="height:100vh"></div><script>
+window.liveChart = function (figure) {{ Plotly.react('chart', figure.data, figure.layout); }};
+function load() {{
+    var script = document.createElement('script');
+    script.src = '{data}?' + Date.now();
+    script.onload = script.onerror = function () {{ script.remove(); }};
+    document.body.appendChild(script);
+}}
+load();
+setInterval(load, {refresh});
+</script></body></html>
+"""
+
+    def __init__(self, symbol: str, width: int = 2000, directory: str = '.', refresh: float = 5.0,
+                 max_candles: int = MAX_CANDLES):
+        """
+        Candlestick chart of a growing kline history for a live dashboard. Candles are kept decimated to
+        at most width buckets, appending only recomputes buckets from the first changed candle. Only the newest
+        max_candles candles are kept, older ones are dropped a whole bucket at a time.
+        write() saves the figure to symbol_live.js, symbol_live.html reloads it every refresh seconds
+        and redraws with Plotly.react, which also works for pages opened from disk
+
+        :param width: maximal amount of buckets
+        :param directory: where html, js and shared plotly.min.js are written
+        :param max_candles: maximal amount of candles kept
+        """
+        self.symbol = symbol
+        self.width = width
+        self.directory = directory
+        self.refresh = refresh
+        self.max_candles = max_candles
+        self.size = 0
+        self.step = 1
+        self.buckets = 0
+        self._start = 0
+        self._rows = np.zeros((5, min(self.CAPACITY, 2 * max_candles)), dtype=np.float64)
+        self._decimated = np.zeros((5, width), dtype=np.float64)
+        self._page_written = False
+
+    def append(self, klines: list):
+        """
+        Adds klines sorted by open time, kline with open time of the last one replaces it
+
+        :param klines: list(list(open_time, open, high, low, close, ..), ..)
+        :return: index of the first bucket that changed
+        """
+        rows = np.asarray([kline[:5] for kline in klines], dtype=np.float64).reshape(-1, 5).T
+        first = self.size
+        if self.size:
+            last = self._start + self.size - 1
+            rows = rows[:, rows[0] >= self._rows[0, last]]
+            if rows.shape[1] and rows[0, 0] == self._rows[0, last]:
+                first = self.size - 1
+        rows = rows[:, -self.max_candles:]
+        dropped = min(first, -(-max(0, first + rows.shape[1] - self.max_candles) // self.step) * self.step)
+        start, first = self._start + dropped, first - dropped
+        size = first + rows.shape[1]
+        if start + size > self._rows.shape[1]:
+            capacity = min(2 * self.max_candles, max(2 * self._rows.shape[1], size))
+            grown = np.zeros((5, capacity), dtype=np.float64) if capacity > self._rows.shape[1] else self._rows
+            grown[:, :first] = self._rows[:, start:start + first]
+            self._rows, start = grown, 0
+        self._rows[:, start + first:start + size] = rows
+        self._start, self.size = start, size
+        if dropped:
+            shift = dropped // self.step
+            self.buckets -= shift
+            self._decimated[:, :self.buckets] = self._decimated[:, shift:shift + self.buckets].copy()
+            if dropped % self.step:
+                first = 0
+        if -(-self.size // self.step) > self.width:
+            while -(-self.size // self.step) > self.width:
+                self.step *= 2
+            first = 0
+        bucket = first // self.step
+        _, *values = reduce_ohlc(*self._rows[:, start + bucket * self.step:start + self.size], step=self.step)
+        self.buckets = bucket + len(values[0])
+        self._decimated[:, bucket:self.buckets] = values
+        return 0 if dropped else bucket
+
+    def figure(self):
+        """
+        :return: dict(data=list, layout=dict) for Plotly.react, times are milliseconds on a date axis
+        """
+        time, open_, high, low, close = self._decimated[:, :self.buckets].tolist()
+        return dict(
+            data=[dict(type='candlestick', x=time, open=open_, high=high, low=low, close=close, name=self.symbol)],
+            layout=dict(title=self.symbol, uirevision=self.symbol,
+                        xaxis={"title": self.symbol, "rangeslider": {"visible": False}, "type": "date"},
+                        yaxis={"fixedrange": False}),
+        )
+
+    def write(self):
+        """
+        Saves figure for the dashboard page, writes the page and plotly.min.js on the first call
+
+        :return: str html file path
+        """
+        page = os.path.join(self.directory, f"{self.symbol}_live.html")
+        if not self._page_written:
+            script = os.path.join(self.directory, 'plotly.min.js')
+            if not os.path.exists(script):
+                from plotly.offline import get_plotlyjs
+                with open(script, 'w', encoding='utf8') as file:
+                    file.write(get_plotlyjs())
+            with open(page, 'w', encoding='utf8') as file:
+                file.write(self.PAGE.format(data=f"{self.symbol}_live.js", refresh=int(self.refresh * 1000)))
+            self._page_written = True
+        path = os.path.join(self.directory, f"{self.symbol}_live.js")
+        with open(f"{path}.tmp", 'w', encoding='utf8') as file:
+            file.write(f"window.liveChart({json.dumps(self.figure())});")
+        os.replace(f"{path}.tmp", path)
+        return page